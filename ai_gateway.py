@@ -0,0 +1,139 @@
+import asyncio
+import atexit
+import json
+import queue
+import threading
+import aiohttp
+from config import Config
+
+class AIGateway:
+    """
+    Runs every OpenRouter call on one asyncio event loop in a daemon
+    thread, over a shared aiohttp session. Request threads hand the loop a
+    coroutine and wait on its future, so upstream network waits are
+    multiplexed on a single thread and connections are pooled instead of
+    each request opening its own.
+    
+    The loop starts on first use, so forked server workers each get their
+    own.
+    """
+    
+    def __init__(self):
+        self._loop = None
+        self._session = None
+        self._lock = threading.Lock()
+    
+    def _start(self):
+        with self._lock:
+            if self._loop is not None:
+                return self._loop
+            
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name='ai-gateway', daemon=True)
+            thread.start()
+            
+            async def open_session():
+                return aiohttp.ClientSession(headers={
+                    "Authorization": f"Bearer {Config.OPENROUTER_API_KEY}",
+                    "Content-Type": "application/json",
+                    "HTTP-Referer": "https://taskboard.example.com",
+                    "X-Title": "TaskBoard"
+                })
+            
+            self._session = asyncio.run_coroutine_threadsafe(open_session(), loop).result()
+            self._loop = loop
+            atexit.register(self.close)
+            return loop
+    
+    def submit(self, coroutine):
+        """Schedule a coroutine on the gateway loop and return its concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self._start())
+    
+    async def _complete(self, messages):
+        payload = {
+            "model": Config.OPENROUTER_MODEL,
+            "messages": messages
+        }
+        timeout = aiohttp.ClientTimeout(total=Config.AI_REQUEST_TIMEOUT, sock_connect=10)
+        
+        async with self._session.post(Config.OPENROUTER_API_URL, json=payload, timeout=timeout) as response:
+            response.raise_for_status()
+            data = await response.json(content_type=None)
+        return data["choices"][0]["message"]["content"].strip()
+    
+    def complete(self, messages):
+        """Text of one (non-streamed) completion"""
+        future = self.submit(self._complete(messages))
+        try:
+            return future.result(timeout=Config.AI_REQUEST_TIMEOUT + 5)
+        finally:
+            future.cancel()
+    
+    async def _stream(self, messages, chunks):
+        payload = {
+            "model": Config.OPENROUTER_MODEL,
+            "messages": messages,
+            "stream": True
+        }
+        timeout = aiohttp.ClientTimeout(sock_connect=10, sock_read=Config.AI_STREAM_IDLE_TIMEOUT)
+        
+        try:
+            async with self._session.post(Config.OPENROUTER_API_URL, json=payload, timeout=timeout) as response:
+                response.raise_for_status()
+                
+                async for raw in response.content:
+                    # Blank lines separate events; lines starting with ':' are keep-alives
+                    line = raw.decode('utf-8').strip()
+                    if not line.startswith('data:'):
+                        continue
+                    data = line[len('data:'):].strip()
+                    if data == '[DONE]':
+                        break
+                    
+                    chunk = json.loads(data)
+                    if 'error' in chunk:
+                        raise RuntimeError(chunk['error'].get('message', 'Upstream error'))
+                    delta = chunk['choices'][0].get('delta', {}).get('content')
+                    if delta:
+                        chunks.put(('delta', delta))
+            chunks.put(('done', None))
+        except Exception as e:
+            chunks.put(('error', e))
+    
+    def stream(self, messages):
+        """
+        Yield the text of a streamed completion piece by piece. Closing the
+        generator cancels the upstream request, so OpenRouter stops
+        generating.
+        """
+        chunks = queue.Queue()
+        future = self.submit(self._stream(messages, chunks))
+        try:
+            while True:
+                try:
+                    kind, value = chunks.get(timeout=Config.AI_STREAM_IDLE_TIMEOUT + 5)
+                except queue.Empty:
+                    raise TimeoutError("AI response stalled")
+                if kind == 'delta':
+                    yield value
+                elif kind == 'error':
+                    raise value
+                else:
+                    return
+        finally:
+            future.cancel()
+    
+    def close(self):
+        """Close the session and stop the loop"""
+        with self._lock:
+            loop, self._loop = self._loop, None
+        if loop is None:
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self._session.close(), loop).result(timeout=5)
+        except Exception as e:
+            print(f"AI gateway close error: {e}")
+        loop.call_soon_threadsafe(loop.stop)
+
+# Global gateway for OpenRouter calls
+ai_gateway = AIGateway()
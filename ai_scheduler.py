@@ -0,0 +1,258 @@
+import hashlib
+import json
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+from config import Config
+
+# Request priorities, most urgent first: validation before a submit, runs
+# of a real task, then practice runs, chat and code generation
+PRIORITY_SUBMIT = 0
+PRIORITY_TASK = 1
+PRIORITY_PRACTICE = 2
+PRIORITY_NAMES = ('submit', 'task', 'practice')
+
+class AIBusy(Exception):
+    """Raised instead of queueing a request the scheduler cannot take now"""
+    
+    def __init__(self, retry_after, per_user=False):
+        super().__init__(f"The AI assistant is busy, please retry in {retry_after} s")
+        self.retry_after = retry_after
+        # True when only this user hit their limit, not the whole service
+        self.per_user = per_user
+
+class Ticket:
+    __slots__ = ('user_key', 'priority', 'queued_at', 'started_at', 'event', 'granted', 'released')
+    
+    def __init__(self, user_key, priority):
+        self.user_key = user_key
+        self.priority = priority
+        self.queued_at = time.monotonic()
+        self.started_at = None
+        self.event = threading.Event()
+        self.granted = False
+        self.released = False
+
+class AIScheduler:
+    """
+    Limits concurrent upstream AI calls to max_concurrent. Requests beyond
+    that wait in per-priority queues; within a priority each user has their
+    own queue and users take turns, so one student clicking Run repeatedly
+    cannot hold up the rest of the class.
+    
+    A request is rejected with AIBusy straight away when its user already
+    has per_user requests pending or the queue is full, and after waiting
+    `wait` seconds without getting a slot. The error carries a retry hint
+    estimated from the queue length and recent call durations.
+    """
+    
+    def __init__(self, max_concurrent=8, max_queue=100, per_user=2, wait=20):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.per_user = per_user
+        self.wait = wait
+        self._lock = threading.Lock()
+        self._queues = [OrderedDict() for _ in PRIORITY_NAMES]
+        self._queued = 0
+        self._active = 0
+        self._pending = {}
+        self._service_time = 5.0
+        self._metrics = [{
+            'requested': 0, 'started': 0, 'rejected': 0, 'timed_out': 0,
+            'wait_total': 0.0, 'wait_max': 0.0
+        } for _ in PRIORITY_NAMES]
+    
+    def _retry_after(self):
+        rounds = (self._queued + 1) / self.max_concurrent
+        return max(1, math.ceil(rounds * self._service_time))
+    
+    def _grant(self, ticket):
+        ticket.started_at = time.monotonic()
+        ticket.granted = True
+        self._active += 1
+        
+        waited = ticket.started_at - ticket.queued_at
+        metrics = self._metrics[ticket.priority]
+        metrics['started'] += 1
+        metrics['wait_total'] += waited
+        metrics['wait_max'] = max(metrics['wait_max'], waited)
+        ticket.event.set()
+    
+    def _dispatch(self):
+        """Hand free slots to the next waiters: highest priority, users in turn"""
+        while self._active < self.max_concurrent and self._queued:
+            for queue in self._queues:
+                if queue:
+                    user_key, tickets = queue.popitem(last=False)
+                    ticket = tickets.popleft()
+                    if tickets:
+                        # Back of the line until every other user had a turn
+                        queue[user_key] = tickets
+                    self._queued -= 1
+                    self._grant(ticket)
+                    break
+    
+    def _forget(self, ticket):
+        count = self._pending[ticket.user_key] - 1
+        if count:
+            self._pending[ticket.user_key] = count
+        else:
+            del self._pending[ticket.user_key]
+    
+    def acquire(self, user_key, priority=PRIORITY_PRACTICE):
+        """Wait for a slot and return its ticket, or raise AIBusy"""
+        ticket = Ticket(user_key, priority)
+        with self._lock:
+            metrics = self._metrics[priority]
+            metrics['requested'] += 1
+            
+            if self._pending.get(user_key, 0) >= self.per_user:
+                metrics['rejected'] += 1
+                raise AIBusy(self._retry_after(), per_user=True)
+            if self._active >= self.max_concurrent and self._queued >= self.max_queue:
+                metrics['rejected'] += 1
+                raise AIBusy(self._retry_after())
+            
+            self._pending[user_key] = self._pending.get(user_key, 0) + 1
+            if self._active < self.max_concurrent and not self._queued:
+                self._grant(ticket)
+                return ticket
+            
+            self._queues[priority].setdefault(user_key, deque()).append(ticket)
+            self._queued += 1
+        
+        if not ticket.event.wait(self.wait):
+            with self._lock:
+                if not ticket.granted:
+                    queue = self._queues[priority]
+                    tickets = queue[user_key]
+                    tickets.remove(ticket)
+                    if not tickets:
+                        del queue[user_key]
+                    self._queued -= 1
+                    self._forget(ticket)
+                    metrics['timed_out'] += 1
+                    raise AIBusy(self._retry_after())
+        return ticket
+    
+    def release(self, ticket):
+        """Free the ticket's slot; releasing twice is harmless"""
+        with self._lock:
+            if not ticket.granted or ticket.released:
+                return
+            ticket.released = True
+            self._active -= 1
+            self._forget(ticket)
+            
+            # Smoothed call duration, for the retry hint
+            elapsed = time.monotonic() - ticket.started_at
+            self._service_time = 0.8 * self._service_time + 0.2 * elapsed
+            self._dispatch()
+    
+    def run(self, user_key, priority, fn):
+        """Call fn() once a slot is free and return its result"""
+        ticket = self.acquire(user_key, priority)
+        try:
+            return fn()
+        finally:
+            self.release(ticket)
+    
+    def stats(self):
+        """Current load and per-priority counters with queue times in milliseconds"""
+        with self._lock:
+            priorities = {}
+            for name, metrics, queue in zip(PRIORITY_NAMES, self._metrics, self._queues):
+                started = metrics['started']
+                priorities[name] = {
+                    'requested': metrics['requested'],
+                    'started': started,
+                    'rejected': metrics['rejected'],
+                    'timed_out': metrics['timed_out'],
+                    'queued': sum(len(tickets) for tickets in queue.values()),
+                    'avg_wait_ms': round(metrics['wait_total'] * 1000 / started, 1) if started else 0,
+                    'max_wait_ms': round(metrics['wait_max'] * 1000, 1)
+                }
+            return {
+                'active': self._active,
+                'queued': self._queued,
+                'max_concurrent': self.max_concurrent,
+                'avg_call_seconds': round(self._service_time, 2),
+                'priorities': priorities
+            }
+
+def fingerprint(messages):
+    """Stable digest of a prompt, for recognising identical requests"""
+    text = json.dumps(messages, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+class SingleFlight:
+    """
+    Shares one call among concurrent identical requests. The first caller
+    with a key runs fn; callers with the same key arriving while it is in
+    flight wait for it and get the same result or exception. Nothing is
+    kept after the call returns, so this is not a cache.
+    
+    An error for which retry_if is true belongs to the leader alone (say,
+    its user's own limit); waiting callers then run again with their own
+    fn instead of receiving it, one of them leading the next call.
+    
+    Keys start with the endpoint name, which the metrics are grouped by.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._metrics = {}
+    
+    def do(self, key, fn, retry_if=None):
+        with self._lock:
+            metrics = self._metrics.setdefault(key[0], {'requests': 0, 'upstream': 0})
+            metrics['requests'] += 1
+        
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = {'event': threading.Event(), 'result': None, 'error': None}
+                    metrics['upstream'] += 1
+            
+            if leader:
+                try:
+                    call['result'] = fn()
+                except Exception as e:
+                    call['error'] = e
+                finally:
+                    with self._lock:
+                        del self._calls[key]
+                    call['event'].set()
+            else:
+                call['event'].wait()
+                if call['error'] is not None and retry_if and retry_if(call['error']):
+                    continue
+            
+            if call['error'] is not None:
+                raise call['error']
+            return call['result']
+    
+    def stats(self):
+        """Requests, upstream calls and the share of requests served by another's call, per endpoint"""
+        with self._lock:
+            return {endpoint: {
+                'requests': metrics['requests'],
+                'upstream': metrics['upstream'],
+                'coalesced': metrics['requests'] - metrics['upstream'],
+                'coalescing_ratio': round(1 - metrics['upstream'] / metrics['requests'], 3)
+            } for endpoint, metrics in self._metrics.items()}
+
+# Global scheduler for OpenRouter calls
+scheduler = AIScheduler(
+    max_concurrent=Config.AI_MAX_CONCURRENT,
+    max_queue=Config.AI_MAX_QUEUE,
+    per_user=Config.AI_MAX_PENDING_PER_USER,
+    wait=Config.AI_QUEUE_TIMEOUT
+)
+
+# Identical OpenRouter requests in flight at the same time
+single_flight = SingleFlight()
@@ -2,6 +2,8 @@ from flask import Flask, render_template, session, redirect, url_for
 from routes import *
 from config import Config
 from models import Teacher, initialize_default_data
+from retention import start_retention_scheduler
+from drafts import start_draft_flusher
 
 app = Flask(__name__)
 app.config.from_object(Config)
@@ -47,8 +49,17 @@ app.add_url_rule('/student/practice', 'practice_editor', practice_editor)
 
 # New OpenRouter AI Integration Routes
 app.add_url_rule('/simulate_run', 'simulate_code_execution', simulate_code_execution, methods=['POST'])
+app.add_url_rule('/validate_code', 'validate_code', validate_code, methods=['POST'])
 app.add_url_rule('/generate_code', 'generate_code', generate_code, methods=['POST'])
+app.add_url_rule('/generate_code/stream', 'generate_code_stream', generate_code_stream, methods=['POST'])
 app.add_url_rule('/ai_chat', 'ai_chat', ai_chat, methods=['POST'])
+app.add_url_rule('/ai_chat/stream', 'ai_chat_stream', ai_chat_stream, methods=['POST'])
+app.add_url_rule('/submit_task', 'submit_task', submit_task, methods=['POST'])
+app.add_url_rule('/drafts', 'save_draft', save_draft, methods=['POST'])
+app.add_url_rule('/search', 'search_index', search_index)
+app.add_url_rule('/submission/<task_id>/<student_id>/attempts', 'submission_attempts', submission_attempts)
+app.add_url_rule('/submission/<task_id>/<student_id>/attempts/<int:version>', 'submission_attempt', submission_attempt)
+app.add_url_rule('/admin/ai/metrics', 'ai_metrics', ai_metrics)
 
 # Notification Routes
 app.add_url_rule('/notifications', 'get_notifications', get_notifications, methods=['GET'])
@@ -136,6 +147,10 @@ def init_app():
         print("   - Admin account created (admin/admin123)")
         print("   - Default campuses initialized")
         print("   - Default grades initialized")
+        
+        if start_retention_scheduler():
+            print(f"   - Notification retention every {Config.NOTIFICATION_RETENTION_INTERVAL_HOURS}h")
+        start_draft_flusher()
     except Exception as e:
         print(f"❌ Error initializing application: {e}")
 
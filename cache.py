@@ -0,0 +1,130 @@
+import threading
+import time
+from contextlib import contextmanager
+from flask import g, has_app_context
+from config import Config
+from database import db
+
+class ReadThroughCache:
+    """
+    Process-wide cache for slow-changing data. Each named entry is loaded
+    on first use and kept for ttl seconds. Invalidation bumps a version row
+    in the database; other workers poll the version table at most every
+    version_check seconds and drop entries whose version moved.
+    
+    A name can hold several keyed values (one per roster, say); they all
+    share the name's version and are invalidated together.
+    """
+    table_name = 'cache_versions'
+    
+    def __init__(self, ttl=300, version_check=5):
+        self.ttl = ttl
+        self.version_check = version_check
+        self._entries = {}
+        self._versions = {}
+        self._checked_at = 0
+        self._lock = threading.Lock()
+        self._pending = threading.local()
+    
+    def create_table(self):
+        query = f"""
+        CREATE TABLE IF NOT EXISTS {self.table_name} (
+            name VARCHAR(64) PRIMARY KEY,
+            version BIGINT NOT NULL DEFAULT 0
+        )
+        """
+        db.execute_query(query)
+    
+    def _sync_versions(self):
+        """Drop entries another worker invalidated since the last check"""
+        now = time.monotonic()
+        if now - self._checked_at < self.version_check:
+            return
+        self._checked_at = now
+        
+        try:
+            rows = db.execute_query(f"SELECT name, version FROM {self.table_name}")
+        except Exception as e:
+            print(f"Cache version check error: {e}")
+            return
+        
+        with self._lock:
+            for row in rows:
+                if self._versions.get(row['name']) != row['version']:
+                    self._versions[row['name']] = row['version']
+                    self._entries.pop(row['name'], None)
+    
+    def get(self, name, loader, key=None):
+        """Cached value for name (and key), calling loader() on a miss or expiry"""
+        self._sync_versions()
+        
+        entry = self._entries.get(name, {}).get(key)
+        if entry and entry[0] > time.monotonic():
+            return entry[1]
+        
+        value = loader()
+        with self._lock:
+            self._entries.setdefault(name, {})[key] = (time.monotonic() + self.ttl, value)
+        return value
+    
+    def invalidate(self, *names):
+        """Drop names here and bump their versions for the other workers"""
+        with self._lock:
+            for name in names:
+                self._entries.pop(name, None)
+        forget_request(*names)
+        
+        pending = getattr(self._pending, 'names', None)
+        if pending is not None:
+            # Inside batch(): bump the versions once when it exits
+            pending.update(names)
+            return
+        self._bump(names)
+    
+    def _bump(self, names):
+        query = f"""
+        INSERT INTO {self.table_name} (name, version) VALUES (%s, 1)
+        ON DUPLICATE KEY UPDATE version = version + 1
+        """
+        try:
+            db.execute_many(query, [(name,) for name in names])
+        except Exception as e:
+            print(f"Cache invalidation error: {e}")
+    
+    @contextmanager
+    def batch(self):
+        """Collapse the version bumps of many writes (a bulk import) into one"""
+        if getattr(self._pending, 'names', None) is not None:
+            yield
+            return
+        
+        self._pending.names = set()
+        try:
+            yield
+        finally:
+            names, self._pending.names = self._pending.names, None
+            if names:
+                self._bump(sorted(names))
+
+def memoize_request(name, loader, key=None):
+    """
+    Per-request memo on flask.g in front of loader, so one request never
+    loads the same (name, key) twice. Outside a request it just calls loader.
+    """
+    if not has_app_context():
+        return loader()
+    
+    memo = g.setdefault('_cache_memo', {}).setdefault(name, {})
+    if key not in memo:
+        memo[key] = loader()
+    return memo[key]
+
+def forget_request(*names):
+    """Drop names from the current request's memo after a write"""
+    if has_app_context() and '_cache_memo' in g:
+        for name in names:
+            g._cache_memo.pop(name, None)
+
+# Global cache instances: reference data, and short-lived rosters
+cache = ReadThroughCache(ttl=Config.CACHE_TTL_SECONDS, version_check=Config.CACHE_VERSION_CHECK_SECONDS)
+roster_cache = ReadThroughCache(ttl=Config.ROSTER_CACHE_TTL_SECONDS, version_check=Config.CACHE_VERSION_CHECK_SECONDS)
@@ -9,6 +9,8 @@ class Config:
     MYSQL_USER = os.environ.get('MYSQL_USER') or 'studentkos'
     MYSQL_PASSWORD = os.environ.get('MYSQL_PASSWORD') or 'Krishna@532'
     MYSQL_DB = os.environ.get('MYSQL_DB') or 'studentkos$default'
+    # Idle MySQL connections kept open for reuse by request and timer threads
+    MYSQL_POOL_SIZE = int(os.environ.get('MYSQL_POOL_SIZE') or 5)
     
     JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY') or 'jwt-secret-key-change-in-production'
     JWT_ACCESS_TOKEN_EXPIRES = timedelta(hours=24)
@@ -18,3 +20,60 @@ class Config:
     OPENROUTER_MODEL = os.environ.get('OPENROUTER_MODEL') or 'openai/gpt-4o'
 
     OPENROUTER_API_URL = "https://openrouter.ai/api/v1/chat/completions"
+    # Seconds a streamed AI response may go without sending anything
+    AI_STREAM_IDLE_TIMEOUT = int(os.environ.get('AI_STREAM_IDLE_TIMEOUT') or 60)
+    # Seconds to wait for a whole (non-streamed) AI response
+    AI_REQUEST_TIMEOUT = int(os.environ.get('AI_REQUEST_TIMEOUT') or 90)
+    # AI request scheduler: concurrent upstream calls, waiting requests,
+    # requests one user may have pending, and seconds a request may wait
+    AI_MAX_CONCURRENT = int(os.environ.get('AI_MAX_CONCURRENT') or 8)
+    AI_MAX_QUEUE = int(os.environ.get('AI_MAX_QUEUE') or 100)
+    AI_MAX_PENDING_PER_USER = int(os.environ.get('AI_MAX_PENDING_PER_USER') or 2)
+    AI_QUEUE_TIMEOUT = int(os.environ.get('AI_QUEUE_TIMEOUT') or 20)
+    # Estimated token budgets of an AI chat prompt: recent turns, and the
+    # condensed summary of older ones (the system prompt and task are extra)
+    AI_CHAT_HISTORY_TOKENS = int(os.environ.get('AI_CHAT_HISTORY_TOKENS') or 2000)
+    AI_CHAT_SUMMARY_TOKENS = int(os.environ.get('AI_CHAT_SUMMARY_TOKENS') or 400)
+    
+    # Notification retention: days to keep each notification type in the
+    # hot table; types not listed use the default
+    NOTIFICATION_RETENTION_DAYS = {
+        'student': 30,
+        'teacher': 30,
+        'task': 90,
+        'submission': 60,
+    }
+    NOTIFICATION_RETENTION_DEFAULT_DAYS = int(os.environ.get('NOTIFICATION_RETENTION_DEFAULT_DAYS') or 90)
+    NOTIFICATION_RETENTION_BATCH_SIZE = 1000
+    # Copy expired rows to notifications_archive before deleting them
+    NOTIFICATION_ARCHIVE_TABLE = True
+    # Directory for gzipped JSONL exports of expired rows (disabled when unset)
+    NOTIFICATION_ARCHIVE_DIR = os.environ.get('NOTIFICATION_ARCHIVE_DIR')
+    # Run retention in a background thread every N hours (0 disables)
+    NOTIFICATION_RETENTION_INTERVAL_HOURS = float(os.environ.get('NOTIFICATION_RETENTION_INTERVAL_HOURS') or 0)
+    
+    # Repeated notifications with the same type, title and audience within
+    # this many seconds are merged into one row (0 disables merging)
+    NOTIFICATION_DIGEST_WINDOW_SECONDS = int(os.environ.get('NOTIFICATION_DIGEST_WINDOW_SECONDS') or 300)
+    
+    # Read-through cache for campuses, grades and the task catalog. Workers
+    # re-check the cache_versions table at most every CACHE_VERSION_CHECK_SECONDS
+    CACHE_TTL_SECONDS = int(os.environ.get('CACHE_TTL_SECONDS') or 300)
+    CACHE_VERSION_CHECK_SECONDS = int(os.environ.get('CACHE_VERSION_CHECK_SECONDS') or 5)
+    # Shared lifetime of cached student rosters and roster counts
+    ROSTER_CACHE_TTL_SECONDS = int(os.environ.get('ROSTER_CACHE_TTL_SECONDS') or 30)
+    
+    # Submission attempts are stored as diffs with a full snapshot every N versions
+    SUBMISSION_SNAPSHOT_INTERVAL = int(os.environ.get('SUBMISSION_SNAPSHOT_INTERVAL') or 10)
+    
+    # Editor autosaves are coalesced in memory and written at most once per
+    # draft every DRAFT_FLUSH_SECONDS
+    DRAFT_FLUSH_SECONDS = int(os.environ.get('DRAFT_FLUSH_SECONDS') or 15)
+    
+    # Similarity reports list submission pairs whose estimated Jaccard
+    # similarity reaches the threshold; shorter programs are not compared
+    SIMILARITY_THRESHOLD = float(os.environ.get('SIMILARITY_THRESHOLD') or 0.6)
+    SIMILARITY_MIN_TOKENS = int(os.environ.get('SIMILARITY_MIN_TOKENS') or 20)
+    
+    # Most index terms one search word expands to as a prefix
+    SEARCH_PREFIX_EXPANSIONS = int(os.environ.get('SEARCH_PREFIX_EXPANSIONS') or 20)
@@ -0,0 +1,57 @@
+# Token-budgeted prompts for AI chat sessions. The system prompt and task
+# context are always sent; recent turns fill the history budget newest
+# first, and turns that no longer fit are folded into a short running
+# summary, so a prompt stays about the same size however long a session runs.
+
+# Rough token estimate: about four characters per token plus a small
+# per-message overhead, close enough for budgeting without a tokenizer
+CHARS_PER_TOKEN = 4
+MESSAGE_OVERHEAD = 4
+
+# Characters kept of each turn when it is folded into the summary
+SUMMARY_TURN_CHARS = 240
+
+def estimate_tokens(text):
+    return MESSAGE_OVERHEAD + (len(text or '') + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+def clip(text, limit):
+    text = ' '.join((text or '').split())
+    return text if len(text) <= limit else text[:limit - 1] + '…'
+
+def split_window(history, budget):
+    """
+    Split history (oldest first, dicts with role and content) into turns
+    to fold away and the newest turns that fit in budget tokens. The
+    latest turn is always kept, even when it alone exceeds the budget.
+    """
+    used = 0
+    start = len(history)
+    while start > 0:
+        cost = estimate_tokens(history[start - 1]['content'])
+        if start < len(history) and used + cost > budget:
+            break
+        used += cost
+        start -= 1
+    return history[:start], history[start:]
+
+def summarize(summary, turns, budget):
+    """
+    Running summary with turns appended as clipped one-line notes; the
+    oldest notes are dropped once it no longer fits in budget tokens
+    """
+    lines = (summary or '').splitlines()
+    lines.extend(f"{turn['role'].title()}: {clip(turn['content'], SUMMARY_TURN_CHARS)}" for turn in turns)
+    while lines and estimate_tokens('\n'.join(lines)) > budget:
+        lines.pop(0)
+    return '\n'.join(lines)
+
+def build_messages(system_prompt, task_context, summary, recent):
+    """Chat messages with the pinned context in one leading system message"""
+    sections = [system_prompt.strip()]
+    if task_context:
+        sections.append(f"Current task:\n{task_context}")
+    if summary:
+        sections.append(f"Earlier in this conversation (condensed):\n{summary}")
+    messages = [{'role': 'system', 'content': '\n\n'.join(sections)}]
+    messages.extend({'role': turn['role'], 'content': turn['content']} for turn in recent)
+    return messages
@@ -1,26 +1,65 @@
 import pymysql
+from pymysql.constants import CLIENT
 from config import Config
+from contextlib import contextmanager
+import threading
 import time
 
 class Database:
-    def __init__(self):
-        self.connection = None
-        self.connect_with_retry()
+    """
+    Connections come from a small pool. A statement borrows one and hands
+    it back when done; a transaction keeps its connection for the thread
+    until it ends. Request threads, the background timers and streaming
+    responses therefore never share a session, so a transaction only ever
+    contains its own thread's statements, and short-lived request threads
+    reuse open connections instead of connecting each time.
+    """
+    
+    def __init__(self, pool_size=Config.MYSQL_POOL_SIZE):
+        self._local = threading.local()
+        self._announced = False
+        self.pool_size = pool_size
+        self._idle = []
+        self._pool_lock = threading.Lock()
+        self._checkin(self.connect_with_retry())
+    
+    @property
+    def connection(self):
+        """The connection this thread is using right now, if any"""
+        return getattr(self._local, 'connection', None)
+    
+    @connection.setter
+    def connection(self, connection):
+        self._local.connection = connection
+    
+    @property
+    def in_transaction(self):
+        return getattr(self._local, 'in_transaction', False)
+    
+    @in_transaction.setter
+    def in_transaction(self, value):
+        self._local.in_transaction = value
     
     def connect_with_retry(self, max_retries=3, retry_delay=2):
+        """Open a new connection and return it"""
         for attempt in range(max_retries):
             try:
-                self.connection = pymysql.connect(
+                connection = pymysql.connect(
                     host=Config.MYSQL_HOST,
                     user=Config.MYSQL_USER,
                     password=Config.MYSQL_PASSWORD,
                     database=Config.MYSQL_DB,
                     cursorclass=pymysql.cursors.DictCursor,
                     autocommit=True,
-                    connect_timeout=10
+                    connect_timeout=10,
+                    # Lets a write and its follow-up go in one round trip
+                    client_flag=CLIENT.MULTI_STATEMENTS
                 )
-                print("✅ Successfully connected to MySQL database!")
-                return
+                if not self._announced:
+                    # Threads connect on first use; report the first one only
+                    print("✅ Successfully connected to MySQL database!")
+                    self._announced = True
+                return connection
                 
             except pymysql.err.OperationalError as e:
                 error_code = e.args[0]
@@ -89,37 +128,153 @@ class Database:
             print(f"❌ Error creating database: {e}")
             raise
     
-    def get_connection(self):
-        if self.connection and self.connection.open:
-            return self.connection
-        else:
-            self.connect_with_retry()
-            return self.connection
+    def _checkout(self):
+        """An open idle connection from the pool, or a new one"""
+        while True:
+            with self._pool_lock:
+                connection = self._idle.pop() if self._idle else None
+            if connection is None:
+                return self.connect_with_retry()
+            if connection.open:
+                return connection
     
-    def execute_query(self, query, params=None):
+    def _checkin(self, connection):
+        """Keep a connection for reuse, or close it when the pool is full"""
+        if not connection.open:
+            return
+        with self._pool_lock:
+            if len(self._idle) < self.pool_size:
+                self._idle.append(connection)
+                return
+        connection.close()
+    
+    @contextmanager
+    def get_connection(self):
+        """
+        The thread's connection: the one its transaction holds, otherwise
+        one borrowed from the pool for the duration of the block
+        """
+        if self.connection:
+            yield self.connection
+            return
+        
+        self.connection = self._checkout()
         try:
-            with self.get_connection().cursor() as cursor:
-                cursor.execute(query, params)
-                if query.strip().upper().startswith('SELECT'):
-                    return cursor.fetchall()
-                else:
-                    self.connection.commit()
-                    return cursor.lastrowid
-        except Exception as e:
-            print(f"Query error: {e}")
+            yield self.connection
+        finally:
+            connection, self.connection = self.connection, None
+            self._checkin(connection)
+    
+    def _commit(self):
+        # Inside transaction() the block commits once at the end
+        if not self.in_transaction:
+            self.connection.commit()
+    
+    def _rollback(self):
+        if not self.in_transaction:
             self.connection.rollback()
-            raise
+    
+    @contextmanager
+    def transaction(self):
+        """
+        Run the statements in the block as one transaction: committed
+        together when it exits, rolled back on an exception. Nested blocks
+        join the outer transaction.
+        """
+        if self.in_transaction:
+            yield
+            return
+        
+        with self.get_connection() as connection:
+            connection.begin()
+            self.in_transaction = True
+            try:
+                yield
+                connection.commit()
+            except Exception:
+                connection.rollback()
+                raise
+            finally:
+                self.in_transaction = False
+    
+    def execute_query(self, query, params=None):
+        with self.get_connection() as connection:
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute(query, params)
+                    if query.strip().upper().startswith('SELECT'):
+                        return cursor.fetchall()
+                    else:
+                        self._commit()
+                        return cursor.lastrowid
+            except Exception as e:
+                print(f"Query error: {e}")
+                self._rollback()
+                raise
+    
+    def execute_update(self, query, params=None):
+        """
+        Run a write statement and return the number of affected rows. With
+        several statements separated by ';' the count is the first one's.
+        """
+        with self.get_connection() as connection:
+            try:
+                with connection.cursor() as cursor:
+                    affected = cursor.execute(query, params)
+                    self._commit()
+                    return affected
+            except Exception as e:
+                print(f"Query error: {e}")
+                self._rollback()
+                raise
+    
+    def index_exists(self, table, index_name):
+        query = """
+        SELECT COUNT(*) AS count FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+        """
+        result = self.execute_query(query, (table, index_name))
+        return bool(result and result[0]['count'])
+    
+    def ensure_index(self, table, index_name, columns, unique=False):
+        """Create an index unless one with this name already exists"""
+        if not self.index_exists(table, index_name):
+            kind = "UNIQUE INDEX" if unique else "INDEX"
+            self.execute_query(f"CREATE {kind} {index_name} ON {table} ({columns})")
+    
+    def ensure_column(self, table, column, definition):
+        """Add a column unless the table already has it; True when it was added"""
+        query = """
+        SELECT COUNT(*) AS count FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+        """
+        result = self.execute_query(query, (table, column))
+        if result and result[0]['count'] == 0:
+            self.execute_query(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+            return True
+        return False
+    
+    def ensure_column_type(self, table, column, definition):
+        """Change a column to definition unless its type already matches"""
+        query = """
+        SELECT column_type FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+        """
+        result = self.execute_query(query, (table, column))
+        if result and result[0]['column_type'].lower() != definition.split()[0].lower():
+            self.execute_query(f"ALTER TABLE {table} MODIFY COLUMN {column} {definition}")
     
     def execute_many(self, query, params_list):
-        try:
-            with self.get_connection().cursor() as cursor:
-                cursor.executemany(query, params_list)
-                self.connection.commit()
-                return cursor.rowcount
-        except Exception as e:
-            print(f"Query error: {e}")
-            self.connection.rollback()
-            raise
+        with self.get_connection() as connection:
+            try:
+                with connection.cursor() as cursor:
+                    cursor.executemany(query, params_list)
+                    self._commit()
+                    return cursor.rowcount
+            except Exception as e:
+                print(f"Query error: {e}")
+                self._rollback()
+                raise
 
 # Global database instance
 db = Database()
\ No newline at end of file
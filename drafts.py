@@ -0,0 +1,151 @@
+import atexit
+import threading
+import time
+from config import Config
+from models import Draft
+
+class DraftBuffer:
+    """
+    Coalesces web editor autosaves. Each save carries the client's sequence
+    number and either the full text or one splice against the version the
+    client last saved. The newest text per (student, task) is kept here and
+    written at most once per window; saves in between only replace it, so a
+    lab of students typing costs one batched write per window.
+    
+    Sequence numbers make saves last-write-wins: an older or repeated save
+    is ignored, and a splice against a version this worker does not hold is
+    answered with 'resync' so the client sends its full text instead.
+    """
+    
+    def __init__(self, window=15):
+        self.window = window
+        self._drafts = {}
+        self._lock = threading.Lock()
+    
+    def _entry(self, key):
+        entry = self._drafts.get(key)
+        if entry is None:
+            row = Draft.find(*key)
+            entry = {
+                'code': row['code'] if row else '',
+                'seq': row['seq'] if row else 0,
+                'dirty': False,
+                'savedAt': time.monotonic()
+            }
+            with self._lock:
+                entry = self._drafts.setdefault(key, entry)
+        return entry
+    
+    def get(self, student_id, task_id):
+        """
+        Current draft as {'code', 'seq'}, or None when there is none. The
+        database is the source: another worker may have flushed a newer
+        draft, so this worker's buffered text is written first and its
+        entry dropped, to be reloaded on the next save.
+        """
+        key = (student_id, task_id)
+        self.flush([key])
+        with self._lock:
+            entry = self._drafts.get(key)
+            if entry and not entry['dirty']:
+                del self._drafts[key]
+        
+        row = Draft.find(student_id, task_id)
+        if not row:
+            return None
+        return {'code': row['code'], 'seq': row['seq']}
+    
+    def save(self, student_id, task_id, seq, code=None, base_seq=None, splice=None):
+        """
+        Apply a save. splice is (start, end, text, length): replace
+        characters start:end of version base_seq with text, giving a draft
+        of length characters. Returns (status, current seq) with status
+        'success', 'stale' or 'resync'.
+        """
+        key = (student_id, task_id)
+        entry = self._entry(key)
+        
+        with self._lock:
+            if seq <= entry['seq']:
+                return 'stale', entry['seq']
+            
+            if code is None:
+                start, end, text, length = splice
+                if base_seq != entry['seq'] or not 0 <= start <= end <= len(entry['code']):
+                    return 'resync', entry['seq']
+                code = entry['code'][:start] + text + entry['code'][end:]
+                if len(code) != length:
+                    return 'resync', entry['seq']
+            
+            entry['code'] = code
+            entry['seq'] = seq
+            entry['dirty'] = True
+            due = time.monotonic() - entry['savedAt'] >= self.window
+        
+        if due:
+            self.flush([key])
+        return 'success', seq
+    
+    def flush(self, keys=None):
+        """Write dirty drafts (all of them by default) in one batch"""
+        now = time.monotonic()
+        with self._lock:
+            keys = list(self._drafts) if keys is None else keys
+            pending = []
+            for key in keys:
+                entry = self._drafts.get(key)
+                if entry and entry['dirty']:
+                    entry['dirty'] = False
+                    entry['savedAt'] = now
+                    try:
+                        entry['code'].encode('utf-8')
+                    except (AttributeError, UnicodeError) as e:
+                        # Cannot be stored; dropped so it does not fail the whole batch
+                        print(f"Draft flush skipped {key}: {e}")
+                        del self._drafts[key]
+                        continue
+                    pending.append((key, entry['code'], entry['seq']))
+            
+            # Forget drafts that have been idle for a while
+            for key, entry in list(self._drafts.items()):
+                if not entry['dirty'] and now - entry['savedAt'] > 10 * self.window:
+                    del self._drafts[key]
+        
+        if not pending:
+            return 0
+        
+        try:
+            Draft.save_many([(student_id, task_id, code, seq) for (student_id, task_id), code, seq in pending])
+        except Exception as e:
+            print(f"Draft flush error: {e}")
+            with self._lock:
+                for key, _, seq in pending:
+                    entry = self._drafts.get(key)
+                    if entry and entry['seq'] == seq:
+                        entry['dirty'] = True
+            return 0
+        return len(pending)
+    
+    def discard(self, student_id, task_id):
+        """Drop the draft once the task is submitted"""
+        with self._lock:
+            self._drafts.pop((student_id, task_id), None)
+        Draft.delete(student_id, task_id)
+
+def start_draft_flusher():
+    """Flush buffered drafts in a daemon thread every window, and at exit"""
+    def run():
+        drafts.flush()
+        schedule()
+    
+    def schedule():
+        timer = threading.Timer(drafts.window, run)
+        timer.daemon = True
+        timer.start()
+        return timer
+    
+    atexit.register(drafts.flush)
+    return schedule()
+
+# Global draft buffer
+drafts = DraftBuffer(window=Config.DRAFT_FLUSH_SECONDS)
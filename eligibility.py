@@ -0,0 +1,101 @@
+import json
+import numpy as np
+
+def parse_targets(value):
+    """campusTarget/gradeTarget column value as a list"""
+    if isinstance(value, str):
+        return json.loads(value)
+    return value or []
+
+class TaskEligibilityIndex:
+    """
+    In-memory index of which (campus, grade) pairs each task targets.
+    Every pair gets a bit position and each task's target set is stored as
+    a packed bitmask row, so eligibility lookups and student-task pair
+    counts are array operations instead of per-task JSON parsing.
+    Build a new index whenever the task catalog changes.
+    """
+    
+    def __init__(self, tasks, campuses=(), grades=()):
+        self.tasks = list(tasks)
+        self.positions = {task['id']: i for i, task in enumerate(self.tasks)}
+        targets = [(parse_targets(task['campusTarget']), parse_targets(task['gradeTarget'])) for task in self.tasks]
+        
+        # Known names first so the layout is stable, then any stray target values
+        self.campuses = list(dict.fromkeys(list(campuses) + [c for campus_target, _ in targets for c in campus_target]))
+        self.grades = list(dict.fromkeys(list(grades) + [g for _, grade_target in targets for g in grade_target]))
+        self.campus_pos = {campus: i for i, campus in enumerate(self.campuses)}
+        self.grade_pos = {grade: i for i, grade in enumerate(self.grades)}
+        self.pair_count = len(self.campuses) * len(self.grades)
+        
+        bits = np.zeros((len(self.tasks), self.pair_count), dtype=bool)
+        for row, (campus_target, grade_target) in enumerate(targets):
+            for campus in campus_target:
+                for grade in grade_target:
+                    bits[row, self.bit(campus, grade)] = True
+        self.masks = np.packbits(bits, axis=1)
+        
+        # Per-task campus and grade membership, folded from the pair bits once
+        pairs = bits.reshape(len(self.tasks), len(self.campuses), len(self.grades))
+        self.by_campus = pairs.any(axis=2)
+        self.by_grade = pairs.any(axis=1)
+    
+    def bit(self, campus, grade):
+        """Bit position of a (campus, grade) pair, or None when unknown"""
+        if campus not in self.campus_pos or grade not in self.grade_pos:
+            return None
+        return self.campus_pos[campus] * len(self.grades) + self.grade_pos[grade]
+    
+    def matching(self, campus=None, grade=None):
+        """
+        Boolean array over the catalog marking tasks that target the given
+        campus and/or grade; combine several with & and |.
+        """
+        if not self.tasks:
+            return np.zeros(0, dtype=bool)
+        if campus is not None and grade is not None:
+            position = self.bit(campus, grade)
+            if position is None:
+                return np.zeros(len(self.tasks), dtype=bool)
+            return (self.masks[:, position // 8] & (0x80 >> (position % 8))) != 0
+        if campus is not None:
+            if campus not in self.campus_pos:
+                return np.zeros(len(self.tasks), dtype=bool)
+            return self.by_campus[:, self.campus_pos[campus]]
+        if grade is not None:
+            if grade not in self.grade_pos:
+                return np.zeros(len(self.tasks), dtype=bool)
+            return self.by_grade[:, self.grade_pos[grade]]
+        return np.ones(len(self.tasks), dtype=bool)
+    
+    def get(self, task_id):
+        """Copy of one catalog task, or None"""
+        position = self.positions.get(task_id)
+        return dict(self.tasks[position]) if position is not None else None
+    
+    def tasks_for(self, campus=None, grade=None):
+        """Copies of the tasks targeting the given campus and/or grade, catalog order"""
+        return [dict(self.tasks[i]) for i in np.flatnonzero(self.matching(campus, grade))]
+    
+    def count_for(self, campus=None, grade=None):
+        return int(self.matching(campus, grade).sum())
+    
+    def student_vector(self, student_counts):
+        """Per-pair student counts from a {(campus, grade): count} mapping"""
+        vector = np.zeros(self.pair_count, dtype=np.int64)
+        for (campus, grade), count in student_counts.items():
+            position = self.bit(campus, grade)
+            if position is not None:
+                vector[position] += count
+        return vector
+    
+    def students_per_task(self, student_counts):
+        """Eligible students for every task, in catalog order"""
+        if not self.tasks:
+            return np.zeros(0, dtype=np.int64)
+        bits = np.unpackbits(self.masks, axis=1, count=self.pair_count)
+        return bits.astype(np.int64) @ self.student_vector(student_counts)
+    
+    def eligible_pairs(self, student_counts, campus=None, grade=None):
+        """Number of eligible student-task pairs, optionally for a subset of tasks"""
+        return int(self.students_per_task(student_counts)[self.matching(campus, grade)].sum())
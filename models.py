@@ -1,7 +1,62 @@
-from datetime import datetime
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from cache import cache, roster_cache, memoize_request
+from config import Config
 from database import db
+from eligibility import TaskEligibilityIndex
+import search
+import similarity
+import base64
 import bcrypt
+import difflib
+import hashlib
+import json
+import threading
 import uuid
+import zlib
+
+class Row:
+    """
+    Lightweight read-only row for large result sets. Subclasses list their
+    columns in __slots__, so rows carry no per-instance dict. Both
+    row.column and row['column'] work, like the dict rows used elsewhere.
+    """
+    __slots__ = ()
+    
+    def __init__(self, **values):
+        for name in self.__slots__:
+            setattr(self, name, values.get(name))
+    
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+    
+    def __contains__(self, key):
+        return key in self.__slots__
+    
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+    
+    def keys(self):
+        return self.__slots__
+    
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+    
+    @classmethod
+    def from_rows(cls, rows):
+        return [cls(**row) for row in rows]
+
+class StudentSummary(Row):
+    __slots__ = ('id', 'studentID', 'name', 'campus', 'grade', 'section', 'createdAt')
+
+class TeacherSummary(Row):
+    __slots__ = ('id', 'teacherID', 'name', 'email', 'campus', 'can_manage_students', 'can_manage_tasks', 'createdAt')
+
+class SubmissionSummary(Row):
+    __slots__ = ('id', 'studentId', 'taskId', 'status', 'submittedAt')
 
 class BaseModel:
     @staticmethod
@@ -11,10 +66,141 @@ class BaseModel:
     @staticmethod
     def format_datetime(dt):
         return dt.strftime('%Y-%m-%d %H:%M:%S')
+    
+    @staticmethod
+    def column_list(columns, alias=None):
+        prefix = f"{alias}." if alias else ""
+        return ", ".join(prefix + column for column in columns)
+    
+    @staticmethod
+    def placeholders(values):
+        return ", ".join(["%s"] * len(values))
+    
+    @staticmethod
+    def chunked(values, size=500):
+        values = list(values)
+        for start in range(0, len(values), size):
+            yield values[start:start + size]
+    
+    @staticmethod
+    def like_prefix(prefix):
+        """LIKE pattern matching values that start with prefix literally"""
+        escaped = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        return escaped + '%'
+    
+    @staticmethod
+    def encode_cursor(row):
+        raw = f"{row['createdAt'].isoformat()}|{row['id']}"
+        return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+    
+    @staticmethod
+    def decode_cursor(cursor):
+        """(createdAt, id) from a page cursor, or None when it is malformed"""
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            created_at, row_id = base64.urlsafe_b64decode(padded).decode('utf-8').split('|', 1)
+            return datetime.fromisoformat(created_at), row_id
+        except (ValueError, TypeError):
+            return None
+    
+    @classmethod
+    def _keyset_batch(cls, conditions, params, after, limit, columns=None):
+        """Rows ordered newest first that come strictly after the (createdAt, id) key"""
+        where = list(conditions)
+        batch_params = list(params)
+        if after:
+            where.append("(createdAt < %s OR (createdAt = %s AND id < %s))")
+            batch_params.extend([after[0], after[0], after[1]])
+        
+        query = f"SELECT {cls.column_list(columns) if columns else '*'} FROM {cls.table_name}"
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        query += " ORDER BY createdAt DESC, id DESC LIMIT %s"
+        batch_params.append(limit)
+        
+        return db.execute_query(query, batch_params)
+    
+    @classmethod
+    def _iter_keyset(cls, conditions=None, params=None, batch_size=500, columns=None):
+        """Yield rows newest first, one (createdAt, id) keyset batch per query"""
+        conditions = list(conditions or [])
+        params = list(params or [])
+        last = None
+        
+        while True:
+            rows = cls._keyset_batch(conditions, params, last, batch_size, columns)
+            for row in rows:
+                yield row
+            
+            if len(rows) < batch_size:
+                return
+            last = (rows[-1]['createdAt'], rows[-1]['id'])
+    
+    @classmethod
+    def _get_page(cls, conditions, params, after=None, limit=50, columns=None):
+        """
+        One page of rows newest first and the cursor for the next page
+        (None on the last page). Seeking on (createdAt, id) keeps the cost
+        of deep pages the same as the first one.
+        """
+        after_key = cls.decode_cursor(after) if after else None
+        rows = cls._keyset_batch(conditions, params, after_key, limit + 1, columns)
+        next_cursor = cls.encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+        return rows[:limit], next_cursor
+
+class Sequence(BaseModel):
+    table_name = 'sequences'
+    
+    # Counters already seeded by this process, so seeding costs one query per name
+    _seeded = set()
+    
+    @classmethod
+    def create_table(cls):
+        query = f"""
+        CREATE TABLE IF NOT EXISTS {cls.table_name} (
+            name VARCHAR(64) PRIMARY KEY,
+            value BIGINT NOT NULL DEFAULT 0
+        )
+        """
+        db.execute_query(query)
+    
+    @classmethod
+    def seed_from(cls, name, table, column, prefix):
+        """
+        Create the counter from the highest existing numeric suffix of
+        column values starting with prefix. Existing counters are left alone.
+        """
+        if name in cls._seeded:
+            return
+        
+        query = f"""
+        INSERT IGNORE INTO {cls.table_name} (name, value)
+        SELECT %s, COALESCE(MAX(CAST(SUBSTRING({column}, %s) AS UNSIGNED)), 0)
+        FROM {table} WHERE {column} LIKE %s
+        """
+        db.execute_query(query, (name, len(prefix) + 1, prefix + '%'))
+        cls._seeded.add(name)
+    
+    @classmethod
+    def reserve(cls, name, count=1):
+        """
+        Atomically reserve count consecutive values and return the first one.
+        LAST_INSERT_ID(expr) is per connection, so the new value comes back
+        with the UPDATE itself and concurrent callers never share a value.
+        """
+        query = f"UPDATE {cls.table_name} SET value = LAST_INSERT_ID(value + %s) WHERE name = %s"
+        last_value = db.execute_query(query, (count, name))
+        return last_value - count + 1
 
 class Student(BaseModel):
     table_name = 'students'
     
+    # Everything except passwordHash, for rosters and lists
+    SUMMARY_COLUMNS = StudentSummary.__slots__
+    
+    # roster_cache name for roster ID tuples and group counts
+    ROSTER_CACHE = 'rosters'
+    
     @classmethod
     def create_table(cls):
         query = f"""
@@ -30,6 +216,10 @@ class Student(BaseModel):
         )
         """
         db.execute_query(query)
+        db.ensure_index(cls.table_name, 'idx_students_campus_grade', 'campus, grade')
+        db.ensure_index(cls.table_name, 'idx_students_created', 'createdAt, id')
+        db.ensure_index(cls.table_name, 'idx_students_campus_created', 'campus, createdAt, id')
+        db.ensure_index(cls.table_name, 'idx_students_name', 'name')
     
     @classmethod
     def create(cls, data):
@@ -53,6 +243,8 @@ class Student(BaseModel):
         )
         
         db.execute_query(query, params)
+        roster_cache.invalidate(cls.ROSTER_CACHE)
+        SearchIndex.index_student(data)
         return student_id
     
     @classmethod
@@ -61,6 +253,15 @@ class Student(BaseModel):
         result = db.execute_query(query, (student_id,))
         return result[0] if result else None
     
+    @classmethod
+    def find_by_ids(cls, student_ids):
+        """Fetch many students by studentID, a bounded IN list per query"""
+        students = []
+        for chunk in cls.chunked(set(student_ids)):
+            query = f"SELECT {cls.column_list(cls.SUMMARY_COLUMNS)} FROM {cls.table_name} WHERE studentID IN ({cls.placeholders(chunk)})"
+            students.extend(db.execute_query(query, chunk))
+        return students
+    
     @classmethod
     def verify_password(cls, student_id, password):
         student = cls.find_by_id(student_id)
@@ -70,20 +271,89 @@ class Student(BaseModel):
     
     @classmethod
     def get_by_campus_grade(cls, campus, grade):
-        query = f"SELECT * FROM {cls.table_name} WHERE campus = %s AND grade = %s"
+        query = f"SELECT {cls.column_list(cls.SUMMARY_COLUMNS)} FROM {cls.table_name} WHERE campus = %s AND grade = %s"
         return db.execute_query(query, (campus, grade))
     
     @classmethod
     def get_all(cls):
-        query = f"SELECT * FROM {cls.table_name} ORDER BY createdAt DESC"
+        query = f"SELECT {cls.column_list(cls.SUMMARY_COLUMNS)} FROM {cls.table_name} ORDER BY createdAt DESC"
         return db.execute_query(query)
     
+    @classmethod
+    def get_page(cls, campus=None, grade=None, section=None, name_prefix=None, after=None, limit=50):
+        """A filtered page of students in get_all order and the next page cursor"""
+        conditions = []
+        params = []
+        
+        if campus:
+            conditions.append("campus = %s")
+            params.append(campus)
+        if grade:
+            conditions.append("grade = %s")
+            params.append(grade)
+        if section:
+            conditions.append("section = %s")
+            params.append(section)
+        if name_prefix:
+            conditions.append("name LIKE %s")
+            params.append(cls.like_prefix(name_prefix))
+        
+        return cls._get_page(conditions, params, after, limit, cls.SUMMARY_COLUMNS)
+    
+    @classmethod
+    def reserve_sequence(cls, prefix, count=1):
+        """Reserve count student ID numbers for the given campus prefix"""
+        name = f"student:{prefix}"
+        Sequence.seed_from(name, cls.table_name, 'studentID', f"{prefix}-")
+        return Sequence.reserve(name, count)
+    
+    @classmethod
+    def iter_all(cls, campus=None, batch_size=500):
+        """Stream students in get_all order without loading the whole roster"""
+        if campus:
+            return cls._iter_keyset(["campus = %s"], [campus], batch_size, cls.SUMMARY_COLUMNS)
+        return cls._iter_keyset(batch_size=batch_size, columns=cls.SUMMARY_COLUMNS)
+    
     @classmethod
     def count_by_campus(cls, campus):
         query = f"SELECT COUNT(*) as count FROM {cls.table_name} WHERE campus = %s"
         result = db.execute_query(query, (campus,))
         return result[0]['count'] if result else 0
     
+    @classmethod
+    def _cached_roster(cls, key, loader):
+        """Per-request memo in front of the short-TTL shared roster cache"""
+        return memoize_request(cls.ROSTER_CACHE, lambda: roster_cache.get(cls.ROSTER_CACHE, loader, key), key)
+    
+    @classmethod
+    def get_group_counts(cls, campus=None):
+        """Student counts per (campus, grade, section), optionally for one campus"""
+        def load():
+            query = f"SELECT campus, grade, section, COUNT(*) AS count FROM {cls.table_name}"
+            params = []
+            if campus:
+                query += " WHERE campus = %s"
+                params.append(campus)
+            query += " GROUP BY campus, grade, section"
+            return tuple(db.execute_query(query, params))
+        return cls._cached_roster(('counts', campus), load)
+    
+    @classmethod
+    def get_roster_ids(cls, campus, grade=None, section=None):
+        """studentIDs of a campus, optionally narrowed to a grade and section, as a tuple"""
+        def load():
+            conditions = ["campus = %s"]
+            params = [campus]
+            if grade:
+                conditions.append("grade = %s")
+                params.append(grade)
+            if section:
+                conditions.append("section = %s")
+                params.append(section)
+            query = f"SELECT studentID FROM {cls.table_name} WHERE {' AND '.join(conditions)}"
+            return tuple(row['studentID'] for row in db.execute_query(query, params))
+        return cls._cached_roster(('ids', campus, grade, section), load)
+    
     @classmethod
     def get_total_count(cls):
         query = f"SELECT COUNT(*) as count FROM {cls.table_name}"
@@ -92,7 +362,7 @@ class Student(BaseModel):
     
     @classmethod
     def get_by_campus_grade_section(cls, campus, grade, section):
-        query = f"SELECT * FROM {cls.table_name} WHERE campus = %s AND grade = %s AND section = %s"
+        query = f"SELECT {cls.column_list(cls.SUMMARY_COLUMNS)} FROM {cls.table_name} WHERE campus = %s AND grade = %s AND section = %s"
         return db.execute_query(query, (campus, grade, section))
     
     @classmethod
@@ -123,16 +393,29 @@ class Student(BaseModel):
         params.append(student_id)
         query = f"UPDATE {cls.table_name} SET {', '.join(set_clause)} WHERE studentID = %s"
         
-        return db.execute_query(query, params)
+        result = db.execute_query(query, params)
+        roster_cache.invalidate(cls.ROSTER_CACHE)
+        if 'name' in data or 'campus' in data:
+            SearchIndex.index_student(cls.find_by_id(student_id))
+        if 'campus' in data:
+            SearchIndex.move_student(student_id, data['campus'])
+        return result
     
     @classmethod
     def delete(cls, student_id):
+        Draft.delete_for_student(student_id)
         query = f"DELETE FROM {cls.table_name} WHERE studentID = %s"
-        return db.execute_query(query, (student_id,))
+        result = db.execute_query(query, (student_id,))
+        roster_cache.invalidate(cls.ROSTER_CACHE)
+        SearchIndex.remove_student(student_id)
+        return result
 
 class Task(BaseModel):
     table_name = 'tasks'
     
+    # Cache entries derived from the task catalog, dropped on every task write
+    CACHE_NAMES = ('tasks', 'task_eligibility')
+    
     @classmethod
     def create_table(cls):
         query = f"""
@@ -147,6 +430,7 @@ class Task(BaseModel):
         )
         """
         db.execute_query(query)
+        db.ensure_index(cls.table_name, 'idx_tasks_created', 'createdAt, id')
     
     @classmethod
     def create(cls, data):
@@ -169,6 +453,8 @@ class Task(BaseModel):
         )
         
         db.execute_query(query, params)
+        cache.invalidate(*cls.CACHE_NAMES)
+        SearchIndex.index_task(task_id, data)
         return task_id
     
     @classmethod
@@ -179,29 +465,67 @@ class Task(BaseModel):
     
     @classmethod
     def get_all(cls):
-        query = f"SELECT * FROM {cls.table_name} ORDER BY createdAt DESC"
-        return db.execute_query(query)
+        def load():
+            query = f"SELECT * FROM {cls.table_name} ORDER BY createdAt DESC"
+            return db.execute_query(query)
+        # Copies, so callers can annotate rows without touching the cache
+        return [dict(task) for task in cache.get(cls.table_name, load)]
     
     @classmethod
-    def get_for_student(cls, campus, grade):
-        query = f"SELECT * FROM {cls.table_name}"
-        tasks = db.execute_query(query)
+    def get_page(cls, campus=None, grade=None, title_prefix=None, after=None, limit=50):
+        """A filtered page of tasks in get_all order and the next page cursor"""
+        conditions = []
+        params = []
         
-        import json
-        filtered_tasks = []
-        for task in tasks:
-            campus_target = json.loads(task['campusTarget']) if task['campusTarget'] else []
-            grade_target = json.loads(task['gradeTarget']) if task['gradeTarget'] else []
-            
-            if campus in campus_target and grade in grade_target:
-                filtered_tasks.append(task)
+        if campus:
+            conditions.append("JSON_CONTAINS(campusTarget, JSON_QUOTE(%s))")
+            params.append(campus)
+        if grade:
+            conditions.append("JSON_CONTAINS(gradeTarget, JSON_QUOTE(%s))")
+            params.append(grade)
+        if title_prefix:
+            conditions.append("title LIKE %s")
+            params.append(cls.like_prefix(title_prefix))
         
-        return filtered_tasks
+        return cls._get_page(conditions, params, after, limit)
+    
+    @classmethod
+    def get_for_student(cls, campus, grade):
+        return cls.eligibility().tasks_for(campus, grade)
+    
+    @classmethod
+    def eligibility(cls):
+        """Bitmask index over the cached task catalog, rebuilt after task writes"""
+        def build():
+            return TaskEligibilityIndex(cls.get_all(), Campus.get_names(), Grade.get_names())
+        return cache.get('task_eligibility', build)
+    
+    @classmethod
+    def get_for_student_with_status(cls, student_id, campus, grade):
+        """
+        Tasks assigned to a student's campus and grade together with the
+        student's latest submittedAt (None when not yet submitted).
+        """
+        query = f"""
+        SELECT t.id, t.title, t.language, t.description, sub.submittedAt
+        FROM {cls.table_name} t
+        LEFT JOIN (
+            SELECT taskId, MAX(submittedAt) AS submittedAt
+            FROM submissions WHERE studentId = %s GROUP BY taskId
+        ) sub ON sub.taskId = t.id
+        WHERE JSON_CONTAINS(t.campusTarget, JSON_QUOTE(%s)) AND JSON_CONTAINS(t.gradeTarget, JSON_QUOTE(%s))
+        ORDER BY t.createdAt DESC
+        """
+        return db.execute_query(query, (student_id, campus, grade))
     
     @classmethod
     def delete(cls, task_id):
+        Draft.delete_for_task(task_id)
         query = f"DELETE FROM {cls.table_name} WHERE id = %s"
-        return db.execute_query(query, (task_id,))
+        result = db.execute_query(query, (task_id,))
+        cache.invalidate(*cls.CACHE_NAMES)
+        SearchIndex.remove('task', task_id)
+        return result
     
     @classmethod
     def update(cls, task_id, data):
@@ -232,90 +556,1018 @@ class Task(BaseModel):
         params.append(task_id)
         query = f"UPDATE {cls.table_name} SET {', '.join(set_clause)} WHERE id = %s"
         
-        return db.execute_query(query, params)
+        result = db.execute_query(query, params)
+        cache.invalidate(*cls.CACHE_NAMES)
+        if 'title' in data or 'description' in data:
+            SearchIndex.index_task(task_id, cls.find_by_id(task_id))
+        return result
+    
+    @classmethod
+    def get_total_count(cls):
+        query = f"SELECT COUNT(*) as count FROM {cls.table_name}"
+        result = db.execute_query(query)
+        return result[0]['count'] if result else 0
+
+class CodeBlob(BaseModel):
+    """
+    Content-addressed store for submission code and output. Each distinct
+    text is kept once, zlib-compressed and keyed by its SHA-256, with a
+    count of the rows referencing it.
+    """
+    table_name = 'code_blobs'
+    
+    @classmethod
+    def create_table(cls):
+        query = f"""
+        CREATE TABLE IF NOT EXISTS {cls.table_name} (
+            hash CHAR(64) PRIMARY KEY,
+            payload MEDIUMBLOB NOT NULL,
+            size INT NOT NULL,
+            refCount INT NOT NULL DEFAULT 0,
+            createdAt DATETIME NOT NULL
+        )
+        """
+        db.execute_query(query)
+    
+    @staticmethod
+    def digest(text):
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+    
+    @staticmethod
+    def decode(payload):
+        return zlib.decompress(payload).decode('utf-8')
+    
+    @classmethod
+    def store(cls, texts):
+        """
+        Add one reference to each text, inserting blobs not stored yet.
+        Returns the hashes in order; None and empty texts map to None.
+        """
+        hashes = [cls.digest(text) if text else None for text in texts]
+        rows = [(digest, zlib.compress(text.encode('utf-8')), len(text), datetime.utcnow())
+                for digest, text in zip(hashes, texts) if digest]
+        if rows:
+            query = f"""
+            INSERT INTO {cls.table_name} (hash, payload, size, refCount, createdAt)
+            VALUES (%s, %s, %s, 1, %s)
+            ON DUPLICATE KEY UPDATE refCount = refCount + 1
+            """
+            db.execute_many(query, rows)
+        return hashes
+    
+    @classmethod
+    def release(cls, hashes):
+        """Drop one reference per hash and delete blobs nobody references"""
+        hashes = [digest for digest in hashes if digest]
+        if not hashes:
+            return
+        
+        query = f"UPDATE {cls.table_name} SET refCount = refCount - 1 WHERE hash = %s"
+        db.execute_many(query, [(digest,) for digest in hashes])
+        query = f"DELETE FROM {cls.table_name} WHERE refCount <= 0 AND hash IN ({cls.placeholders(hashes)})"
+        db.execute_query(query, hashes)
+
+class Submission(BaseModel):
+    table_name = 'submissions'
+    
+    # Everything except the code and output TEXT columns
+    SUMMARY_COLUMNS = SubmissionSummary.__slots__
+    
+    @classmethod
+    def create_table(cls):
+        query = f"""
+        CREATE TABLE IF NOT EXISTS {cls.table_name} (
+            id VARCHAR(36) PRIMARY KEY,
+            studentId VARCHAR(20) NOT NULL,
+            taskId VARCHAR(36) NOT NULL,
+            code TEXT,
+            output TEXT,
+            status VARCHAR(20) DEFAULT 'completed',
+            submittedAt DATETIME NOT NULL,
+            FOREIGN KEY (studentId) REFERENCES students(studentID),
+            FOREIGN KEY (taskId) REFERENCES tasks(id)
+        )
+        """
+        db.execute_query(query)
+        db.ensure_column(cls.table_name, 'idempotencyKey', 'VARCHAR(64)')
+        db.ensure_column(cls.table_name, 'codeHash', 'CHAR(64)')
+        db.ensure_column(cls.table_name, 'outputHash', 'CHAR(64)')
+        db.ensure_index(cls.table_name, 'idx_submissions_task_student', 'taskId, studentId')
+        
+        # One submission per student and task; older duplicates are dropped first
+        if not db.index_exists(cls.table_name, 'uq_submissions_student_task'):
+            cls.remove_duplicates()
+            db.ensure_index(cls.table_name, 'uq_submissions_student_task', 'studentId, taskId', unique=True)
+        if db.index_exists(cls.table_name, 'idx_submissions_student_task'):
+            db.execute_query(f"DROP INDEX idx_submissions_student_task ON {cls.table_name}")
+        
+        cls.migrate_to_blobs()
+    
+    @classmethod
+    def migrate_to_blobs(cls, batch_size=500):
+        """
+        Move inline code/output TEXT into the blob store, a batch at a time.
+        Rows already migrated are skipped, so it is safe to run repeatedly.
+        """
+        migrated = 0
+        while True:
+            query = f"""
+            SELECT id, code, output FROM {cls.table_name}
+            WHERE codeHash IS NULL AND outputHash IS NULL AND (code <> '' OR output <> '')
+            LIMIT %s
+            """
+            rows = db.execute_query(query, (batch_size,))
+            if not rows:
+                break
+            
+            with db.transaction():
+                texts = [text for row in rows for text in (row['code'], row['output'])]
+                hashes = CodeBlob.store(texts)
+                # Empty texts get no blob and stay inline as ''
+                query = f"""
+                UPDATE {cls.table_name} SET codeHash = %s, outputHash = %s,
+                    code = IF(codeHash IS NULL, code, NULL), output = IF(outputHash IS NULL, output, NULL)
+                WHERE id = %s
+                """
+                db.execute_many(query, [(hashes[2 * i], hashes[2 * i + 1], row['id']) for i, row in enumerate(rows)])
+            migrated += len(rows)
+        
+        if migrated:
+            print(f"✅ Moved code of {migrated} submissions to the blob store")
+        return migrated
+    
+    @classmethod
+    def remove_duplicates(cls):
+        """Keep only the latest submission of each student for each task"""
+        query = f"""
+        DELETE older FROM {cls.table_name} older
+        JOIN {cls.table_name} newer ON newer.studentId = older.studentId AND newer.taskId = older.taskId
+            AND (newer.submittedAt > older.submittedAt
+                 OR (newer.submittedAt = older.submittedAt AND newer.id > older.id))
+        """
+        return db.execute_update(query)
+    
+    @classmethod
+    def create(cls, data):
+        submission_id, _ = cls.upsert(data)
+        return submission_id
+    
+    @classmethod
+    def upsert(cls, data):
+        """
+        Store the student's submission for a task, replacing an earlier one.
+        Resending the same idempotencyKey changes nothing, so retried or
+        double-clicked submits are harmless. Code and output go to the blob
+        store. Returns (submission_id, changed).
+        """
+        idempotency_key = data.get('idempotencyKey') or cls.generate_id()
+        
+        with db.transaction():
+            # The current row, locked so its blob references can be released
+            query = f"""
+            SELECT id, codeHash, outputHash, idempotencyKey FROM {cls.table_name}
+            WHERE studentId = %s AND taskId = %s FOR UPDATE
+            """
+            result = db.execute_query(query, (data['studentId'], data['taskId']))
+            existing = result[0] if result else None
+            if existing and existing['idempotencyKey'] == idempotency_key:
+                return existing['id'], False
+            
+            submission_id = existing['id'] if existing else cls.generate_id()
+            code_hash, output_hash = CodeBlob.store([data.get('code', ''), data.get('output', '')])
+            
+            # Every column keeps its value when the key repeats (a concurrent retry);
+            # idempotencyKey goes last because later assignments see earlier updates
+            same = "idempotencyKey <=> VALUES(idempotencyKey)"
+            query = f"""
+            INSERT INTO {cls.table_name} (id, studentId, taskId, codeHash, outputHash, status, submittedAt, idempotencyKey)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE
+                codeHash = IF({same}, codeHash, VALUES(codeHash)),
+                outputHash = IF({same}, outputHash, VALUES(outputHash)),
+                code = IF({same}, code, NULL),
+                output = IF({same}, output, NULL),
+                status = IF({same}, status, VALUES(status)),
+                submittedAt = IF({same}, submittedAt, VALUES(submittedAt)),
+                idempotencyKey = VALUES(idempotencyKey)
+            """
+            
+            params = (
+                submission_id,
+                data['studentId'],
+                data['taskId'],
+                code_hash,
+                output_hash,
+                data.get('status', 'completed'),
+                datetime.utcnow(),
+                idempotency_key
+            )
+            
+            # Affected rows: 1 for an insert, 2 for a replaced submission, 0 for a repeat
+            affected = db.execute_update(query, params)
+            if affected == 0:
+                CodeBlob.release([code_hash, output_hash])
+            else:
+                if existing:
+                    CodeBlob.release([existing['codeHash'], existing['outputHash']])
+                SubmissionAttempt.record(data['studentId'], data['taskId'], data.get('code', ''))
+                SubmissionSignature.store(data['studentId'], data['taskId'], data.get('code', ''))
+                SearchIndex.index_submission(data['studentId'], data['taskId'], data.get('code', ''))
+        
+        return submission_id, affected > 0
+    
+    @classmethod
+    def find_by_student_task(cls, student_id, task_id):
+        """The submission with code and output read back from the blob store"""
+        query = f"""
+        SELECT sub.*, cb.payload AS codePayload, ob.payload AS outputPayload
+        FROM {cls.table_name} sub
+        LEFT JOIN {CodeBlob.table_name} cb ON cb.hash = sub.codeHash
+        LEFT JOIN {CodeBlob.table_name} ob ON ob.hash = sub.outputHash
+        WHERE sub.studentId = %s AND sub.taskId = %s
+        """
+        result = db.execute_query(query, (student_id, task_id))
+        if not result:
+            return None
+        
+        # Empty code or output has no blob; it reads back as ''
+        submission = result[0]
+        code_payload = submission.pop('codePayload')
+        output_payload = submission.pop('outputPayload')
+        submission['code'] = CodeBlob.decode(code_payload) if code_payload is not None else submission['code'] or ''
+        submission['output'] = CodeBlob.decode(output_payload) if output_payload is not None else submission['output'] or ''
+        return submission
+    
+    @classmethod
+    def get_by_student(cls, student_id):
+        query = f"SELECT {cls.column_list(cls.SUMMARY_COLUMNS)} FROM {cls.table_name} WHERE studentId = %s"
+        return SubmissionSummary.from_rows(db.execute_query(query, (student_id,)))
+    
+    @classmethod
+    def get_task_completions(cls, task_id):
+        query = f"SELECT {cls.column_list(cls.SUMMARY_COLUMNS)} FROM {cls.table_name} WHERE taskId = %s"
+        return SubmissionSummary.from_rows(db.execute_query(query, (task_id,)))
+    
+    @classmethod
+    def get_completions_for_tasks(cls, task_ids):
+        """studentId/taskId pairs for all submissions to the given tasks"""
+        completions = []
+        for chunk in cls.chunked(set(task_ids)):
+            query = f"SELECT studentId, taskId FROM {cls.table_name} WHERE taskId IN ({cls.placeholders(chunk)})"
+            completions.extend(db.execute_query(query, chunk))
+        return completions
+    
+    @classmethod
+    def count_by_students(cls, student_ids):
+        """Submission counts keyed by studentId for the given students"""
+        counts = {}
+        for chunk in cls.chunked(set(student_ids)):
+            query = f"""
+            SELECT studentId, COUNT(*) AS count FROM {cls.table_name}
+            WHERE studentId IN ({cls.placeholders(chunk)}) GROUP BY studentId
+            """
+            for row in db.execute_query(query, chunk):
+                counts[row['studentId']] = row['count']
+        return counts
+    
+    @classmethod
+    def get_group_counts(cls, campus=None):
+        """Submission counts per submitting student's (campus, grade, section)"""
+        query = f"""
+        SELECT s.campus, s.grade, s.section, COUNT(*) AS count
+        FROM {cls.table_name} sub JOIN students s ON s.studentID = sub.studentId
+        """
+        params = []
+        if campus:
+            query += " WHERE s.campus = %s"
+            params.append(campus)
+        query += " GROUP BY s.campus, s.grade, s.section"
+        return db.execute_query(query, params)
+    
+    @classmethod
+    def count_by_task(cls, campus=None):
+        """Submission counts keyed by taskId, optionally from one campus's students"""
+        if campus:
+            query = f"""
+            SELECT sub.taskId, COUNT(*) AS count
+            FROM {cls.table_name} sub JOIN students s ON s.studentID = sub.studentId
+            WHERE s.campus = %s GROUP BY sub.taskId
+            """
+            rows = db.execute_query(query, (campus,))
+        else:
+            query = f"SELECT taskId, COUNT(*) AS count FROM {cls.table_name} GROUP BY taskId"
+            rows = db.execute_query(query)
+        return {row['taskId']: row['count'] for row in rows}
+    
+    @classmethod
+    def get_completion_count(cls, task_id):
+        query = f"SELECT COUNT(*) as count FROM {cls.table_name} WHERE taskId = %s"
+        result = db.execute_query(query, (task_id,))
+        return result[0]['count'] if result else 0
+    
+    @classmethod
+    def get_student_completions(cls, student_id):
+        return cls.get_by_student(student_id)
+    
+    @classmethod
+    def get_completed_students_for_task(cls, task_id):
+        query = f"""
+        SELECT {cls.column_list(Student.SUMMARY_COLUMNS, 's')} FROM students s
+        JOIN submissions sub ON s.studentID = sub.studentId
+        WHERE sub.taskId = %s
+        """
+        return db.execute_query(query, (task_id,))
+    
+    @classmethod
+    def get_pending_students_for_task(cls, task_id, campus_list, grade_list):
+        """Targeted students with no submission for the task (anti-join)"""
+        campus_list = list(campus_list)
+        grade_list = list(grade_list)
+        if not campus_list or not grade_list:
+            return []
+        
+        query = f"""
+        SELECT {cls.column_list(Student.SUMMARY_COLUMNS, 's')} FROM students s
+        WHERE s.campus IN ({cls.placeholders(campus_list)}) AND s.grade IN ({cls.placeholders(grade_list)})
+        AND NOT EXISTS (
+            SELECT 1 FROM submissions sub WHERE sub.taskId = %s AND sub.studentId = s.studentID
+        )
+        """
+        return db.execute_query(query, campus_list + grade_list + [task_id])
+
+class SubmissionAttempt(BaseModel):
+    """
+    Append-only log of every submitted version per student and task.
+    Most attempts are stored as a line diff against the previous one; a
+    full snapshot is written every SUBMISSION_SNAPSHOT_INTERVAL versions
+    (or when the diff would not be smaller), so rebuilding any version
+    replays a bounded number of diffs.
+    """
+    table_name = 'submission_attempts'
+    
+    @classmethod
+    def create_table(cls):
+        query = f"""
+        CREATE TABLE IF NOT EXISTS {cls.table_name} (
+            studentId VARCHAR(20) NOT NULL,
+            taskId VARCHAR(36) NOT NULL,
+            version INT NOT NULL,
+            isSnapshot BOOLEAN NOT NULL,
+            payload MEDIUMBLOB NOT NULL,
+            size INT NOT NULL,
+            createdAt DATETIME NOT NULL,
+            PRIMARY KEY (studentId, taskId, version),
+            FOREIGN KEY (studentId) REFERENCES students(studentID),
+            FOREIGN KEY (taskId) REFERENCES tasks(id)
+        )
+        """
+        db.execute_query(query)
+        db.ensure_index(cls.table_name, 'idx_submission_attempts_task', 'taskId')
+    
+    @staticmethod
+    def diff(previous, code):
+        """
+        Line diff turning previous into code: [start, end] copies lines of
+        previous, a string is inserted text.
+        """
+        old_lines = previous.splitlines(keepends=True)
+        new_lines = code.splitlines(keepends=True)
+        ops = []
+        matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag == 'equal':
+                ops.append([i1, i2])
+            elif tag in ('replace', 'insert'):
+                ops.append(''.join(new_lines[j1:j2]))
+        return ops
+    
+    @staticmethod
+    def patch(previous, ops):
+        old_lines = previous.splitlines(keepends=True)
+        return ''.join(''.join(old_lines[op[0]:op[1]]) if isinstance(op, list) else op for op in ops)
+    
+    @staticmethod
+    def encode(body):
+        return zlib.compress(json.dumps(body, separators=(',', ':')).encode('utf-8'))
+    
+    @staticmethod
+    def decode(payload):
+        return json.loads(zlib.decompress(payload).decode('utf-8'))
+    
+    @classmethod
+    def record(cls, student_id, task_id, code):
+        """
+        Append code as the next version. Call it in the transaction that
+        stores the submission, whose row lock keeps versions in order.
+        """
+        query = f"SELECT MAX(version) AS version FROM {cls.table_name} WHERE studentId = %s AND taskId = %s"
+        result = db.execute_query(query, (student_id, task_id))
+        latest = result[0]['version'] if result and result[0]['version'] else 0
+        
+        code = code or ''
+        payload = cls.encode(code)
+        is_snapshot = latest % Config.SUBMISSION_SNAPSHOT_INTERVAL == 0
+        if not is_snapshot:
+            delta = cls.encode(cls.diff(cls.get_version(student_id, task_id, latest) or '', code))
+            if len(delta) < len(payload):
+                payload = delta
+            else:
+                is_snapshot = True
+        
+        query = f"""
+        INSERT INTO {cls.table_name} (studentId, taskId, version, isSnapshot, payload, size, createdAt)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+        """
+        db.execute_query(query, (student_id, task_id, latest + 1, is_snapshot, payload, len(code), datetime.utcnow()))
+        return latest + 1
+    
+    @classmethod
+    def get_version(cls, student_id, task_id, version=None):
+        """Code of one version (the latest by default), or None if it does not exist"""
+        version_filter = "AND version <= %s" if version is not None else ""
+        version_params = [version] if version is not None else []
+        
+        # The nearest snapshot at or before the version, then the diffs after it
+        query = f"""
+        SELECT version, isSnapshot, payload FROM {cls.table_name}
+        WHERE studentId = %s AND taskId = %s {version_filter} AND version >= (
+            SELECT MAX(version) FROM {cls.table_name}
+            WHERE studentId = %s AND taskId = %s {version_filter} AND isSnapshot = TRUE)
+        ORDER BY version
+        """
+        params = [student_id, task_id] + version_params + [student_id, task_id] + version_params
+        rows = db.execute_query(query, params)
+        if not rows or (version is not None and rows[-1]['version'] != version):
+            return None
+        
+        code = ''
+        for row in rows:
+            body = cls.decode(row['payload'])
+            code = body if row['isSnapshot'] else cls.patch(code, body)
+        return code
+    
+    @classmethod
+    def get_history(cls, student_id, task_id):
+        """Version metadata for a student's attempts at a task, oldest first"""
+        query = f"""
+        SELECT version, isSnapshot, size, createdAt FROM {cls.table_name}
+        WHERE studentId = %s AND taskId = %s ORDER BY version
+        """
+        return db.execute_query(query, (student_id, task_id))
+    
+    @classmethod
+    def count_by_students(cls, task_id):
+        """Attempt counts keyed by studentId for one task"""
+        query = f"SELECT studentId, COUNT(*) AS count FROM {cls.table_name} WHERE taskId = %s GROUP BY studentId"
+        return {row['studentId']: row['count'] for row in db.execute_query(query, (task_id,))}
+    
+    @classmethod
+    def count_by_task(cls, campus=None):
+        """Attempt totals keyed by taskId, optionally from one campus's students"""
+        if campus:
+            query = f"""
+            SELECT a.taskId, COUNT(*) AS count
+            FROM {cls.table_name} a JOIN students s ON s.studentID = a.studentId
+            WHERE s.campus = %s GROUP BY a.taskId
+            """
+            rows = db.execute_query(query, (campus,))
+        else:
+            query = f"SELECT taskId, COUNT(*) AS count FROM {cls.table_name} GROUP BY taskId"
+            rows = db.execute_query(query)
+        return {row['taskId']: row['count'] for row in rows}
+
+class Draft(BaseModel):
+    """Latest autosaved editor text per student and task, zlib-compressed"""
+    table_name = 'submission_drafts'
+    
+    @classmethod
+    def create_table(cls):
+        query = f"""
+        CREATE TABLE IF NOT EXISTS {cls.table_name} (
+            studentId VARCHAR(20) NOT NULL,
+            taskId VARCHAR(36) NOT NULL,
+            code MEDIUMBLOB NOT NULL,
+            seq INT NOT NULL,
+            updatedAt DATETIME NOT NULL,
+            PRIMARY KEY (studentId, taskId),
+            INDEX idx_submission_drafts_task (taskId)
+        )
+        """
+        # No foreign keys: drafts are written in the background and must
+        # neither block deleting a student or task nor fail a batched
+        # flush; the owners' delete methods remove them instead
+        db.execute_query(query)
+    
+    @classmethod
+    def find(cls, student_id, task_id):
+        query = f"SELECT code, seq, updatedAt FROM {cls.table_name} WHERE studentId = %s AND taskId = %s"
+        result = db.execute_query(query, (student_id, task_id))
+        if not result:
+            return None
+        
+        draft = result[0]
+        draft['code'] = zlib.decompress(draft['code']).decode('utf-8')
+        return draft
+    
+    @classmethod
+    def save_many(cls, drafts):
+        """
+        Write (studentId, taskId, code, seq) drafts in one statement. A row
+        only moves forward: a lower seq than the stored one is ignored.
+        """
+        # seq goes last because later assignments see the updated values of earlier ones
+        newer = "VALUES(seq) > seq"
+        query = f"""
+        INSERT INTO {cls.table_name} (studentId, taskId, code, seq, updatedAt)
+        VALUES (%s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            code = IF({newer}, VALUES(code), code),
+            updatedAt = IF({newer}, VALUES(updatedAt), updatedAt),
+            seq = GREATEST(seq, VALUES(seq))
+        """
+        now = datetime.utcnow()
+        rows = [(student_id, task_id, zlib.compress(code.encode('utf-8')), seq, now)
+                for student_id, task_id, code, seq in drafts]
+        return db.execute_many(query, rows)
+    
+    @classmethod
+    def delete(cls, student_id, task_id):
+        query = f"DELETE FROM {cls.table_name} WHERE studentId = %s AND taskId = %s"
+        db.execute_query(query, (student_id, task_id))
+    
+    @classmethod
+    def delete_for_student(cls, student_id):
+        db.execute_query(f"DELETE FROM {cls.table_name} WHERE studentId = %s", (student_id,))
+    
+    @classmethod
+    def delete_for_task(cls, task_id):
+        db.execute_query(f"DELETE FROM {cls.table_name} WHERE taskId = %s", (task_id,))
+
+class SubmissionSignature(BaseModel):
+    """
+    MinHash signatures of submitted code and the per-task LSH buckets built
+    from them. Submissions sharing a bucket in any band are candidate
+    copies; only those pairs are scored, so a task report is close to
+    linear in the number of submissions instead of comparing every pair.
+    """
+    table_name = 'submission_signatures'
+    buckets_table = 'submission_lsh_buckets'
+    
+    @classmethod
+    def create_table(cls):
+        query = f"""
+        CREATE TABLE IF NOT EXISTS {cls.table_name} (
+            studentId VARCHAR(20) NOT NULL,
+            taskId VARCHAR(36) NOT NULL,
+            signature VARBINARY({similarity.NUM_PERM * 4}) NOT NULL,
+            tokenCount INT NOT NULL,
+            updatedAt DATETIME NOT NULL,
+            PRIMARY KEY (taskId, studentId),
+            FOREIGN KEY (studentId) REFERENCES students(studentID),
+            FOREIGN KEY (taskId) REFERENCES tasks(id)
+        )
+        """
+        db.execute_query(query)
+        
+        query = f"""
+        CREATE TABLE IF NOT EXISTS {cls.buckets_table} (
+            taskId VARCHAR(36) NOT NULL,
+            band TINYINT NOT NULL,
+            bucket BIGINT NOT NULL,
+            studentId VARCHAR(20) NOT NULL,
+            PRIMARY KEY (taskId, band, bucket, studentId)
+        )
+        """
+        db.execute_query(query)
+        db.ensure_index(cls.buckets_table, 'idx_lsh_buckets_task_student', 'taskId, studentId')
+        
+        cls.backfill()
+    
+    @classmethod
+    def backfill(cls, batch_size=500):
+        """Sign submissions made before signatures existed, a batch at a time"""
+        signed = 0
+        while True:
+            query = f"""
+            SELECT sub.studentId, sub.taskId, COALESCE(cb.payload, sub.code) AS code, cb.payload IS NOT NULL AS compressed
+            FROM submissions sub
+            LEFT JOIN {CodeBlob.table_name} cb ON cb.hash = sub.codeHash
+            LEFT JOIN {cls.table_name} sig ON sig.taskId = sub.taskId AND sig.studentId = sub.studentId
+            WHERE sig.studentId IS NULL
+            LIMIT %s
+            """
+            rows = db.execute_query(query, (batch_size,))
+            if not rows:
+                break
+            
+            for row in rows:
+                code = CodeBlob.decode(row['code']) if row['compressed'] else row['code']
+                cls.store(row['studentId'], row['taskId'], code)
+            signed += len(rows)
+        
+        if signed:
+            print(f"✅ Indexed {signed} submissions for similarity reports")
+        return signed
+    
+    @classmethod
+    def store(cls, student_id, task_id, code):
+        """
+        (Re)index one submission. Code with fewer than
+        SIMILARITY_MIN_TOKENS tokens keeps a signature but no buckets, so
+        trivial programs are not reported as copies of each other.
+        """
+        tokens = similarity.tokenize(code)
+        sig = similarity.signature(tokens)
+        
+        query = f"""
+        REPLACE INTO {cls.table_name} (studentId, taskId, signature, tokenCount, updatedAt)
+        VALUES (%s, %s, %s, %s, %s)
+        """
+        db.execute_query(query, (student_id, task_id, similarity.to_bytes(sig), len(tokens), datetime.utcnow()))
+        db.execute_query(f"DELETE FROM {cls.buckets_table} WHERE taskId = %s AND studentId = %s", (task_id, student_id))
+        
+        if len(tokens) >= Config.SIMILARITY_MIN_TOKENS:
+            query = f"INSERT IGNORE INTO {cls.buckets_table} (taskId, band, bucket, studentId) VALUES (%s, %s, %s, %s)"
+            db.execute_many(query, [(task_id, band, bucket, student_id)
+                                    for band, bucket in enumerate(similarity.band_hashes(sig))])
+    
+    @classmethod
+    def _signatures(cls, task_id, student_ids):
+        signatures = {}
+        for chunk in cls.chunked(set(student_ids)):
+            query = f"""
+            SELECT studentId, signature FROM {cls.table_name}
+            WHERE taskId = %s AND studentId IN ({cls.placeholders(chunk)})
+            """
+            for row in db.execute_query(query, [task_id] + chunk):
+                signatures[row['studentId']] = similarity.from_bytes(row['signature'])
+        return signatures
+    
+    @classmethod
+    def find_similar(cls, task_id, student_id, threshold=None):
+        """[(studentId, similarity)] of submissions resembling one, most similar first"""
+        threshold = Config.SIMILARITY_THRESHOLD if threshold is None else threshold
+        query = f"""
+        SELECT DISTINCT other.studentId
+        FROM {cls.buckets_table} own
+        JOIN {cls.buckets_table} other ON other.taskId = own.taskId AND other.band = own.band
+            AND other.bucket = own.bucket AND other.studentId <> own.studentId
+        WHERE own.taskId = %s AND own.studentId = %s
+        """
+        candidates = [row['studentId'] for row in db.execute_query(query, (task_id, student_id))]
+        if not candidates:
+            return []
+        
+        signatures = cls._signatures(task_id, candidates + [student_id])
+        own = signatures.get(student_id)
+        if own is None:
+            return []
+        
+        matches = [(other, similarity.similarity(own, signatures[other]))
+                   for other in candidates if other in signatures]
+        return sorted([match for match in matches if match[1] >= threshold], key=lambda match: -match[1])
+    
+    @classmethod
+    def task_report(cls, task_id, campus=None, threshold=None):
+        """
+        [(studentId, studentId, similarity)] for every pair of a task's
+        submissions above threshold, optionally only among one campus's
+        students, most similar first.
+        """
+        threshold = Config.SIMILARITY_THRESHOLD if threshold is None else threshold
+        joins = ""
+        conditions = ["a.taskId = %s"]
+        params = [task_id]
+        if campus:
+            joins = "JOIN students sa ON sa.studentID = a.studentId JOIN students sb ON sb.studentID = b.studentId"
+            conditions.append("sa.campus = %s AND sb.campus = %s")
+            params.extend([campus, campus])
+        
+        # Candidate pairs: submissions sharing a bucket in at least one band
+        query = f"""
+        SELECT DISTINCT a.studentId AS first, b.studentId AS second
+        FROM {cls.buckets_table} a
+        JOIN {cls.buckets_table} b ON b.taskId = a.taskId AND b.band = a.band
+            AND b.bucket = a.bucket AND b.studentId > a.studentId
+        {joins}
+        WHERE {' AND '.join(conditions)}
+        """
+        pairs = [(row['first'], row['second']) for row in db.execute_query(query, params)]
+        if not pairs:
+            return []
+        
+        signatures = cls._signatures(task_id, [student_id for pair in pairs for student_id in pair])
+        report = []
+        for first, second in pairs:
+            if first in signatures and second in signatures:
+                score = similarity.similarity(signatures[first], signatures[second])
+                if score >= threshold:
+                    report.append((first, second, score))
+        return sorted(report, key=lambda pair: -pair[2])
+
+class SearchIndex(BaseModel):
+    """
+    Inverted index over students (ID and name), tasks (title and
+    description) and submitted code. Each term has a posting per document
+    with its field-weighted frequency; documents are re-indexed as they
+    are created, updated or deleted. Queries look terms up by equality or
+    by an index range for prefixes, never by scanning text with LIKE.
+    
+    Student and submission postings carry the student's campus, so a
+    search can be scoped to one campus in SQL.
+    """
+    table_name = 'search_postings'
+    documents_table = 'search_documents'
+    
+    # Field weights: an ID or title hit outranks one in a name, description or code
+    STUDENT_FIELDS = (('studentID', 3), ('name', 2))
+    TASK_FIELDS = (('title', 3), ('description', 1))
+    
+    @classmethod
+    def create_table(cls):
+        query = f"""
+        CREATE TABLE IF NOT EXISTS {cls.table_name} (
+            term VARCHAR({search.MAX_TERM_LENGTH}) CHARACTER SET utf8mb4 COLLATE utf8mb4_bin NOT NULL,
+            kind VARCHAR(16) NOT NULL,
+            docId VARCHAR(64) NOT NULL,
+            weight INT NOT NULL,
+            campus VARCHAR(50),
+            PRIMARY KEY (term, kind, docId)
+        )
+        """
+        db.execute_query(query)
+        db.ensure_index(cls.table_name, 'idx_search_postings_doc', 'kind, docId')
+        if db.ensure_column(cls.table_name, 'campus', 'VARCHAR(50)'):
+            query = f"""
+            UPDATE {cls.table_name} p JOIN {Student.table_name} s
+              ON s.studentID = IF(p.kind = 'student', p.docId, SUBSTRING_INDEX(p.docId, ':', 1))
+            SET p.campus = s.campus
+            WHERE p.kind IN ('student', 'submission')
+            """
+            db.execute_query(query)
+        
+        query = f"""
+        CREATE TABLE IF NOT EXISTS {cls.documents_table} (
+            kind VARCHAR(16) NOT NULL,
+            docId VARCHAR(64) NOT NULL,
+            indexedAt DATETIME NOT NULL,
+            PRIMARY KEY (kind, docId)
+        )
+        """
+        db.execute_query(query)
+        
+        if not db.execute_query(f"SELECT 1 FROM {cls.documents_table} LIMIT 1"):
+            cls.rebuild()
+    
+    @staticmethod
+    def submission_doc_id(student_id, task_id):
+        return f"{student_id}:{task_id}"
+    
+    @classmethod
+    def index(cls, kind, doc_id, fields, campus=None):
+        """Replace the postings of one document from (text, weight) fields"""
+        weights = search.document_terms(fields)
+        with db.transaction():
+            db.execute_query(f"DELETE FROM {cls.table_name} WHERE kind = %s AND docId = %s", (kind, doc_id))
+            if weights:
+                query = f"INSERT INTO {cls.table_name} (term, kind, docId, weight, campus) VALUES (%s, %s, %s, %s, %s)"
+                db.execute_many(query, [(term, kind, doc_id, weight, campus) for term, weight in weights.items()])
+            query = f"REPLACE INTO {cls.documents_table} (kind, docId, indexedAt) VALUES (%s, %s, %s)"
+            db.execute_query(query, (kind, doc_id, datetime.utcnow()))
+    
+    @classmethod
+    def remove(cls, kind, doc_id):
+        with db.transaction():
+            db.execute_query(f"DELETE FROM {cls.table_name} WHERE kind = %s AND docId = %s", (kind, doc_id))
+            db.execute_query(f"DELETE FROM {cls.documents_table} WHERE kind = %s AND docId = %s", (kind, doc_id))
+    
+    @classmethod
+    def index_student(cls, student):
+        if student:
+            cls.index('student', student['studentID'],
+                      [(student.get(field), weight) for field, weight in cls.STUDENT_FIELDS], student.get('campus'))
+    
+    @classmethod
+    def move_student(cls, student_id, campus):
+        """Move the postings of a student's submissions to their new campus"""
+        low, high = search.prefix_range(cls.submission_doc_id(student_id, ''))
+        query = f"UPDATE {cls.table_name} SET campus = %s WHERE kind = 'submission' AND docId >= %s AND docId < %s"
+        db.execute_query(query, (campus, low, high))
+    
+    @classmethod
+    def remove_student(cls, student_id):
+        """Drop a student and the index entries of their submissions"""
+        cls.remove('student', student_id)
+        low, high = search.prefix_range(cls.submission_doc_id(student_id, ''))
+        with db.transaction():
+            for table in (cls.table_name, cls.documents_table):
+                query = f"DELETE FROM {table} WHERE kind = 'submission' AND docId >= %s AND docId < %s"
+                db.execute_query(query, (low, high))
+    
+    @classmethod
+    def index_task(cls, task_id, task):
+        if task:
+            cls.index('task', task_id, [(task.get(field), weight) for field, weight in cls.TASK_FIELDS])
+    
+    @classmethod
+    def index_submission(cls, student_id, task_id, code, campus=None):
+        """Index submitted code; campus is looked up when not given"""
+        if campus is None:
+            student = Student.find_by_id(student_id)
+            campus = student['campus'] if student else None
+        cls.index('submission', cls.submission_doc_id(student_id, task_id), [(code, 1)], campus)
+    
+    @classmethod
+    def rebuild(cls, batch_size=500):
+        """Index every student, task and submission from scratch"""
+        for table in (cls.table_name, cls.documents_table):
+            db.execute_query(f"DELETE FROM {table}")
+        
+        students = 0
+        for student in Student.iter_all(batch_size=batch_size):
+            cls.index_student(student)
+            students += 1
+        tasks = Task.get_all()
+        for task in tasks:
+            cls.index_task(task['id'], task)
+        
+        submissions = 0
+        after = ''
+        while True:
+            query = f"""
+            SELECT sub.id, sub.studentId, sub.taskId, COALESCE(cb.payload, sub.code) AS code, cb.payload IS NOT NULL AS compressed,
+                   s.campus
+            FROM submissions sub LEFT JOIN {CodeBlob.table_name} cb ON cb.hash = sub.codeHash
+            LEFT JOIN {Student.table_name} s ON s.studentID = sub.studentId
+            WHERE sub.id > %s ORDER BY sub.id LIMIT %s
+            """
+            rows = db.execute_query(query, (after, batch_size))
+            if not rows:
+                break
+            for row in rows:
+                code = CodeBlob.decode(row['code']) if row['compressed'] else row['code']
+                cls.index_submission(row['studentId'], row['taskId'], code, row['campus'])
+            after = rows[-1]['id']
+            submissions += len(rows)
+        
+        if students or tasks or submissions:
+            print(f"✅ Search index built: {students} students, {len(tasks)} tasks, {submissions} submissions")
     
     @classmethod
-    def get_total_count(cls):
-        query = f"SELECT COUNT(*) as count FROM {cls.table_name}"
-        result = db.execute_query(query)
-        return result[0]['count'] if result else 0
+    def search(cls, query, kinds=None, limit=20, campus=None, task_ids=None):
+        """
+        Ranked [(kind, docId, score)] for documents matching every word of
+        query. Each word also matches index terms it is a prefix of.
+        campus limits students and submissions to that campus, and
+        task_ids (when not None) the tasks to those ids; both are applied
+        in the queries, so limit results are all in scope.
+        """
+        words = search.query_terms(query)
+        if not words:
+            return []
+        kinds = list(kinds or ())
+        kind_filter = f" AND kind IN ({cls.placeholders(kinds)})" if kinds else ""
+        filter_params = list(kinds)
+        if campus is not None:
+            kind_filter += " AND (kind = 'task' OR campus = %s)"
+            filter_params.append(campus)
+        if task_ids is not None:
+            task_ids = list(task_ids)
+            if task_ids:
+                kind_filter += f" AND (kind <> 'task' OR docId IN ({cls.placeholders(task_ids)}))"
+                filter_params.extend(task_ids)
+            else:
+                kind_filter += " AND kind <> 'task'"
+        
+        # Expand every word to the indexed terms it starts; an exact match sorts first
+        expansions = {}
+        for word in words:
+            low, high = search.prefix_range(word)
+            query = f"""
+            SELECT DISTINCT term FROM {cls.table_name}
+            WHERE term >= %s AND term < %s{kind_filter}
+            ORDER BY term LIMIT %s
+            """
+            rows = db.execute_query(query, [low, high] + filter_params + [Config.SEARCH_PREFIX_EXPANSIONS])
+            expansions[word] = [row['term'] for row in rows]
+            if not expansions[word]:
+                return []
+        
+        all_terms = list({term for word_terms in expansions.values() for term in word_terms})
+        postings = {}
+        query = f"""
+        SELECT term, kind, docId, weight FROM {cls.table_name}
+        WHERE term IN ({cls.placeholders(all_terms)}){kind_filter}
+        """
+        for row in db.execute_query(query, all_terms + filter_params):
+            postings.setdefault(row['term'], {})[(row['kind'], row['docId'])] = row['weight']
+        
+        rows = db.execute_query(f"SELECT kind, COUNT(*) AS count FROM {cls.documents_table} GROUP BY kind")
+        document_counts = {row['kind']: row['count'] for row in rows}
+        return search.rank(expansions, postings, document_counts, limit)
 
-class Submission(BaseModel):
-    table_name = 'submissions'
+class Conversation(BaseModel):
+    """
+    Server-side AI chat sessions. Turns are numbered per conversation;
+    turns already folded into the running summary sit at or below
+    compactedThrough and are no longer loaded, so building a prompt only
+    reads the recent window.
+    """
+    table_name = 'ai_conversations'
+    messages_table = 'ai_conversation_messages'
     
     @classmethod
     def create_table(cls):
         query = f"""
         CREATE TABLE IF NOT EXISTS {cls.table_name} (
             id VARCHAR(36) PRIMARY KEY,
-            studentId VARCHAR(20) NOT NULL,
-            taskId VARCHAR(36) NOT NULL,
-            code TEXT,
-            output TEXT,
-            status VARCHAR(20) DEFAULT 'completed',
-            submittedAt DATETIME NOT NULL,
-            FOREIGN KEY (studentId) REFERENCES students(studentID),
-            FOREIGN KEY (taskId) REFERENCES tasks(id)
+            userKey VARCHAR(64) NOT NULL,
+            taskId VARCHAR(36),
+            summary TEXT,
+            messageCount INT NOT NULL DEFAULT 0,
+            compactedThrough INT NOT NULL DEFAULT 0,
+            createdAt DATETIME NOT NULL,
+            updatedAt DATETIME NOT NULL
         )
         """
         db.execute_query(query)
-    
-    @classmethod
-    def create(cls, data):
-        submission_id = cls.generate_id()
+        db.ensure_index(cls.table_name, 'idx_ai_conversations_user', 'userKey, updatedAt')
         
         query = f"""
-        INSERT INTO {cls.table_name} (id, studentId, taskId, code, output, status, submittedAt)
-        VALUES (%s, %s, %s, %s, %s, %s, %s)
-        """
-        
-        params = (
-            submission_id,
-            data['studentId'],
-            data['taskId'],
-            data.get('code', ''),
-            data.get('output', ''),
-            data.get('status', 'completed'),
-            datetime.utcnow()
+        CREATE TABLE IF NOT EXISTS {cls.messages_table} (
+            conversationId VARCHAR(36) NOT NULL,
+            seq INT NOT NULL,
+            role VARCHAR(16) NOT NULL,
+            content MEDIUMTEXT NOT NULL,
+            createdAt DATETIME NOT NULL,
+            PRIMARY KEY (conversationId, seq)
         )
-        
-        db.execute_query(query, params)
-        return submission_id
-    
-    @classmethod
-    def find_by_student_task(cls, student_id, task_id):
-        query = f"SELECT * FROM {cls.table_name} WHERE studentId = %s AND taskId = %s"
-        result = db.execute_query(query, (student_id, task_id))
-        return result[0] if result else None
+        """
+        db.execute_query(query)
     
     @classmethod
-    def get_by_student(cls, student_id):
-        query = f"SELECT * FROM {cls.table_name} WHERE studentId = %s"
-        return db.execute_query(query, (student_id,))
+    def new(cls, user_key, task_id=None):
+        """A conversation that is only stored by append(), with its first turns"""
+        return {'id': cls.generate_id(), 'userKey': user_key, 'taskId': task_id,
+                'summary': '', 'compactedThrough': 0, 'new': True}
     
     @classmethod
-    def get_task_completions(cls, task_id):
-        query = f"SELECT * FROM {cls.table_name} WHERE taskId = %s"
-        return db.execute_query(query, (task_id,))
+    def find(cls, conversation_id, user_key):
+        """The conversation if it belongs to user_key"""
+        query = f"""
+        SELECT id, userKey, taskId, summary, compactedThrough FROM {cls.table_name}
+        WHERE id = %s AND userKey = %s
+        """
+        result = db.execute_query(query, (conversation_id, user_key))
+        return result[0] if result else None
     
     @classmethod
-    def get_completion_count(cls, task_id):
-        query = f"SELECT COUNT(*) as count FROM {cls.table_name} WHERE taskId = %s"
-        result = db.execute_query(query, (task_id,))
-        return result[0]['count'] if result else 0
+    def append(cls, conversation, turns):
+        """
+        Add (role, content) turns in order, storing a new() conversation
+        first, and return the last turn's number
+        """
+        now = datetime.utcnow()
+        with db.transaction():
+            if conversation.get('new'):
+                query = f"""
+                INSERT INTO {cls.table_name} (id, userKey, taskId, summary, createdAt, updatedAt)
+                VALUES (%s, %s, %s, '', %s, %s)
+                """
+                db.execute_query(query, (conversation['id'], conversation['userKey'], conversation['taskId'], now, now))
+            
+            query = f"""
+            UPDATE {cls.table_name} SET messageCount = LAST_INSERT_ID(messageCount + %s), updatedAt = %s
+            WHERE id = %s
+            """
+            last = db.execute_query(query, (len(turns), now, conversation['id']))
+            query = f"""
+            INSERT INTO {cls.messages_table} (conversationId, seq, role, content, createdAt)
+            VALUES (%s, %s, %s, %s, %s)
+            """
+            first = last - len(turns) + 1
+            db.execute_many(query, [(conversation['id'], first + offset, role, content, now)
+                                    for offset, (role, content) in enumerate(turns)])
+        conversation['new'] = False
+        return last
     
     @classmethod
-    def get_student_completions(cls, student_id):
-        return cls.get_by_student(student_id)
+    def get_window(cls, conversation):
+        """Turns not folded into the summary yet, oldest first"""
+        query = f"""
+        SELECT seq, role, content FROM {cls.messages_table}
+        WHERE conversationId = %s AND seq > %s ORDER BY seq
+        """
+        return db.execute_query(query, (conversation['id'], conversation['compactedThrough']))
     
     @classmethod
-    def get_completed_students_for_task(cls, task_id):
-        query = """
-        SELECT s.* FROM students s
-        JOIN submissions sub ON s.studentID = sub.studentId
-        WHERE sub.taskId = %s
+    def compact(cls, conversation_id, summary, through_seq):
+        """Store the new summary covering every turn up to through_seq"""
+        query = f"""
+        UPDATE {cls.table_name} SET summary = %s, compactedThrough = GREATEST(compactedThrough, %s)
+        WHERE id = %s
         """
-        return db.execute_query(query, (task_id,))
+        db.execute_query(query, (summary, through_seq, conversation_id))
 
 class Admin(BaseModel):
     table_name = 'admins'
@@ -371,6 +1623,9 @@ class Admin(BaseModel):
 class Teacher(BaseModel):
     table_name = 'teachers'
     
+    # Everything except passwordHash
+    SUMMARY_COLUMNS = TeacherSummary.__slots__
+    
     @classmethod
     def create_table(cls):
         query = f"""
@@ -387,6 +1642,7 @@ class Teacher(BaseModel):
         )
         """
         db.execute_query(query)
+        db.ensure_index(cls.table_name, 'idx_teachers_created', 'createdAt, id')
     
     @classmethod
     def create(cls, data):
@@ -428,14 +1684,41 @@ class Teacher(BaseModel):
     
     @classmethod
     def get_by_campus(cls, campus):
-        query = f"SELECT * FROM {cls.table_name} WHERE campus = %s"
+        query = f"SELECT {cls.column_list(cls.SUMMARY_COLUMNS)} FROM {cls.table_name} WHERE campus = %s"
         return db.execute_query(query, (campus,))
     
     @classmethod
     def get_all(cls):
-        query = f"SELECT * FROM {cls.table_name} ORDER BY createdAt DESC"
+        query = f"SELECT {cls.column_list(cls.SUMMARY_COLUMNS)} FROM {cls.table_name} ORDER BY createdAt DESC"
         return db.execute_query(query)
     
+    @classmethod
+    def get_page(cls, campus=None, name_prefix=None, after=None, limit=50):
+        """A filtered page of teachers in get_all order and the next page cursor"""
+        conditions = []
+        params = []
+        
+        if campus:
+            conditions.append("campus = %s")
+            params.append(campus)
+        if name_prefix:
+            conditions.append("name LIKE %s")
+            params.append(cls.like_prefix(name_prefix))
+        
+        return cls._get_page(conditions, params, after, limit, cls.SUMMARY_COLUMNS)
+    
+    @classmethod
+    def reserve_sequence(cls, prefix, count=1):
+        """Reserve count teacher ID numbers for the given campus prefix"""
+        name = f"teacher:{prefix}"
+        Sequence.seed_from(name, cls.table_name, 'teacherID', f"{prefix}-T")
+        return Sequence.reserve(name, count)
+    
+    @classmethod
+    def iter_all(cls, batch_size=500):
+        """Stream teachers in get_all order without loading the whole list"""
+        return cls._iter_keyset(batch_size=batch_size, columns=cls.SUMMARY_COLUMNS)
+    
     @classmethod
     def count_by_campus(cls, campus):
         query = f"SELECT COUNT(*) as count FROM {cls.table_name} WHERE campus = %s"
@@ -489,6 +1772,9 @@ class Teacher(BaseModel):
 class Campus(BaseModel):
     table_name = 'campuses'
     
+    # Default campuses as (name, code), in the order the forms list them
+    DEFAULTS = (('Subhash Nagar', 'SUB'), ('Yamuna', 'YAM'), ('I20', 'I20'))
+    
     @classmethod
     def create_table(cls):
         query = f"""
@@ -507,11 +1793,7 @@ class Campus(BaseModel):
         result = db.execute_query(query)
         
         if result and result[0]['count'] == 0:
-            default_campuses = [
-                (cls.generate_id(), 'Subhash Nagar', 'SUB', datetime.utcnow()),
-                (cls.generate_id(), 'Yamuna', 'YAM', datetime.utcnow()),
-                (cls.generate_id(), 'I20', 'I20', datetime.utcnow())
-            ]
+            default_campuses = [(cls.generate_id(), name, code, datetime.utcnow()) for name, code in cls.DEFAULTS]
             
             query = f"""
             INSERT INTO {cls.table_name} (id, name, code, createdAt)
@@ -519,12 +1801,24 @@ class Campus(BaseModel):
             """
             
             db.execute_many(query, default_campuses)
+            cache.invalidate(cls.table_name)
             print("✅ Default campuses initialized")
     
     @classmethod
     def get_all(cls):
-        query = f"SELECT * FROM {cls.table_name} ORDER BY name"
-        return db.execute_query(query)
+        def load():
+            query = f"SELECT * FROM {cls.table_name} ORDER BY name"
+            return db.execute_query(query)
+        return [dict(campus) for campus in cache.get(cls.table_name, load)]
+    
+    @classmethod
+    def get_names(cls):
+        """Campus names in the order they were added, defaults first, for the forms"""
+        defaults = [name for name, _ in cls.DEFAULTS]
+        def position(campus):
+            name = campus['name']
+            return (campus['createdAt'], defaults.index(name) if name in defaults else len(defaults), name)
+        return [campus['name'] for campus in sorted(cls.get_all(), key=position)]
 
 class Grade(BaseModel):
     table_name = 'grades'
@@ -559,16 +1853,52 @@ class Grade(BaseModel):
             """
             
             db.execute_many(query, default_grades)
+            cache.invalidate(cls.table_name)
             print("✅ Default grades initialized (1st to 10th Class)")
     
     @classmethod
     def get_all(cls):
-        query = f"SELECT * FROM {cls.table_name} ORDER BY level"
-        return db.execute_query(query)
+        def load():
+            query = f"SELECT * FROM {cls.table_name} ORDER BY level"
+            return db.execute_query(query)
+        return [dict(grade) for grade in cache.get(cls.table_name, load)]
+    
+    @classmethod
+    def get_names(cls):
+        return [grade['name'] for grade in cls.get_all()]
 
 class Notification(BaseModel):
     table_name = 'notifications'
     
+    # Per-user watermark and maintained unread counter, one row per user
+    read_state_table = 'notification_read_state'
+    # Sparse per-user overrides for items read individually after the watermark
+    reads_table = 'notification_reads'
+    # Expired notifications moved out of the hot table by the retention job
+    archive_table = 'notifications_archive'
+    
+    # Returned to clients; isRead is computed per user
+    COLUMNS = ('id', 'type', 'title', 'message', 'relatedId', 'targetUserType',
+               'targetCampus', 'targetGrade', 'icon', 'itemCount', 'link', 'createdAt')
+    
+    # Events with the same type, title and audience collapse into one row
+    DIGEST_KEY = ('type', 'title', 'targetUserType', 'targetCampus', 'targetGrade')
+    
+    # Per-thread buffer of events raised inside digest()
+    _digest_state = threading.local()
+    
+    # Watermark for users who have never marked anything as read
+    NEVER_READ = datetime(1970, 1, 1)
+    
+    @staticmethod
+    def _now():
+        """
+        Current time for createdAt and lastReadAt. Both are DATETIME(6), so
+        the microseconds are stored and a notification created just after
+        a mark-all-as-read still sorts after the watermark.
+        """
+        return datetime.utcnow()
+    
     @classmethod
     def create_table(cls):
         query = f"""
@@ -583,124 +1913,501 @@ class Notification(BaseModel):
             targetGrade VARCHAR(20),
             icon VARCHAR(50),
             isRead BOOLEAN DEFAULT FALSE,
-            createdAt DATETIME NOT NULL
+            itemCount INT NOT NULL DEFAULT 1,
+            link VARCHAR(255),
+            createdAt DATETIME(6) NOT NULL
+        )
+        """
+        db.execute_query(query)
+        db.ensure_column(cls.table_name, 'itemCount', 'INT NOT NULL DEFAULT 1')
+        db.ensure_column(cls.table_name, 'link', 'VARCHAR(255)')
+        db.ensure_column_type(cls.table_name, 'createdAt', 'DATETIME(6) NOT NULL')
+        
+        query = f"""
+        CREATE TABLE IF NOT EXISTS {cls.read_state_table} (
+            userKey VARCHAR(64) PRIMARY KEY,
+            userType VARCHAR(20) NOT NULL,
+            campus VARCHAR(50),
+            grade VARCHAR(20),
+            lastReadAt DATETIME(6) NOT NULL,
+            unreadCount INT NOT NULL DEFAULT 0,
+            INDEX idx_read_state_audience (userType, campus, grade)
+        )
+        """
+        db.execute_query(query)
+        db.ensure_column_type(cls.read_state_table, 'lastReadAt', 'DATETIME(6) NOT NULL')
+        
+        query = f"""
+        CREATE TABLE IF NOT EXISTS {cls.reads_table} (
+            userKey VARCHAR(64) NOT NULL,
+            notificationId VARCHAR(36) NOT NULL,
+            readAt DATETIME NOT NULL,
+            PRIMARY KEY (userKey, notificationId)
+        )
+        """
+        db.execute_query(query)
+        
+        query = f"""
+        CREATE TABLE IF NOT EXISTS {cls.archive_table} (
+            id VARCHAR(36) PRIMARY KEY,
+            type VARCHAR(50),
+            title VARCHAR(255) NOT NULL,
+            message TEXT,
+            relatedId VARCHAR(100),
+            targetUserType VARCHAR(20),
+            targetCampus VARCHAR(50),
+            targetGrade VARCHAR(20),
+            icon VARCHAR(50),
+            itemCount INT NOT NULL DEFAULT 1,
+            link VARCHAR(255),
+            createdAt DATETIME(6) NOT NULL,
+            archivedAt DATETIME NOT NULL,
+            INDEX idx_notifications_archive_created (createdAt)
         )
         """
         db.execute_query(query)
+        db.ensure_column(cls.archive_table, 'itemCount', 'INT NOT NULL DEFAULT 1')
+        db.ensure_column(cls.archive_table, 'link', 'VARCHAR(255)')
+        db.ensure_column_type(cls.archive_table, 'createdAt', 'DATETIME(6) NOT NULL')
+        
+        db.ensure_index(cls.table_name, 'idx_notifications_created', 'createdAt')
+        db.ensure_index(cls.table_name, 'idx_notifications_type_created', 'type, createdAt')
+        db.ensure_index(cls.table_name, 'idx_notifications_audience',
+                        'targetUserType, targetCampus, targetGrade, createdAt')
     
     @classmethod
     def create(cls, data):
-        notification_id = cls.generate_id()
+        state = cls._digest_state
+        if getattr(state, 'depth', 0):
+            # Inside digest(): written once the outermost block exits
+            state.events.append(data)
+            return None
         
+        if Config.NOTIFICATION_DIGEST_WINDOW_SECONDS:
+            return cls._write_digest([data])[0]
+        return cls._insert([cls._row(data)])[0]
+    
+    @classmethod
+    @contextmanager
+    def digest(cls, links=None):
+        """
+        Buffer notifications raised inside the block. On exit, events with
+        the same type, title and audience are written as one summary row
+        carrying the event count. links maps targetUserType to a detail
+        link for the summaries. Blocks nest; the outermost one writes.
+        """
+        state = cls._digest_state
+        if not getattr(state, 'depth', 0):
+            state.events = []
+            state.links = {}
+        state.depth = getattr(state, 'depth', 0) + 1
+        state.links.update(links or {})
+        
+        try:
+            yield
+        finally:
+            state.depth -= 1
+            if not state.depth:
+                events, links = state.events, state.links
+                state.events, state.links = [], {}
+                if events:
+                    cls._write_digest(events, links)
+    
+    @classmethod
+    def _row(cls, data, item_count=1, link=None):
+        return {
+            'id': cls.generate_id(),
+            'type': data.get('type'),
+            'title': data['title'],
+            'message': data.get('message', ''),
+            'relatedId': data.get('relatedId'),
+            'targetUserType': data.get('targetUserType'),
+            'targetCampus': data.get('targetCampus'),
+            'targetGrade': data.get('targetGrade'),
+            'icon': data.get('icon', 'fas fa-bell'),
+            'itemCount': item_count,
+            'link': data.get('link') or link,
+            'createdAt': cls._now()
+        }
+    
+    @staticmethod
+    def _summary_message(message, item_count):
+        return message if item_count == 1 else f"{message} (+{item_count - 1} more)"
+    
+    @classmethod
+    def _insert(cls, rows):
+        """Insert notification rows and bump each audience's unread counters"""
         query = f"""
-        INSERT INTO {cls.table_name} (id, type, title, message, relatedId, targetUserType, targetCampus, targetGrade, icon, isRead, createdAt)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        INSERT INTO {cls.table_name} ({cls.column_list(cls.COLUMNS)}, isRead)
+        VALUES ({cls.placeholders(cls.COLUMNS)}, FALSE)
         """
+        db.execute_many(query, [tuple(row[column] for column in cls.COLUMNS) for row in rows])
         
-        params = (
-            notification_id,
-            data.get('type'),
-            data['title'],
-            data.get('message', ''),
-            data.get('relatedId'),
-            data.get('targetUserType'),
-            data.get('targetCampus'),
-            data.get('targetGrade'),
-            data.get('icon', 'fas fa-bell'),
-            False,
-            datetime.utcnow()
-        )
+        # Bump the unread counter of every user who can see each new
+        # notification and whose watermark does not already cover it
+        for row in rows:
+            condition, condition_params = cls._recipient_condition(
+                row['targetUserType'], row['targetCampus'], row['targetGrade'])
+            if condition:
+                query = f"""
+                UPDATE {cls.read_state_table} SET unreadCount = unreadCount + 1
+                WHERE {condition} AND lastReadAt < %s
+                """
+                db.execute_query(query, condition_params + [row['createdAt']])
         
-        db.execute_query(query, params)
-        return notification_id
+        return [row['id'] for row in rows]
     
     @classmethod
-    def get_for_user(cls, user_type, user_id=None, campus=None, grade=None):
-        query = f"SELECT * FROM {cls.table_name} WHERE "
+    def _write_digest(cls, events, links=None):
+        """
+        Collapse events by DIGEST_KEY and write them. A group of events
+        about a single item (one relatedId) that matches a notification
+        about the same item created within the digest window is merged into
+        that row instead of adding a new one; events about different items
+        only collapse inside one digest() block. Returns the id written or
+        updated for each event.
+        """
+        links = links or {}
+        groups = {}
+        for data in events:
+            key = tuple(data.get(column) for column in cls.DIGEST_KEY)
+            groups.setdefault(key, []).append(data)
         
-        conditions = []
-        params = []
+        recent = {}
+        window = Config.NOTIFICATION_DIGEST_WINDOW_SECONDS
+        types = [notification_type for notification_type in {key[0] for key in groups} if notification_type]
+        if window and types:
+            query = f"""
+            SELECT id, {cls.column_list(cls.DIGEST_KEY)}, relatedId, link, createdAt FROM {cls.table_name}
+            WHERE createdAt >= %s AND type IN ({cls.placeholders(types)}) AND relatedId IS NOT NULL
+            ORDER BY createdAt
+            """
+            for row in db.execute_query(query, [datetime.utcnow() - timedelta(seconds=window)] + types):
+                recent[tuple(row[column] for column in cls.DIGEST_KEY) + (row['relatedId'],)] = row
+        
+        ids = {}
+        new_rows = []
+        for key, group in groups.items():
+            latest = group[-1]
+            link = links.get(latest.get('targetUserType'))
+            related_ids = {data.get('relatedId') for data in group}
+            recent_key = key + (latest.get('relatedId'),) if len(related_ids) == 1 else None
+            
+            if recent_key in recent:
+                ids[key] = cls._merge(recent[recent_key], latest, len(group), link)
+            else:
+                row = cls._row(latest, len(group), link if len(group) > 1 else None)
+                row['message'] = cls._summary_message(row['message'], len(group))
+                new_rows.append(row)
+                ids[key] = row['id']
+        
+        if new_rows:
+            cls._insert(new_rows)
+        return [ids[tuple(data.get(column) for column in cls.DIGEST_KEY)] for data in events]
+    
+    @classmethod
+    def _merge(cls, existing, data, count, link=None):
+        """
+        Fold count more events into an existing notification and move it to
+        the top as unread. Users who had already read it get their counter
+        bumped, unless their watermark covers the new time as well; users
+        still counting it as unread are left alone.
+        """
+        now = cls._now()
+        condition, params = cls._recipient_condition(
+            existing['targetUserType'], existing['targetCampus'], existing['targetGrade'])
+        if condition:
+            query = f"""
+            UPDATE {cls.read_state_table} SET unreadCount = unreadCount + 1
+            WHERE {condition} AND lastReadAt < %s AND (lastReadAt >= %s OR EXISTS (
+                SELECT 1 FROM {cls.reads_table} r
+                WHERE r.userKey = {cls.read_state_table}.userKey AND r.notificationId = %s))
+            """
+            db.execute_query(query, params + [now, existing['createdAt'], existing['id']])
+        db.execute_query(f"DELETE FROM {cls.reads_table} WHERE notificationId = %s", (existing['id'],))
         
+        # Assignments run left to right, so message sees the new itemCount
+        query = f"""
+        UPDATE {cls.table_name}
+        SET itemCount = itemCount + %s, message = CONCAT(%s, ' (+', itemCount - 1, ' more)'),
+            link = %s, createdAt = %s
+        WHERE id = %s
+        """
+        db.execute_query(query, (
+            count,
+            data.get('message', ''),
+            data.get('link') or link or existing['link'],
+            now,
+            existing['id']
+        ))
+        return existing['id']
+    
+    @staticmethod
+    def user_key(user_type, user_id):
+        return f"{user_type}:{user_id}"
+    
+    @staticmethod
+    def _audience_condition(user_type, campus=None, grade=None):
+        """SQL condition and params selecting the notifications a user can see"""
         if user_type == 'admin':
-            conditions.append("(targetUserType = 'admin' OR targetUserType = 'admin_and_teachers' OR targetUserType = 'admin_and_students')")
+            return "(targetUserType = 'admin' OR targetUserType = 'admin_and_teachers' OR targetUserType = 'admin_and_students')", []
         elif user_type == 'teacher':
             if campus:
-                conditions.append("((targetUserType = 'teacher' AND targetCampus = %s) OR targetUserType = 'all_teachers' OR targetUserType = 'admin_and_teachers')")
-                params.append(campus)
+                return "((targetUserType = 'teacher' AND targetCampus = %s) OR targetUserType = 'all_teachers' OR targetUserType = 'admin_and_teachers')", [campus]
         elif user_type == 'student':
             if campus and grade:
-                conditions.append("((targetUserType = 'student' AND targetCampus = %s AND targetGrade = %s) OR targetUserType = 'all_students' OR targetUserType = 'admin_and_students')")
-                params.extend([campus, grade])
+                return "((targetUserType = 'student' AND targetCampus = %s AND targetGrade = %s) OR targetUserType = 'all_students' OR targetUserType = 'admin_and_students')", [campus, grade]
+        return None, []
+    
+    # Join predicate between notifications n and read-state rows st: the
+    # audience rules of _audience_condition written over both tables
+    RECIPIENT_MATCH = """
+        ((st.userType = 'admin' AND n.targetUserType IN ('admin', 'admin_and_teachers', 'admin_and_students'))
+         OR (st.userType = 'teacher' AND (n.targetUserType IN ('all_teachers', 'admin_and_teachers')
+                                          OR (n.targetUserType = 'teacher' AND n.targetCampus = st.campus)))
+         OR (st.userType = 'student' AND (n.targetUserType IN ('all_students', 'admin_and_students')
+                                          OR (n.targetUserType = 'student' AND n.targetCampus = st.campus
+                                              AND n.targetGrade = st.grade))))
+    """
+    
+    @staticmethod
+    def _recipient_condition(target_user_type, campus=None, grade=None):
+        """
+        SQL condition on read-state rows for the users who can see a
+        notification with this target; the inverse of _audience_condition.
+        """
+        if target_user_type == 'admin':
+            return "userType = 'admin'", []
+        elif target_user_type == 'admin_and_teachers':
+            return "userType IN ('admin', 'teacher')", []
+        elif target_user_type == 'admin_and_students':
+            return "userType IN ('admin', 'student')", []
+        elif target_user_type == 'teacher':
+            return "userType = 'teacher' AND campus = %s", [campus]
+        elif target_user_type == 'all_teachers':
+            return "userType = 'teacher'", []
+        elif target_user_type == 'student':
+            return "userType = 'student' AND campus = %s AND grade = %s", [campus, grade]
+        elif target_user_type == 'all_students':
+            return "userType = 'student'", []
+        return None, []
+    
+    @classmethod
+    def _seed_read_state(cls, user_key, user_type, campus=None, grade=None):
+        """
+        (Re)create a user's read state with every visible notification
+        unread. Runs once per user, or again after their campus or grade
+        changes, since the counter is only valid for one audience.
+        """
+        condition, params = cls._audience_condition(user_type, campus, grade)
+        if not condition:
+            return 0
         
-        if not conditions:
-            return []
-            
-        query += " OR ".join(conditions) + " ORDER BY createdAt DESC LIMIT 50"
-        return db.execute_query(query, params)
+        db.execute_query(f"DELETE FROM {cls.reads_table} WHERE userKey = %s", (user_key,))
+        query = f"""
+        REPLACE INTO {cls.read_state_table} (userKey, userType, campus, grade, lastReadAt, unreadCount)
+        SELECT %s, %s, %s, %s, %s, COUNT(*) FROM {cls.table_name} WHERE {condition}
+        """
+        db.execute_query(query, [user_key, user_type, campus, grade, cls.NEVER_READ] + params)
+        
+        result = db.execute_query(f"SELECT unreadCount FROM {cls.read_state_table} WHERE userKey = %s", (user_key,))
+        return result[0]['unreadCount'] if result else 0
+    
+    @classmethod
+    def _select_for_user(cls, condition):
+        """Visible notifications with per-user isRead and the user's counter"""
+        return f"""
+        SELECT {cls.column_list(cls.COLUMNS, 'n')},
+               COALESCE(n.createdAt <= st.lastReadAt OR r.notificationId IS NOT NULL, FALSE) AS isRead,
+               st.unreadCount AS unreadCount, st.campus AS stateCampus, st.grade AS stateGrade
+        FROM {cls.table_name} n
+        LEFT JOIN {cls.read_state_table} st ON st.userKey = %s
+        LEFT JOIN {cls.reads_table} r ON r.userKey = st.userKey AND r.notificationId = n.id
+        WHERE {condition}
+        ORDER BY n.createdAt DESC LIMIT 50
+        """
+    
+    @classmethod
+    def get_for_user(cls, user_type, user_id=None, campus=None, grade=None):
+        notifications, _ = cls.get_for_user_with_unread_count(user_type, user_id, campus, grade)
+        return notifications
     
     @classmethod
     def get_unread_count(cls, user_type, user_id=None, campus=None, grade=None):
-        query = f"SELECT COUNT(*) as count FROM {cls.table_name} WHERE isRead = FALSE AND "
+        """The user's maintained counter: a single primary-key lookup"""
+        user_key = cls.user_key(user_type, user_id)
+        query = f"SELECT unreadCount, campus, grade FROM {cls.read_state_table} WHERE userKey = %s"
+        result = db.execute_query(query, (user_key,))
         
-        conditions = []
-        params = []
+        if result and (result[0]['campus'], result[0]['grade']) == (campus, grade):
+            return result[0]['unreadCount']
+        return cls._seed_read_state(user_key, user_type, campus, grade)
+    
+    @classmethod
+    def get_for_user_with_unread_count(cls, user_type, user_id=None, campus=None, grade=None):
+        """
+        Latest notifications and the unread count in a single round trip.
+        Returns a (notifications, unread_count) tuple.
+        """
+        condition, params = cls._audience_condition(user_type, campus, grade)
+        if not condition:
+            return [], 0
         
-        if user_type == 'admin':
-            conditions.append("(targetUserType = 'admin' OR targetUserType = 'admin_and_teachers' OR targetUserType = 'admin_and_students')")
-        elif user_type == 'teacher':
-            if campus:
-                conditions.append("((targetUserType = 'teacher' AND targetCampus = %s) OR targetUserType = 'all_teachers' OR targetUserType = 'admin_and_teachers')")
-                params.append(campus)
-        elif user_type == 'student':
-            if campus and grade:
-                conditions.append("((targetUserType = 'student' AND targetCampus = %s AND targetGrade = %s) OR targetUserType = 'all_students' OR targetUserType = 'admin_and_students')")
-                params.extend([campus, grade])
+        user_key = cls.user_key(user_type, user_id)
+        notifications = db.execute_query(cls._select_for_user(condition), [user_key] + params)
+        if not notifications:
+            return [], 0
         
-        if not conditions:
-            return 0
-            
-        query += " OR ".join(conditions)
-        result = db.execute_query(query, params)
-        return result[0]['count'] if result else 0
+        first = notifications[0]
+        if first['unreadCount'] is None or (first['stateCampus'], first['stateGrade']) != (campus, grade):
+            # First visit or a changed audience: seed the counter and re-read the flags
+            cls._seed_read_state(user_key, user_type, campus, grade)
+            notifications = db.execute_query(cls._select_for_user(condition), [user_key] + params)
+        
+        unread_count = (notifications[0]['unreadCount'] or 0) if notifications else 0
+        for notification in notifications:
+            notification['isRead'] = bool(notification['isRead'])
+            for key in ('unreadCount', 'stateCampus', 'stateGrade'):
+                notification.pop(key, None)
+        return notifications, unread_count
     
     @classmethod
-    def mark_as_read(cls, notification_id, user_type, user_id=None, campus=None, grade=None):
-        # First verify the user has access to this notification
-        notifications = cls.get_for_user(user_type, user_id, campus, grade)
-        accessible_ids = [n['id'] for n in notifications]
-        
-        if notification_id not in accessible_ids:
+    def mark_as_read(cls, notification_id, user_type, user_id=None):
+        """
+        Mark one notification read for this user in a single round trip.
+        The audience comes from the user's read state, checked against
+        their current student or teacher record inside the statement, so an
+        id the user cannot see matches nothing; the counter is decremented
+        by a second statement in the same call only when a row was added.
+        Returns the number of rows affected: 0 when the notification is not
+        visible or was already read.
+        """
+        user_key = cls.user_key(user_type, user_id)
+        query = f"""
+        INSERT IGNORE INTO {cls.reads_table} (userKey, notificationId, readAt)
+        SELECT st.userKey, n.id, %s
+        FROM {cls.table_name} n
+        JOIN {cls.read_state_table} st ON st.userKey = %s
+        LEFT JOIN {Student.table_name} s ON st.userType = 'student' AND s.studentID = %s
+        LEFT JOIN {Teacher.table_name} t ON st.userType = 'teacher' AND t.teacherID = %s
+        WHERE n.id = %s AND n.createdAt > st.lastReadAt AND {cls.RECIPIENT_MATCH}
+          AND (st.userType = 'admin' OR (s.campus = st.campus AND s.grade = st.grade) OR t.campus = st.campus);
+        SET @marked = ROW_COUNT();
+        UPDATE {cls.read_state_table} SET unreadCount = GREATEST(unreadCount - 1, 0)
+        WHERE userKey = %s AND @marked > 0
+        """
+        params = (datetime.utcnow(), user_key, user_id, user_id, notification_id, user_key)
+        return db.execute_update(query, params)
+    
+    @classmethod
+    def mark_all_as_read(cls, user_type, user_id=None, campus=None, grade=None):
+        """
+        Move the user's watermark to now and zero the counter: one row
+        write. Notifications created after it, even within the same
+        second, stay unread and are counted by _insert.
+        """
+        condition, _ = cls._audience_condition(user_type, campus, grade)
+        if not condition:
             return 0
         
-        query = f"UPDATE {cls.table_name} SET isRead = TRUE WHERE id = %s"
-        return db.execute_query(query, (notification_id,))
+        query = f"""
+        INSERT INTO {cls.read_state_table} (userKey, userType, campus, grade, lastReadAt, unreadCount)
+        VALUES (%s, %s, %s, %s, %s, 0)
+        ON DUPLICATE KEY UPDATE userType = VALUES(userType), campus = VALUES(campus), grade = VALUES(grade),
+                                lastReadAt = VALUES(lastReadAt), unreadCount = 0
+        """
+        params = (cls.user_key(user_type, user_id), user_type, campus, grade, cls._now())
+        return db.execute_update(query, params)
     
     @classmethod
-    def mark_all_as_read(cls, user_type, user_id=None, campus=None, grade=None):
-        query = f"UPDATE {cls.table_name} SET isRead = TRUE WHERE isRead = FALSE AND "
+    def expire_batch(cls, notification_type, cutoff, batch_size=1000, archive=True):
+        """
+        Remove up to batch_size notifications of one type created before
+        cutoff, oldest first. Rows are copied to the archive table first
+        when archive is set, read overrides pointing at them are dropped and
+        unread counters that still included them are decremented. Returns
+        the removed rows so callers can export them.
+        """
+        query = f"""
+        SELECT {cls.column_list(cls.COLUMNS)} FROM {cls.table_name}
+        WHERE type <=> %s AND createdAt < %s
+        ORDER BY createdAt LIMIT %s
+        """
+        rows = db.execute_query(query, (notification_type, cutoff, batch_size))
+        if not rows:
+            return []
         
-        conditions = []
-        params = []
+        ids = [row['id'] for row in rows]
+        marks = cls.placeholders(ids)
         
-        if user_type == 'admin':
-            conditions.append("(targetUserType = 'admin' OR targetUserType = 'admin_and_teachers' OR targetUserType = 'admin_and_students')")
-        elif user_type == 'teacher':
-            if campus:
-                conditions.append("((targetUserType = 'teacher' AND targetCampus = %s) OR targetUserType = 'all_teachers' OR targetUserType = 'admin_and_teachers')")
-                params.append(campus)
-        elif user_type == 'student':
-            if campus and grade:
-                conditions.append("((targetUserType = 'student' AND targetCampus = %s AND targetGrade = %s) OR targetUserType = 'all_students' OR targetUserType = 'admin_and_students')")
-                params.extend([campus, grade])
+        if archive:
+            query = f"""
+            INSERT IGNORE INTO {cls.archive_table} ({cls.column_list(cls.COLUMNS)}, archivedAt)
+            SELECT {cls.column_list(cls.COLUMNS)}, %s FROM {cls.table_name} WHERE id IN ({marks})
+            """
+            db.execute_query(query, [datetime.utcnow()] + ids)
         
-        if not conditions:
-            return 0
+        # Users for whom these notifications were still unread
+        query = f"""
+        SELECT st.userKey, COUNT(*) AS count
+        FROM {cls.table_name} n
+        JOIN {cls.read_state_table} st ON n.createdAt > st.lastReadAt AND {cls.RECIPIENT_MATCH}
+        LEFT JOIN {cls.reads_table} r ON r.userKey = st.userKey AND r.notificationId = n.id
+        WHERE n.id IN ({marks}) AND r.notificationId IS NULL
+        GROUP BY st.userKey
+        """
+        unread = db.execute_query(query, ids)
+        
+        db.execute_query(f"DELETE FROM {cls.reads_table} WHERE notificationId IN ({marks})", ids)
+        db.execute_query(f"DELETE FROM {cls.table_name} WHERE id IN ({marks})", ids)
+        
+        if unread:
+            query = f"UPDATE {cls.read_state_table} SET unreadCount = GREATEST(unreadCount - %s, 0) WHERE userKey = %s"
+            db.execute_many(query, [(row['count'], row['userKey']) for row in unread])
+        
+        return rows
+    
+    @classmethod
+    def prune_read_overrides(cls, batch_size=1000):
+        """
+        Drop per-item read rows already covered by the user's watermark
+        after a later mark-all-as-read. Returns the number removed.
+        """
+        removed = 0
+        while True:
+            query = f"""
+            SELECT r.userKey, r.notificationId
+            FROM {cls.reads_table} r
+            JOIN {cls.read_state_table} st ON st.userKey = r.userKey
+            JOIN {cls.table_name} n ON n.id = r.notificationId
+            WHERE n.createdAt <= st.lastReadAt
+            LIMIT %s
+            """
+            rows = db.execute_query(query, (batch_size,))
+            if not rows:
+                return removed
             
-        query += " OR ".join(conditions)
-        return db.execute_query(query, params)
+            pairs = ", ".join(["(%s, %s)"] * len(rows))
+            params = [value for row in rows for value in (row['userKey'], row['notificationId'])]
+            db.execute_query(f"DELETE FROM {cls.reads_table} WHERE (userKey, notificationId) IN ({pairs})", params)
+            removed += len(rows)
+            
+            if len(rows) < batch_size:
+                return removed
+    
+    @classmethod
+    def get_types(cls):
+        result = db.execute_query(f"SELECT DISTINCT type FROM {cls.table_name}")
+        return [row['type'] for row in result]
     
     @classmethod
     def create_task_notification(cls, task, action="created"):
+        # One batched write, merged with recent edits of the same task
+        with cls.digest():
+            cls._create_task_notifications(task, action)
+    
+    @classmethod
+    def _create_task_notifications(cls, task, action):
         # Notify admin
         cls.create({
             'type': 'task',
@@ -778,6 +2485,12 @@ class Notification(BaseModel):
     
     @classmethod
     def create_submission_notification(cls, submission, student, task):
+        # Both rows go out in one batched write
+        with cls.digest():
+            cls._create_submission_notifications(submission, student, task)
+    
+    @classmethod
+    def _create_submission_notifications(cls, submission, student, task):
         # Notify admin
         cls.create({
             'type': 'submission',
@@ -802,14 +2515,22 @@ class Notification(BaseModel):
 def initialize_default_data():
     """Initialize all database tables and default data"""
     # Create tables
+    cache.create_table()
     Student.create_table()
     Teacher.create_table()
     Task.create_table()
+    CodeBlob.create_table()
     Submission.create_table()
+    SubmissionAttempt.create_table()
+    Draft.create_table()
+    SubmissionSignature.create_table()
+    SearchIndex.create_table()
+    Conversation.create_table()
     Admin.create_table()
     Campus.create_table()
     Grade.create_table()
     Notification.create_table()
+    Sequence.create_table()
     
     # Initialize default data
     Admin.create_default()
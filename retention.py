@@ -0,0 +1,93 @@
+import argparse
+import gzip
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+from config import Config
+from models import Notification
+
+def retention_days(notification_type):
+    return Config.NOTIFICATION_RETENTION_DAYS.get(notification_type, Config.NOTIFICATION_RETENTION_DEFAULT_DAYS)
+
+def open_export_file(export_dir, now):
+    """Gzipped JSONL file for this run's expired notifications"""
+    os.makedirs(export_dir, exist_ok=True)
+    path = os.path.join(export_dir, f"notifications-{now.strftime('%Y%m%d-%H%M%S')}.jsonl.gz")
+    return gzip.open(path, 'wt', encoding='utf-8'), path
+
+def run_retention(now=None, batch_size=None, archive=None, export_dir=None):
+    """
+    Expire notifications older than their type's retention period in small
+    batches, so no statement holds locks on the hot table for long.
+    Returns a dict of removed row counts per type.
+    """
+    now = now or datetime.utcnow()
+    batch_size = batch_size or Config.NOTIFICATION_RETENTION_BATCH_SIZE
+    archive = Config.NOTIFICATION_ARCHIVE_TABLE if archive is None else archive
+    export_dir = export_dir or Config.NOTIFICATION_ARCHIVE_DIR
+    
+    export_file = None
+    export_path = None
+    removed = {}
+    
+    try:
+        for notification_type in Notification.get_types():
+            cutoff = now - timedelta(days=retention_days(notification_type))
+            removed[notification_type] = 0
+            
+            while True:
+                rows = Notification.expire_batch(notification_type, cutoff, batch_size, archive)
+                
+                if rows and export_dir:
+                    if export_file is None:
+                        export_file, export_path = open_export_file(export_dir, now)
+                    for row in rows:
+                        export_file.write(json.dumps(row, default=str) + '\n')
+                
+                removed[notification_type] += len(rows)
+                if len(rows) < batch_size:
+                    break
+        
+        overrides = Notification.prune_read_overrides(batch_size)
+    finally:
+        if export_file is not None:
+            export_file.close()
+    
+    print(f"🧹 Notification retention removed {sum(removed.values())} notifications "
+          f"and {overrides} read markers")
+    if export_path:
+        print(f"📦 Expired notifications exported to {export_path}")
+    return removed
+
+def start_retention_scheduler(interval_hours=None):
+    """Run retention in a daemon thread every interval_hours"""
+    interval_hours = interval_hours or Config.NOTIFICATION_RETENTION_INTERVAL_HOURS
+    if not interval_hours:
+        return None
+    
+    def run():
+        try:
+            run_retention()
+        except Exception as e:
+            print(f"Notification retention error: {e}")
+        schedule()
+    
+    def schedule():
+        timer = threading.Timer(interval_hours * 3600, run)
+        timer.daemon = True
+        timer.start()
+        return timer
+    
+    return schedule()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Expire old notifications")
+    parser.add_argument('--batch-size', type=int, help="rows per delete batch")
+    parser.add_argument('--no-archive', action='store_true', help="delete without copying to the archive table")
+    parser.add_argument('--export-dir', help="write expired rows to a gzipped JSONL file in this directory")
+    args = parser.parse_args()
+    
+    run_retention(batch_size=args.batch_size,
+                  archive=False if args.no_archive else None,
+                  export_dir=args.export_dir)
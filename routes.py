@@ -1,17 +1,40 @@
-from flask import render_template, request, jsonify, redirect, url_for, session, send_file
+from flask import render_template, request, jsonify, redirect, url_for, session, send_file, Response
 from functools import wraps
+from collections import Counter, defaultdict
 import json
-import pandas as pd
-from io import BytesIO
 import bcrypt
 import jwt
-import requests
 from datetime import datetime, timedelta
 from database import db
 from config import Config
+from utils import (
+    generate_student_id, generate_teacher_id, import_students_from_excel, write_xlsx_export, iter_csv_export, student_export_row, teacher_export_row,
+    STUDENT_EXPORT_HEADERS, TEACHER_EXPORT_HEADERS, STUDENT_EXPORT_INFO, TEACHER_EXPORT_INFO
+)
 
 # Import models
-from models import Student, Task, Submission, Admin, Teacher, Campus, Grade, Notification, initialize_default_data
+from models import Student, Task, Submission, SubmissionAttempt, SubmissionSignature, SearchIndex, Conversation, Admin, Teacher, Campus, Grade, Notification, initialize_default_data
+from models import StudentSummary, TeacherSummary
+from cache import roster_cache
+from drafts import drafts
+from conversation import build_messages, clip, split_window, summarize
+from ai_gateway import ai_gateway
+from ai_scheduler import scheduler as ai_scheduler, single_flight, fingerprint, AIBusy, PRIORITY_SUBMIT, PRIORITY_TASK, PRIORITY_PRACTICE
+
+# Rows per page on the paginated list pages
+PAGE_SIZE = 50
+
+# Sections have no table; campuses and grades come from Campus/Grade.get_names()
+SECTIONS = [
+    'LL', 'HH', 'DD', 'FF', 
+    'Tata Boys', 'Tata Girls', 
+    'Google Boys', 'Google Girls', 
+    'Infosys Boys', 'Infosys Girls', 
+    'Adobe', 'Adobe Boys', 'Adobe Girls',
+    'Mahendra Boys', 'Mahendra Girls',
+    'Verizon Boys', 'Verizon Girls', 
+    'Microsoft Boys', 'Microsoft Girls'
+]
 
 # Decorators
 def login_required(f):
@@ -67,119 +90,63 @@ def verify_token(token):
     except jwt.InvalidTokenError:
         return None
 
-def generate_student_id(campus, sequence):
-    campus_prefix = {
-        'Subhash Nagar': 'SUB',
-        'Yamuna': 'YAM', 
-        'I20': 'I20'
-    }.get(campus, 'STD')
-    return f"{campus_prefix}-{sequence:03d}"
-
-def generate_teacher_id(campus, sequence):
-    campus_prefix = {
-        'Subhash Nagar': 'SUB',
-        'Yamuna': 'YAM', 
-        'I20': 'I20'
-    }.get(campus, 'TCH')
-    return f"{campus_prefix}-T{sequence:03d}"
-
-def export_students_to_excel(students):
-    # Create DataFrame with student data including passwords
-    student_data = []
-    for s in students:
-        student_data.append({
-            'studentID': s['studentID'],
-            'name': s['name'],
-            'campus': s['campus'],
-            'grade': s['grade'],
-            'section': s.get('section', ''),
-            'password': '123456'  # Default password for all students
-        })
-    
-    df = pd.DataFrame(student_data)
-    
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, sheet_name='Students', index=False)
-        
-        # Add a info sheet with instructions
-        info_data = {
-            'Information': [
-                'This file contains student login credentials',
-                'All students have default password: 123456',
-                'Students should change their password after first login',
-                'Keep this file secure and do not share publicly'
-            ]
-        }
-        info_df = pd.DataFrame(info_data)
-        info_df.to_excel(writer, sheet_name='Instructions', index=False)
-    
-    output.seek(0)
-    return output
-
-def export_teachers_to_excel(teachers):
-    # Create DataFrame with teacher data including passwords
-    teacher_data = []
-    for t in teachers:
-        teacher_data.append({
-            'teacherID': t['teacherID'],
-            'name': t['name'],
-            'email': t['email'],
-            'campus': t['campus'],
-            'password': '123456'  # Default password for all teachers
-        })
-    
-    df = pd.DataFrame(teacher_data)
-    
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, sheet_name='Teachers', index=False)
-        
-        # Add a info sheet with instructions
-        info_data = {
-            'Information': [
-                'This file contains teacher login credentials',
-                'All teachers have default password: 123456',
-                'Teachers should change their password after first login',
-                'Keep this file secure and do not share publicly'
-            ]
-        }
-        info_df = pd.DataFrame(info_data)
-        info_df.to_excel(writer, sheet_name='Instructions', index=False)
-    
-    output.seek(0)
-    return output
-
-def import_students_from_excel(file):
-    try:
-        df = pd.read_excel(file)
-        students = []
-        
-        for idx, row in df.iterrows():
-            student_id = generate_student_id(row['campus'], idx + 1)
-            student = {
-                'studentID': student_id,
-                'name': row['name'],
-                'campus': row['campus'],
-                'grade': row['grade'],
-                'section': row.get('section', 'LL'),
-                'password': '123456'  # Default password
-            }
-            students.append(student)
-        
-        return students
-    except Exception as e:
-        print(f"Error importing Excel: {e}")
-        return []
+def list_filters(*names):
+    """Non-empty list filters from the query string, for queries and page links"""
+    filters = {}
+    for name in names:
+        value = request.args.get(name, '').strip()
+        if value:
+            filters[name] = value
+    return filters
+
+def build_export_response(basename, sheet_name, headers, rows, info_lines):
+    """Stream an export as xlsx (default), csv or csv.gz based on ?format="""
+    export_format = request.args.get('format', 'xlsx').lower()
+    
+    if export_format in ('csv', 'csv.gz'):
+        compress = export_format == 'csv.gz'
+        response = Response(iter_csv_export(headers, rows, compress=compress),
+                            mimetype='application/gzip' if compress else 'text/csv')
+        response.headers['Content-Disposition'] = f'attachment; filename="{basename}.{export_format}"'
+        return response
+    
+    excel_file = write_xlsx_export(sheet_name, headers, rows, info_lines)
+    return send_file(excel_file, 
+                    download_name=f'{basename}.xlsx',
+                    as_attachment=True)
 
 def get_student_progress_data(campus=None):
-    """Get comprehensive student progress data for admin/teacher dashboard"""
-    students = Student.get_all()
-    tasks = Task.get_all()
-    
-    # Filter students by campus if provided
-    if campus:
-        students = [s for s in students if s['campus'] == campus]
+    """
+    Get comprehensive student progress data for admin/teacher dashboard.
+    Built from a few grouped queries; with a campus every query is scoped
+    to it in SQL, so the cost follows the size of that campus.
+    """
+    eligibility = Task.eligibility()
+    tasks = eligibility.tasks_for(campus)
+    student_groups = Student.get_group_counts(campus)
+    submission_groups = Submission.get_group_counts(campus)
+    task_completions = Submission.count_by_task(campus)
+    task_attempts = SubmissionAttempt.count_by_task(campus)
+    
+    def tally(rows, key):
+        totals = Counter()
+        for row in rows:
+            totals[key(row)] += row['count']
+        return totals
+    
+    students_by_campus = tally(student_groups, lambda row: row['campus'])
+    students_by_grade = tally(student_groups, lambda row: row['grade'])
+    students_by_section = tally(student_groups, lambda row: row['section'])
+    students_by_campus_grade = tally(student_groups, lambda row: (row['campus'], row['grade']))
+    submissions_by_campus = tally(submission_groups, lambda row: row['campus'])
+    submissions_by_grade = tally(submission_groups, lambda row: row['grade'])
+    submissions_by_section = tally(submission_groups, lambda row: row['section'])
+    
+    total_students = sum(students_by_campus.values())
+    
+    # Tasks in scope, and eligible students per catalog task in one product
+    scope = eligibility.matching(campus)
+    students_per_task = eligibility.students_per_task(students_by_campus_grade)
     
     progress_data = {
         'campus_wise': {},
@@ -187,7 +154,7 @@ def get_student_progress_data(campus=None):
         'task_wise': {},
         'section_wise': {},
         'overall_stats': {
-            'total_students': len(students),
+            'total_students': total_students,
             'total_tasks': len(tasks),
             'total_submissions': 0,
             'completion_rate': 0
@@ -195,79 +162,42 @@ def get_student_progress_data(campus=None):
     }
     
     # Campus-wise progress
-    campuses = ['Subhash Nagar', 'Yamuna', 'I20']
-    for campus_name in campuses:
-        campus_students = [s for s in students if s['campus'] == campus_name]
-        campus_tasks = []
-        
-        for task in tasks:
-            campus_target = json.loads(task['campusTarget']) if isinstance(task['campusTarget'], str) else task.get('campusTarget', [])
-            if campus_name in campus_target:
-                campus_tasks.append(task)
-        
-        total_possible_submissions = len(campus_students) * len(campus_tasks)
-        actual_submissions = 0
-        
-        for student in campus_students:
-            student_submissions = Submission.get_by_student(student['studentID'])
-            actual_submissions += len(student_submissions)
+    for campus_name in Campus.get_names():
+        campus_task_count = int((scope & eligibility.matching(campus=campus_name)).sum())
+        campus_student_count = students_by_campus[campus_name]
+        total_possible_submissions = campus_student_count * campus_task_count
+        actual_submissions = submissions_by_campus[campus_name]
         
         progress_data['campus_wise'][campus_name] = {
-            'total_students': len(campus_students),
-            'total_tasks': len(campus_tasks),
+            'total_students': campus_student_count,
+            'total_tasks': campus_task_count,
             'completed_submissions': actual_submissions,
             'completion_rate': round((actual_submissions / total_possible_submissions * 100), 2) if total_possible_submissions > 0 else 0
         }
     
     # Grade-wise progress
-    grades = [f"{i}th Class" for i in range(1, 11)]
-    for grade in grades:
-        grade_students = [s for s in students if s['grade'] == grade]
-        grade_tasks = []
-        
-        for task in tasks:
-            grade_target = json.loads(task['gradeTarget']) if isinstance(task['gradeTarget'], str) else task.get('gradeTarget', [])
-            if grade in grade_target:
-                grade_tasks.append(task)
-        
-        total_possible_submissions = len(grade_students) * len(grade_tasks)
-        actual_submissions = 0
-        
-        for student in grade_students:
-            student_submissions = Submission.get_by_student(student['studentID'])
-            actual_submissions += len(student_submissions)
+    for grade in Grade.get_names():
+        grade_task_count = int((scope & eligibility.matching(grade=grade)).sum())
+        grade_student_count = students_by_grade[grade]
+        total_possible_submissions = grade_student_count * grade_task_count
+        actual_submissions = submissions_by_grade[grade]
         
         progress_data['grade_wise'][grade] = {
-            'total_students': len(grade_students),
-            'total_tasks': len(grade_tasks),
+            'total_students': grade_student_count,
+            'total_tasks': grade_task_count,
             'completed_submissions': actual_submissions,
             'completion_rate': round((actual_submissions / total_possible_submissions * 100), 2) if total_possible_submissions > 0 else 0
         }
     
     # Section-wise progress
-    sections = [
-        'LL', 'HH', 'DD', 'FF', 
-        'Tata Boys', 'Tata Girls', 
-        'Google Boys', 'Google Girls', 
-        'Infosys Boys', 'Infosys Girls', 
-        'Adobe', 'Adobe Boys', 'Adobe Girls',
-        'Mahendra Boys', 'Mahendra Girls',
-        'Verizon Boys', 'Verizon Girls', 
-        'Microsoft Boys', 'Microsoft Girls'
-    ]
-    
-    for section in sections:
-        section_students = [s for s in students if s.get('section') == section]
-        if section_students:  # Only include sections that have students
-            total_possible_submissions = len(section_students) * len(tasks)
-            actual_submissions = 0
-            
-            for student in section_students:
-                student_submissions = Submission.get_by_student(student['studentID'])
-                actual_submissions += len(student_submissions)
+    for section in SECTIONS:
+        section_student_count = students_by_section[section]
+        if section_student_count:  # Only include sections that have students
+            total_possible_submissions = section_student_count * len(tasks)
+            actual_submissions = submissions_by_section[section]
             
             progress_data['section_wise'][section] = {
-                'total_students': len(section_students),
+                'total_students': section_student_count,
                 'total_tasks': len(tasks),
                 'completed_submissions': actual_submissions,
                 'completion_rate': round((actual_submissions / total_possible_submissions * 100), 2) if total_possible_submissions > 0 else 0
@@ -275,34 +205,59 @@ def get_student_progress_data(campus=None):
     
     # Task-wise progress
     for task in tasks:
-        completions = Submission.get_task_completions(task['id'])
-        total_students = 0
-        
-        campus_target = json.loads(task['campusTarget']) if isinstance(task['campusTarget'], str) else task.get('campusTarget', [])
-        grade_target = json.loads(task['gradeTarget']) if isinstance(task['gradeTarget'], str) else task.get('gradeTarget', [])
-        
-        for campus_name in campus_target:
-            for grade in grade_target:
-                students_count = len(Student.get_by_campus_grade(campus_name, grade))
-                total_students += students_count
+        completed = task_completions.get(task['id'], 0)
+        attempts = task_attempts.get(task['id'], 0)
+        total_students_for_task = int(students_per_task[eligibility.positions[task['id']]])
         
         progress_data['task_wise'][task['title']] = {
             'task_id': task['id'],
-            'completed': len(completions),
-            'total_students': total_students,
-            'pending': total_students - len(completions),
-            'completion_rate': round((len(completions) / total_students * 100), 2) if total_students > 0 else 0
+            'completed': completed,
+            'total_students': total_students_for_task,
+            'pending': total_students_for_task - completed,
+            'attempts': attempts,
+            'avg_attempts': round(attempts / completed, 1) if completed > 0 else 0,
+            'completion_rate': round((completed / total_students_for_task * 100), 2) if total_students_for_task > 0 else 0
         }
     
     # Overall stats
-    total_submissions = sum([len(Submission.get_by_student(s['studentID'])) for s in students])
-    total_possible_submissions = len(students) * len(tasks)
+    total_submissions = sum(submissions_by_campus.values())
+    total_possible_submissions = int(students_per_task[scope].sum())
     
     progress_data['overall_stats']['total_submissions'] = total_submissions
     progress_data['overall_stats']['completion_rate'] = round((total_submissions / total_possible_submissions * 100), 2) if total_possible_submissions > 0 else 0
     
     return progress_data
 
+# OpenRouter request helpers
+def openrouter_completion(messages):
+    """Text of one (non-streamed) OpenRouter completion, fetched by the async gateway"""
+    return ai_gateway.complete(messages)
+
+def ai_user_key():
+    """Scheduler key of the logged-in user, so each user gets a fair share"""
+    payload = verify_token(session.get('token')) or {}
+    return Notification.user_key(payload.get('user_type'), payload.get('user_id'))
+
+def ai_completion(messages, endpoint, priority=PRIORITY_PRACTICE):
+    """
+    OpenRouter completion run through the AI scheduler; raises AIBusy
+    under load. Identical requests to the same endpoint and priority that
+    are in flight together (a class running the same starter code) share
+    one call. A leader turned away for its own user's limit does not turn
+    the others away; they go to the scheduler themselves.
+    """
+    user_key = ai_user_key()
+    key = (endpoint, priority, Config.OPENROUTER_MODEL, fingerprint(messages))
+    return single_flight.do(key, lambda: ai_scheduler.run(user_key, priority, lambda: openrouter_completion(messages)),
+                            retry_if=lambda error: isinstance(error, AIBusy) and error.per_user)
+
+def ai_busy_response(error, field="message"):
+    """Quick 503 telling the browser when to try again"""
+    response = jsonify({"status": "error", field: str(error), "retry_after": error.retry_after})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
 # AI Code Validation Function using OpenRouter
 def validate_student_code(student_code, task_description):
     """Validate student code using OpenRouter AI with detailed feedback"""
@@ -324,34 +279,21 @@ Status: [Validation Status]
 Feedback: [Detailed feedback]
 Errors: [Specific error messages or "None"]
 """
-        payload = {
-            "model": Config.OPENROUTER_MODEL,
-            "messages": [
-                {
-                    "role": "system", 
-                    "content": """You are an expert code validation assistant. 
-                    Your task is to validate student code against task requirements.
-                    Provide detailed feedback on any issues found."""
-                },
-                {
-                    "role": "user", 
-                    "content": user_prompt
-                }
-            ]
-        }
-        
-        headers = {
-            "Authorization": f"Bearer {Config.OPENROUTER_API_KEY}",
-            "Content-Type": "application/json",
-            "HTTP-Referer": "https://taskboard.example.com",
-            "X-Title": "TaskBoard"
-        }
-        
-        response = requests.post(Config.OPENROUTER_API_URL, headers=headers, json=payload)
-        response.raise_for_status()
+        messages = [
+            {
+                "role": "system", 
+                "content": """You are an expert code validation assistant. 
+                Your task is to validate student code against task requirements.
+                Provide detailed feedback on any issues found."""
+            },
+            {
+                "role": "user", 
+                "content": user_prompt
+            }
+        ]
         
-        data = response.json()
-        result = data["choices"][0]["message"]["content"].strip()
+        # Validation gates a submit, so it goes ahead of practice runs
+        result = ai_completion(messages, 'validate', PRIORITY_SUBMIT)
         
         # Parse the response to extract status, feedback, and errors
         status = "Incorrect"
@@ -371,6 +313,8 @@ Errors: [Specific error messages or "None"]
             "feedback": feedback,
             "errors": errors
         }
+    except AIBusy:
+        raise
     except Exception as e:
         print(f"OpenRouter API error: {e}")
         return {
@@ -379,44 +323,32 @@ Errors: [Specific error messages or "None"]
             "errors": "API error"
         }
 
-# AI Code Generation Function using OpenRouter
-def generate_code_with_ai(prompt, language="python"):
-    """Generate code using OpenRouter AI"""
-    try:
-        system_prompt = f"""
+def code_generation_messages(prompt, language):
+    system_prompt = f"""
 You are an expert {language} programmer and educator. 
 Generate clean, well-commented code that solves the user's request.
 Focus on educational value and best practices.
 Only provide the code without explanations unless specifically asked.
 """
-        
-        payload = {
-            "model": Config.OPENROUTER_MODEL,
-            "messages": [
-                {
-                    "role": "system", 
-                    "content": system_prompt
-                },
-                {
-                    "role": "user", 
-                    "content": prompt
-                }
-            ]
-        }
-        
-        headers = {
-            "Authorization": f"Bearer {Config.OPENROUTER_API_KEY}",
-            "Content-Type": "application/json",
-            "HTTP-Referer": "https://taskboard.example.com",
-            "X-Title": "TaskBoard"
+    
+    return [
+        {
+            "role": "system", 
+            "content": system_prompt
+        },
+        {
+            "role": "user", 
+            "content": prompt
         }
-        
-        response = requests.post(Config.OPENROUTER_API_URL, headers=headers, json=payload)
-        response.raise_for_status()
-        
-        data = response.json()
-        result = data["choices"][0]["message"]["content"].strip()
-        return result
+    ]
+
+# AI Code Generation Function using OpenRouter
+def generate_code_with_ai(prompt, language="python"):
+    """Generate code using OpenRouter AI"""
+    try:
+        return ai_completion(code_generation_messages(prompt, language), 'generate')
+    except AIBusy:
+        raise
     except Exception as e:
         print(f"OpenRouter API error: {e}")
         return f"Error generating code: {str(e)}"
@@ -425,53 +357,177 @@ Only provide the code without explanations unless specifically asked.
 def chat_with_ai(messages):
     """Chat with OpenRouter AI"""
     try:
-        payload = {
-            "model": Config.OPENROUTER_MODEL,
-            "messages": messages
-        }
-        
-        headers = {
-            "Authorization": f"Bearer {Config.OPENROUTER_API_KEY}",
-            "Content-Type": "application/json",
-            "HTTP-Referer": "https://taskboard.example.com",
-            "X-Title": "TaskBoard"
-        }
-        
-        response = requests.post(Config.OPENROUTER_API_URL, headers=headers, json=payload)
-        response.raise_for_status()
-        
-        data = response.json()
-        result = data["choices"][0]["message"]["content"].strip()
-        return result
+        return ai_completion(messages, 'chat')
+    except AIBusy:
+        raise
     except Exception as e:
         print(f"OpenRouter API error: {e}")
         return f"Error: {str(e)}"
 
 # Notification Routes
+def similar_submission_rows(pairs):
+    """(studentId, studentId, similarity) report pairs with student details for the templates"""
+    students = {student['studentID']: student for student in Student.find_by_ids(
+        student_id for pair in pairs for student_id in pair[:2])}
+    return [{
+        'first': students[first],
+        'second': students[second],
+        'similarity': round(score * 100)
+    } for first, second, score in pairs if first in students and second in students]
+
+# Streaming AI Completion using OpenRouter
+def stream_ai_completion(messages):
+    """
+    Yield the text of an OpenRouter completion piece by piece as it is
+    generated. The gateway reads the upstream stream; closing the generator
+    (the browser went away) cancels it, so OpenRouter stops generating.
+    """
+    return ai_gateway.stream(messages)
+
+def sse_response(chunks, start=None):
+    """
+    Relay text chunks to the browser as server-sent events: one 'data'
+    event per chunk, then 'done', or 'error' if the upstream call failed.
+    A start payload is sent first as a 'start' event. When the client
+    disconnects the server closes this generator, which closes chunks and
+    with it the upstream request.
+    """
+    def events():
+        try:
+            if start is not None:
+                yield f"event: start\ndata: {json.dumps(start)}\n\n"
+            for chunk in chunks:
+                yield f"data: {json.dumps({'delta': chunk})}\n\n"
+            yield "event: done\ndata: {}\n\n"
+        except Exception as e:
+            print(f"OpenRouter streaming error: {e}")
+            yield f"event: error\ndata: {json.dumps({'message': str(e)})}\n\n"
+        finally:
+            chunks.close()
+    
+    return Response(events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# Pinned at the top of every AI chat prompt
+CHAT_SYSTEM_PROMPT = """You are TaskBoard Bot, a friendly programming tutor for school students
+learning Python and Arduino. Explain ideas step by step, point students
+towards the answer instead of writing whole solutions for them, and keep
+replies short. Use Markdown code blocks for code."""
+
+# Characters of the task description pinned to a chat prompt
+CHAT_TASK_CONTEXT_CHARS = 1500
+
+def chat_task_context(task_id):
+    """Short description of the task a chat is about, or None"""
+    task = Task.eligibility().get(task_id) if task_id else None
+    if not task:
+        return None
+    return f"{task['title']}\n{clip(task.get('description'), CHAT_TASK_CONTEXT_CHARS)}"
+
+def prepare_chat(data):
+    """
+    (conversation, question, messages) for a chat request. A 'message'
+    joins the user's server-side conversation (a new one when
+    conversation_id is missing or not theirs) and only the recent window
+    of it is sent, with older turns folded into the stored summary. The
+    question itself is not stored here: it is saved together with its
+    reply, so a busy or failed call leaves no unanswered turn behind. A
+    legacy 'messages' array is trimmed the same way without being stored
+    (conversation and question are None). Raises ValueError when the
+    request has neither.
+    """
+    message = data.get("message")
+    if isinstance(message, str) and message.strip():
+        user_type, user_id, _, _ = notification_audience()
+        user_key = Notification.user_key(user_type, user_id)
+        
+        conversation = None
+        if data.get("conversation_id"):
+            conversation = Conversation.find(data["conversation_id"], user_key)
+        if not conversation:
+            task = Task.eligibility().get(data.get("task_id"))
+            conversation = Conversation.new(user_key, task['id'] if task else None)
+        
+        question = message.strip()
+        history = [] if conversation.get('new') else Conversation.get_window(conversation)
+        history.append({'role': 'user', 'content': question})
+        # The question is the newest turn and always stays in recent
+        older, recent = split_window(history, Config.AI_CHAT_HISTORY_TOKENS)
+        summary = conversation['summary']
+        if older:
+            summary = summarize(summary, older, Config.AI_CHAT_SUMMARY_TOKENS)
+            Conversation.compact(conversation['id'], summary, older[-1]['seq'])
+        
+        task_context = chat_task_context(conversation['taskId'])
+        return conversation, question, build_messages(CHAT_SYSTEM_PROMPT, task_context, summary, recent)
+    
+    messages = data.get("messages")
+    if not messages or not isinstance(messages, list):
+        raise ValueError("A message or a valid messages array is required")
+    
+    history = [turn for turn in messages
+               if isinstance(turn, dict) and turn.get('role') in ('user', 'assistant')
+               and isinstance(turn.get('content'), str)]
+    if not history:
+        raise ValueError("A message or a valid messages array is required")
+    older, recent = split_window(history, Config.AI_CHAT_HISTORY_TOKENS)
+    summary = summarize(None, older, Config.AI_CHAT_SUMMARY_TOKENS) if older else None
+    task_context = chat_task_context(data.get("task_id"))
+    return None, None, build_messages(CHAT_SYSTEM_PROMPT, task_context, summary, recent)
+
+def record_chat_reply(chunks, conversation, question):
+    """
+    Pass chunks through and store the question and its reply once the
+    stream ends, including the part received before a disconnect or
+    error. Nothing is stored when no reply arrived.
+    """
+    reply = []
+    try:
+        for chunk in chunks:
+            reply.append(chunk)
+            yield chunk
+    finally:
+        chunks.close()
+        if reply:
+            Conversation.append(conversation, [('user', question), ('assistant', ''.join(reply))])
+
+def notification_audience():
+    """
+    (user_type, user_id, campus, grade) of the logged-in user for the
+    notification queries and access checks. Campus and grade are read from
+    the database on every call, like the dashboards do, so an admin's edit
+    takes effect at once; the session copy is refreshed when it differs.
+    """
+    payload = verify_token(session.get('token'))
+    user_type = payload.get('user_type')
+    user_id = payload.get('user_id')
+    campus = None
+    grade = None
+    
+    if user_type == 'teacher':
+        teacher = Teacher.find_by_id(user_id)
+        if teacher:
+            campus = teacher['campus']
+            if session.get('teacher_campus') != campus:
+                session['teacher_campus'] = campus
+    elif user_type == 'student':
+        student = Student.find_by_id(user_id)
+        if student:
+            campus = student['campus']
+            grade = student['grade']
+            if (session.get('student_campus'), session.get('student_grade')) != (campus, grade):
+                session['student_campus'] = campus
+                session['student_grade'] = grade
+    
+    return user_type, user_id, campus, grade
+
 @login_required
 def get_notifications():
     """Get notifications for current user"""
     try:
-        token = session.get('token')
-        payload = verify_token(token)
-        user_type = payload.get('user_type')
-        user_id = payload.get('user_id')
-        
-        # Get user-specific data for filtering
-        campus = None
-        grade = None
-        
-        if user_type == 'teacher':
-            teacher = Teacher.find_by_id(user_id)
-            if teacher:
-                campus = teacher['campus']
-        elif user_type == 'student':
-            student = Student.find_by_id(user_id)
-            if student:
-                campus = student['campus']
-                grade = student['grade']
+        user_type, user_id, campus, grade = notification_audience()
         
-        notifications = Notification.get_for_user(user_type, user_id, campus, grade)
+        notifications, unread_count = Notification.get_for_user_with_unread_count(user_type, user_id, campus, grade)
         
         # Convert datetime to string for JSON serialization
         for notification in notifications:
@@ -482,7 +538,7 @@ def get_notifications():
         return jsonify({
             'status': 'success',
             'notifications': notifications,
-            'unread_count': Notification.get_unread_count(user_type, user_id, campus, grade)
+            'unread_count': unread_count
         })
     
     except Exception as e:
@@ -492,31 +548,15 @@ def get_notifications():
 def mark_notification_read(notification_id):
     """Mark a notification as read"""
     try:
-        token = session.get('token')
-        payload = verify_token(token)
-        user_type = payload.get('user_type')
-        user_id = payload.get('user_id')
-        
-        # Get user-specific data for access control
-        campus = None
-        grade = None
+        # The statement resolves the audience itself; no lookup needed here
+        payload = verify_token(session.get('token'))
         
-        if user_type == 'teacher':
-            teacher = Teacher.find_by_id(user_id)
-            if teacher:
-                campus = teacher['campus']
-        elif user_type == 'student':
-            student = Student.find_by_id(user_id)
-            if student:
-                campus = student['campus']
-                grade = student['grade']
-        
-        result = Notification.mark_as_read(notification_id, user_type, user_id, campus, grade)
+        result = Notification.mark_as_read(notification_id, payload.get('user_type'), payload.get('user_id'))
         
         if result:
             return jsonify({'status': 'success', 'message': 'Notification marked as read'})
         else:
-            return jsonify({'status': 'error', 'message': 'Notification not found or access denied'})
+            return jsonify({'status': 'error', 'message': 'Notification not found, already read or access denied'})
     
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)})
@@ -525,24 +565,7 @@ def mark_notification_read(notification_id):
 def mark_all_notifications_read():
     """Mark all notifications as read for current user"""
     try:
-        token = session.get('token')
-        payload = verify_token(token)
-        user_type = payload.get('user_type')
-        user_id = payload.get('user_id')
-        
-        # Get user-specific data for access control
-        campus = None
-        grade = None
-        
-        if user_type == 'teacher':
-            teacher = Teacher.find_by_id(user_id)
-            if teacher:
-                campus = teacher['campus']
-        elif user_type == 'student':
-            student = Student.find_by_id(user_id)
-            if student:
-                campus = student['campus']
-                grade = student['grade']
+        user_type, user_id, campus, grade = notification_audience()
         
         result = Notification.mark_all_as_read(user_type, user_id, campus, grade)
         
@@ -587,6 +610,8 @@ def login():
                 session['user_type'] = 'student'
                 session['student_id'] = student['studentID']
                 session['student_name'] = student['name']
+                session['student_campus'] = student['campus']
+                session['student_grade'] = student['grade']
                 return redirect(url_for('student_dashboard'))
         
         return render_template('login.html', error='Invalid credentials')
@@ -603,8 +628,7 @@ def admin_dashboard():
     progress_data = get_student_progress_data()
     
     # Get notifications for admin
-    notifications = Notification.get_for_user('admin')
-    unread_count = Notification.get_unread_count('admin')
+    notifications, unread_count = Notification.get_for_user_with_unread_count('admin', session.get('username'))
     
     return render_template('admin_dashboard.html', 
                          progress_data=progress_data,
@@ -613,29 +637,28 @@ def admin_dashboard():
 
 @admin_required
 def manage_students():
-    students = Student.get_all()
-    return render_template('manage_students.html', students=students)
+    filters = list_filters('campus', 'grade', 'section', 'q')
+    students, next_cursor = Student.get_page(campus=filters.get('campus'),
+                                             grade=filters.get('grade'),
+                                             section=filters.get('section'),
+                                             name_prefix=filters.get('q'),
+                                             after=request.args.get('after'),
+                                             limit=PAGE_SIZE)
+    return render_template('manage_students.html', 
+                         students=StudentSummary.from_rows(students),
+                         next_cursor=next_cursor,
+                         filters=filters,
+                         campuses=Campus.get_names(),
+                         grades=Grade.get_names(),
+                         sections=SECTIONS)
 
 @admin_required
 def add_student():
-    sections = [
-        'LL', 'HH', 'DD', 'FF', 
-        'Tata Boys', 'Tata Girls', 
-        'Google Boys', 'Google Girls', 
-        'Infosys Boys', 'Infosys Girls', 
-        'Adobe', 'Adobe Boys', 'Adobe Girls',
-        'Mahendra Boys', 'Mahendra Girls',
-        'Verizon Boys', 'Verizon Girls', 
-        'Microsoft Boys', 'Microsoft Girls'
-    ]
+    sections = SECTIONS
     
     if request.method == 'POST':
-        # Get the count of existing students to generate ID
-        existing_students = Student.get_all()
-        sequence = len(existing_students) + 1
-        
         data = {
-            'studentID': generate_student_id(request.form.get('campus'), sequence),
+            'studentID': generate_student_id(request.form.get('campus')),
             'name': request.form.get('name'),
             'campus': request.form.get('campus'),
             'grade': request.form.get('grade'),
@@ -662,16 +685,7 @@ def edit_student(student_id):
     if not student:
         return redirect(url_for('manage_students'))
     
-    sections = [
-        'LL', 'HH', 'DD', 'FF', 
-        'Tata Boys', 'Tata Girls', 
-        'Google Boys', 'Google Girls', 
-        'Infosys Boys', 'Infosys Girls', 
-        'Adobe', 'Adobe Boys', 'Adobe Girls',
-        'Mahendra Boys', 'Mahendra Girls',
-        'Verizon Boys', 'Verizon Girls', 
-        'Microsoft Boys', 'Microsoft Girls'
-    ]
+    sections = SECTIONS
     
     if request.method == 'POST':
         data = {
@@ -718,16 +732,19 @@ def upload_students():
         if file and file.filename.endswith('.xlsx'):
             students_data = import_students_from_excel(file)
             success_count = 0
-            for student_data in students_data:
-                try:
-                    Student.create(student_data)
-                    success_count += 1
-                    # Create notification for each student
-                    student = Student.find_by_id(student_data['studentID'])
-                    if student:
-                        Notification.create_student_notification(student, "added")
-                except Exception as e:
-                    print(f"Error creating student: {e}")
+            # One summary notification per audience instead of one per student
+            links = {'admin': url_for('manage_students'), 'teacher': url_for('teacher_students')}
+            with Notification.digest(links), roster_cache.batch():
+                for student_data in students_data:
+                    try:
+                        Student.create(student_data)
+                        success_count += 1
+                        # Create notification for each student
+                        student = Student.find_by_id(student_data['studentID'])
+                        if student:
+                            Notification.create_student_notification(student, "added")
+                    except Exception as e:
+                        print(f"Error creating student: {e}")
             
             print(f"Successfully imported {success_count} students")
             return redirect(url_for('manage_students'))
@@ -736,29 +753,32 @@ def upload_students():
 
 @admin_required
 def export_students():
-    students = Student.get_all()
-    excel_file = export_students_to_excel(students)
-    return send_file(excel_file, 
-                    download_name='students_with_passwords.xlsx',
-                    as_attachment=True)
+    rows = (student_export_row(s) for s in Student.iter_all())
+    return build_export_response('students_with_passwords', 'Students',
+                                 STUDENT_EXPORT_HEADERS, rows, STUDENT_EXPORT_INFO)
 
 @admin_required
 def manage_teachers():
-    teachers = Teacher.get_all()
-    return render_template('manage_teachers.html', teachers=teachers)
+    filters = list_filters('campus', 'q')
+    teachers, next_cursor = Teacher.get_page(campus=filters.get('campus'),
+                                             name_prefix=filters.get('q'),
+                                             after=request.args.get('after'),
+                                             limit=PAGE_SIZE)
+    return render_template('manage_teachers.html', 
+                         teachers=TeacherSummary.from_rows(teachers),
+                         next_cursor=next_cursor,
+                         filters=filters,
+                         campuses=Campus.get_names())
 
 @admin_required
 def add_teacher():
-    campuses = ['Subhash Nagar', 'Yamuna', 'I20']
+    campuses = Campus.get_names()
     
     if request.method == 'POST':
-        # Get the count of existing teachers for this campus to generate ID
         campus = request.form.get('campus')
-        existing_teachers = Teacher.get_by_campus(campus)
-        sequence = len(existing_teachers) + 1
         
         data = {
-            'teacherID': generate_teacher_id(campus, sequence),
+            'teacherID': generate_teacher_id(campus),
             'name': request.form.get('name'),
             'email': request.form.get('email'),
             'campus': campus,
@@ -786,7 +806,7 @@ def edit_teacher(teacher_id):
     if not teacher:
         return redirect(url_for('manage_teachers'))
     
-    campuses = ['Subhash Nagar', 'Yamuna', 'I20']
+    campuses = Campus.get_names()
     
     if request.method == 'POST':
         data = {
@@ -823,21 +843,29 @@ def delete_teacher(teacher_id):
 
 @admin_required
 def export_teachers():
-    teachers = Teacher.get_all()
-    excel_file = export_teachers_to_excel(teachers)
-    return send_file(excel_file, 
-                    download_name='teachers_with_passwords.xlsx',
-                    as_attachment=True)
+    rows = (teacher_export_row(t) for t in Teacher.iter_all())
+    return build_export_response('teachers_with_passwords', 'Teachers',
+                                 TEACHER_EXPORT_HEADERS, rows, TEACHER_EXPORT_INFO)
 
 @admin_required
 def manage_tasks():
-    tasks = Task.get_all()
-    return render_template('manage_tasks.html', tasks=tasks)
+    filters = list_filters('campus', 'grade', 'q')
+    tasks, next_cursor = Task.get_page(campus=filters.get('campus'),
+                                       grade=filters.get('grade'),
+                                       title_prefix=filters.get('q'),
+                                       after=request.args.get('after'),
+                                       limit=PAGE_SIZE)
+    return render_template('manage_tasks.html', 
+                         tasks=tasks,
+                         next_cursor=next_cursor,
+                         filters=filters,
+                         campuses=Campus.get_names(),
+                         grades=Grade.get_names())
 
 @admin_required
 def add_task():
-    grades = [f"{i}th Class" for i in range(1, 11)]
-    campuses = ['Subhash Nagar', 'Yamuna', 'I20']
+    grades = Grade.get_names()
+    campuses = Campus.get_names()
     
     if request.method == 'POST':
         data = {
@@ -877,8 +905,8 @@ def edit_task(task_id):
     if not task:
         return redirect(url_for('manage_tasks'))
     
-    grades = [f"{i}th Class" for i in range(1, 11)]
-    campuses = ['Subhash Nagar', 'Yamuna', 'I20']
+    grades = Grade.get_names()
+    campuses = Campus.get_names()
     
     if request.method == 'POST':
         data = {
@@ -932,24 +960,17 @@ def task_details(task_id):
     # Get completed students
     completed_students = Submission.get_completed_students_for_task(task_id)
     
-    # Get all students who should complete this task
-    all_target_students = []
+    # Targeted students without a submission, resolved by the database
     campus_target = json.loads(task['campusTarget']) if isinstance(task['campusTarget'], str) else task.get('campusTarget', [])
     grade_target = json.loads(task['gradeTarget']) if isinstance(task['gradeTarget'], str) else task.get('gradeTarget', [])
-    
-    for campus in campus_target:
-        for grade in grade_target:
-            students = Student.get_by_campus_grade(campus, grade)
-            all_target_students.extend(students)
-    
-    # Find pending students
-    completed_student_ids = [s['studentID'] for s in completed_students]
-    pending_students = [s for s in all_target_students if s['studentID'] not in completed_student_ids]
+    pending_students = Submission.get_pending_students_for_task(task_id, campus_target, grade_target)
     
     return render_template('task_details.html', 
                          task=task, 
                          completed_students=completed_students,
-                         pending_students=pending_students)
+                         pending_students=pending_students,
+                         attempt_counts=SubmissionAttempt.count_by_students(task_id),
+                         similar_pairs=similar_submission_rows(SubmissionSignature.task_report(task_id)))
 
 @admin_required
 def view_submission(task_id, student_id):
@@ -964,10 +985,13 @@ def view_submission(task_id, student_id):
     if not submission:
         return redirect(url_for('task_details', task_id=task_id))
     
+    similar = SubmissionSignature.find_similar(task_id, student_id)
+    
     return render_template('view_submission.html', 
                          task=task, 
                          student=student,
-                         submission=submission)
+                         submission=submission,
+                         similar_pairs=similar_submission_rows([(student_id, other, score) for other, score in similar]))
 
 # Teacher Routes
 @teacher_required
@@ -984,12 +1008,13 @@ def teacher_dashboard():
     if not teacher:
         return redirect(url_for('logout'))
     
+    session['teacher_campus'] = teacher['campus']
+    
     # Get progress data for teacher's campus only
     progress_data = get_student_progress_data(campus=teacher['campus'])
     
     # Get notifications for teacher
-    notifications = Notification.get_for_user('teacher', teacher_id, teacher['campus'])
-    unread_count = Notification.get_unread_count('teacher', teacher_id, teacher['campus'])
+    notifications, unread_count = Notification.get_for_user_with_unread_count('teacher', teacher_id, teacher['campus'])
     
     return render_template('teacher_dashboard.html', 
                          teacher=teacher, 
@@ -1011,36 +1036,34 @@ def teacher_students():
     if not teacher:
         return redirect(url_for('logout'))
     
-    # Get students for teacher's campus only
-    students = Student.get_all()
-    campus_students = [s for s in students if s['campus'] == teacher['campus']]
+    # Get one page of students for teacher's campus only
+    filters = list_filters('grade', 'section', 'q')
+    campus_students, next_cursor = Student.get_page(campus=teacher['campus'],
+                                                    grade=filters.get('grade'),
+                                                    section=filters.get('section'),
+                                                    name_prefix=filters.get('q'),
+                                                    after=request.args.get('after'),
+                                                    limit=PAGE_SIZE)
     
-    # Get tasks that target teacher's campus
-    tasks = Task.get_all()
-    campus_tasks = []
-    for task in tasks:
-        campus_target = json.loads(task['campusTarget']) if isinstance(task['campusTarget'], str) else task.get('campusTarget', [])
-        if teacher['campus'] in campus_target:
-            campus_tasks.append(task)
+    eligibility = Task.eligibility()
+    
+    # Submission counts for the whole page in one query
+    submission_counts = Submission.count_by_students(s['studentID'] for s in campus_students)
     
     # Calculate task statistics for each student
     for student in campus_students:
-        # Get all tasks assigned to this student (based on campus and grade)
-        student_tasks = []
-        for task in campus_tasks:
-            grade_target = json.loads(task['gradeTarget']) if isinstance(task['gradeTarget'], str) else task.get('gradeTarget', [])
-            if student['grade'] in grade_target:
-                student_tasks.append(task)
+        # Tasks assigned to this student's campus and grade
+        student['tasks_assigned'] = eligibility.count_for(teacher['campus'], student['grade'])
         
-        student['tasks_assigned'] = len(student_tasks)
-        
-        # Get submissions for this student
-        submissions = Submission.get_by_student(student['studentID'])
-        student['tasks_completed'] = len(submissions)
+        student['tasks_completed'] = submission_counts.get(student['studentID'], 0)
     
     return render_template('teacher_students.html', 
                          teacher=teacher, 
-                         students=campus_students)
+                         students=campus_students,
+                         next_cursor=next_cursor,
+                         filters=filters,
+                         grades=Grade.get_names(),
+                         sections=SECTIONS)
 
 @teacher_required
 def teacher_add_student():
@@ -1060,26 +1083,13 @@ def teacher_add_student():
     if not teacher.get('can_manage_students', False):
         return redirect(url_for('teacher_students'))
     
-    sections = [
-        'LL', 'HH', 'DD', 'FF', 
-        'Tata Boys', 'Tata Girls', 
-        'Google Boys', 'Google Girls', 
-        'Infosys Boys', 'Infosys Girls', 
-        'Adobe', 'Adobe Boys', 'Adobe Girls',
-        'Mahendra Boys', 'Mahendra Girls',
-        'Verizon Boys', 'Verizon Girls', 
-        'Microsoft Boys', 'Microsoft Girls'
-    ]
+    sections = SECTIONS
     
     if request.method == 'POST':
-        # Get the count of existing students for this campus to generate ID
         campus = teacher['campus']  # Use teacher's campus
-        existing_students = Student.get_all()
-        campus_students = [s for s in existing_students if s['campus'] == campus]
-        sequence = len(campus_students) + 1
         
         data = {
-            'studentID': generate_student_id(campus, sequence),
+            'studentID': generate_student_id(campus),
             'name': request.form.get('name'),
             'campus': campus,  # Force to teacher's campus
             'grade': request.form.get('grade'),
@@ -1126,16 +1136,7 @@ def teacher_edit_student(student_id):
     if student['campus'] != teacher['campus']:
         return redirect(url_for('teacher_students'))
     
-    sections = [
-        'LL', 'HH', 'DD', 'FF', 
-        'Tata Boys', 'Tata Girls', 
-        'Google Boys', 'Google Girls', 
-        'Infosys Boys', 'Infosys Girls', 
-        'Adobe', 'Adobe Boys', 'Adobe Girls',
-        'Mahendra Boys', 'Mahendra Girls',
-        'Verizon Boys', 'Verizon Girls', 
-        'Microsoft Boys', 'Microsoft Girls'
-    ]
+    sections = SECTIONS
     
     if request.method == 'POST':
         data = {
@@ -1202,13 +1203,9 @@ def teacher_export_students():
         return redirect(url_for('teacher_students'))
     
     # Get students for teacher's campus only
-    students = Student.get_all()
-    campus_students = [s for s in students if s['campus'] == teacher['campus']]
-    
-    excel_file = export_students_to_excel(campus_students)
-    return send_file(excel_file, 
-                    download_name=f'students_{teacher["campus"]}.xlsx',
-                    as_attachment=True)
+    rows = (student_export_row(s) for s in Student.iter_all(campus=teacher['campus']))
+    return build_export_response(f'students_{teacher["campus"]}', 'Students',
+                                 STUDENT_EXPORT_HEADERS, rows, STUDENT_EXPORT_INFO)
 
 @teacher_required
 def teacher_tasks():
@@ -1225,35 +1222,28 @@ def teacher_tasks():
         return redirect(url_for('logout'))
     
     # Get tasks that target teacher's campus
-    tasks = Task.get_all()
-    campus_tasks = []
-    for task in tasks:
-        campus_target = json.loads(task['campusTarget']) if isinstance(task['campusTarget'], str) else task.get('campusTarget', [])
-        if teacher['campus'] in campus_target:
-            campus_tasks.append(task)
+    eligibility = Task.eligibility()
+    campus_tasks = eligibility.tasks_for(teacher['campus'])
+    
+    # Students per grade of the teacher's campus, one grouped query
+    grade_counts = Counter()
+    for row in Student.get_group_counts(teacher['campus']):
+        grade_counts[(row['campus'], row['grade'])] += row['count']
+    students_per_task = eligibility.students_per_task(grade_counts)
+    
+    # One query for all completions, filtered to the cached campus roster
+    completions = Submission.get_completions_for_tasks(task['id'] for task in campus_tasks)
+    campus_student_ids = set(Student.get_roster_ids(teacher['campus']))
+    
+    completed_by_task = defaultdict(set)
+    for completion in completions:
+        if completion['studentId'] in campus_student_ids:
+            completed_by_task[completion['taskId']].add(completion['studentId'])
     
     # Calculate statistics for each task
     for task in campus_tasks:
-        # Get all students who should complete this task from teacher's campus
-        all_target_students = []
-        grade_target = json.loads(task['gradeTarget']) if isinstance(task['gradeTarget'], str) else task.get('gradeTarget', [])
-        for grade in grade_target:
-            students = Student.get_by_campus_grade(teacher['campus'], grade)
-            all_target_students.extend(students)
-        
-        task['students_assigned'] = len(all_target_students)
-        
-        # Get completed submissions for this task
-        completions = Submission.get_task_completions(task['id'])
-        
-        # Filter to only include students from teacher's campus
-        completed_students = []
-        for completion in completions:
-            student = Student.find_by_id(completion['studentId'])
-            if student and student['campus'] == teacher['campus']:
-                completed_students.append(student)
-        
-        task['completions'] = len(completed_students)
+        task['students_assigned'] = int(students_per_task[eligibility.positions[task['id']]])
+        task['completions'] = len(completed_by_task[task['id']])
         
         # Calculate completion rate
         if task['students_assigned'] > 0:
@@ -1283,7 +1273,7 @@ def teacher_add_task():
     if not teacher.get('can_manage_tasks', False):
         return redirect(url_for('teacher_tasks'))
     
-    grades = [f"{i}th Class" for i in range(1, 11)]
+    grades = Grade.get_names()
     # Only show teacher's campus
     campuses = [teacher['campus']]
     
@@ -1346,7 +1336,7 @@ def teacher_edit_task(task_id):
     if teacher['campus'] not in campus_target:
         return redirect(url_for('teacher_tasks'))
     
-    grades = [f"{i}th Class" for i in range(1, 11)]
+    grades = Grade.get_names()
     # Only show teacher's campus
     campuses = [teacher['campus']]
     
@@ -1437,22 +1427,17 @@ def teacher_task_details(task_id):
     # Filter to only include students from teacher's campus
     completed_students = [s for s in completed_students if s['campus'] == teacher['campus']]
     
-    # Get all students who should complete this task from teacher's campus
-    all_target_students = []
+    # Students from teacher's campus who should complete this task but have not
     grade_target = json.loads(task['gradeTarget']) if isinstance(task['gradeTarget'], str) else task.get('gradeTarget', [])
-    for grade in grade_target:
-        students = Student.get_by_campus_grade(teacher['campus'], grade)
-        all_target_students.extend(students)
-    
-    # Find pending students
-    completed_student_ids = [s['studentID'] for s in completed_students]
-    pending_students = [s for s in all_target_students if s['studentID'] not in completed_student_ids]
+    pending_students = Submission.get_pending_students_for_task(task_id, [teacher['campus']], grade_target)
     
     return render_template('teacher_task_details.html', 
                          teacher=teacher,
                          task=task, 
                          completed_students=completed_students,
-                         pending_students=pending_students)
+                         pending_students=pending_students,
+                         attempt_counts=SubmissionAttempt.count_by_students(task_id),
+                         similar_pairs=similar_submission_rows(SubmissionSignature.task_report(task_id, campus=teacher['campus'])))
 
 @teacher_required
 def teacher_view_submission(task_id, student_id):
@@ -1483,11 +1468,17 @@ def teacher_view_submission(task_id, student_id):
     if not submission:
         return redirect(url_for('teacher_task_details', task_id=task_id))
     
+    # Only matches among the teacher's own campus
+    similar = SubmissionSignature.find_similar(task_id, student_id)
+    similar_pairs = [row for row in similar_submission_rows([(student_id, other, score) for other, score in similar])
+                     if row['second']['campus'] == teacher['campus']]
+    
     return render_template('teacher_view_submission.html', 
                          teacher=teacher,
                          task=task, 
                          student=student,
-                         submission=submission)
+                         submission=submission,
+                         similar_pairs=similar_pairs)
 
 # Student Routes
 @login_required
@@ -1504,27 +1495,28 @@ def student_dashboard():
     if not student:
         return redirect(url_for('logout'))
     
-    # Get assigned tasks
-    tasks = Task.get_for_student(student['campus'], student['grade'])
+    # Keep the notification audience in the session current
+    session['student_campus'] = student['campus']
+    session['student_grade'] = student['grade']
+    
+    # Get assigned tasks together with their submission status
+    tasks = Task.get_for_student_with_status(student_id, student['campus'], student['grade'])
     
-    # Get submission status
     task_status = []
     for task in tasks:
-        submission = Submission.find_by_student_task(student_id, task['id'])
         task_status.append({
             'task': {
                 'id': task['id'],
                 'title': task['title'],
                 'language': task['language'],
-                'description': task.get('description', '')
+                'description': task.get('description') or ''
             },
-            'completed': submission is not None,
-            'completed_date': submission.get('submittedAt') if submission else None
+            'completed': task['submittedAt'] is not None,
+            'completed_date': task['submittedAt']
         })
     
     # Get notifications for student
-    notifications = Notification.get_for_user('student', student_id, student['campus'], student['grade'])
-    unread_count = Notification.get_unread_count('student', student_id, student['campus'], student['grade'])
+    notifications, unread_count = Notification.get_for_user_with_unread_count('student', student_id, student['campus'], student['grade'])
     
     return render_template('student_dashboard.html',
                          student=student,
@@ -1550,7 +1542,10 @@ def web_editor():
     
     submission = Submission.find_by_student_task(student_id, task_id)
     
-    return render_template('web_editor.html', task=task, submission=submission)
+    # Unsubmitted work autosaved from an earlier visit
+    draft = drafts.get(student_id, task_id) if not submission else None
+    
+    return render_template('web_editor.html', task=task, submission=submission, draft=draft)
 
 # Practice Editor Route (Available to all roles)
 @login_required
@@ -1596,6 +1591,8 @@ def validate_code():
             "message": validation_result.get("feedback")
         })
     
+    except AIBusy as e:
+        return ai_busy_response(e)
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)})
 
@@ -1642,32 +1639,19 @@ Do not provide corrected code. Only provide the error message or the simulated o
         
         user_prompt = f"Code:\n{code}"
         
-        payload = {
-            "model": Config.OPENROUTER_MODEL,
-            "messages": [
-                {
-                    "role": "system", 
-                    "content": system_prompt
-                },
-                {
-                    "role": "user", 
-                    "content": user_prompt
-                }
-            ]
-        }
-        
-        headers = {
-            "Authorization": f"Bearer {Config.OPENROUTER_API_KEY}",
-            "Content-Type": "application/json",
-            "HTTP-Referer": "https://taskboard.example.com",
-            "X-Title": "TaskBoard"
-        }
-        
-        response = requests.post(Config.OPENROUTER_API_URL, headers=headers, json=payload)
-        response.raise_for_status()
+        messages = [
+            {
+                "role": "system", 
+                "content": system_prompt
+            },
+            {
+                "role": "user", 
+                "content": user_prompt
+            }
+        ]
         
-        data = response.json()
-        result = data["choices"][0]["message"]["content"].strip()
+        priority = PRIORITY_TASK if task_id and task_id != "practice" else PRIORITY_PRACTICE
+        result = ai_completion(messages, 'simulate', priority)
         
         # Check if the result starts with "ERROR" or "SUCCESS"
         if result.startswith("ERROR:"):
@@ -1678,6 +1662,8 @@ Do not provide corrected code. Only provide the error message or the simulated o
             # If the AI didn't follow the format, return the whole result as output
             return jsonify({"status": "error", "output": "Unexpected response from AI: " + result})
     
+    except AIBusy as e:
+        return ai_busy_response(e, "output")
     except Exception as e:
         return jsonify({"status": "error", "output": f"Simulation failed: {str(e)}"})
 
@@ -1702,6 +1688,8 @@ def generate_code():
             "message": "Code generated successfully"
         })
     
+    except AIBusy as e:
+        return ai_busy_response(e)
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)})
 
@@ -1711,23 +1699,88 @@ def ai_chat():
     """Chat with OpenRouter AI"""
     try:
         data = request.get_json()
-        messages = data.get("messages")
         
-        if not messages or not isinstance(messages, list):
-            return jsonify({"status": "error", "message": "Valid messages array is required"})
+        try:
+            conversation, question, messages = prepare_chat(data)
+        except ValueError as e:
+            return jsonify({"status": "error", "message": str(e)})
         
         # Chat with AI
         response = chat_with_ai(messages)
+        if conversation and not response.startswith("Error:"):
+            Conversation.append(conversation, [('user', question), ('assistant', response)])
         
         return jsonify({
             "status": "success",
             "response": response,
+            "conversation_id": conversation['id'] if conversation else None,
             "message": "AI response received"
         })
     
+    except AIBusy as e:
+        return ai_busy_response(e)
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)})
 
+@login_required
+def generate_code_stream():
+    """Generate code, streamed to the browser as server-sent events"""
+    try:
+        data = request.get_json()
+        prompt = data.get("prompt")
+        language = data.get("language", "python")
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    
+    if not prompt:
+        return jsonify({"status": "error", "message": "Prompt is required"}), 400
+    
+    try:
+        ticket = ai_scheduler.acquire(ai_user_key(), PRIORITY_PRACTICE)
+    except AIBusy as e:
+        return ai_busy_response(e)
+    
+    try:
+        response = sse_response(stream_ai_completion(code_generation_messages(prompt, language)))
+    except Exception:
+        ai_scheduler.release(ticket)
+        raise
+    # The slot is held until the stream ends or the client goes away
+    response.call_on_close(lambda: ai_scheduler.release(ticket))
+    return response
+
+@login_required
+def ai_chat_stream():
+    """Chat with OpenRouter AI, streamed to the browser as server-sent events"""
+    try:
+        data = request.get_json()
+        if not isinstance(data, dict):
+            raise ValueError("A JSON object is required")
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    
+    try:
+        ticket = ai_scheduler.acquire(ai_user_key(), PRIORITY_PRACTICE)
+    except AIBusy as e:
+        return ai_busy_response(e)
+    
+    # Until the response owns the slot, any failure must give it back
+    try:
+        conversation, question, messages = prepare_chat(data)
+        chunks = stream_ai_completion(messages)
+        if conversation:
+            chunks = record_chat_reply(chunks, conversation, question)
+        response = sse_response(chunks, start={'conversation_id': conversation['id'] if conversation else None})
+    except ValueError as e:
+        ai_scheduler.release(ticket)
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except Exception as e:
+        ai_scheduler.release(ticket)
+        return jsonify({"status": "error", "message": str(e)}), 500
+    
+    response.call_on_close(lambda: ai_scheduler.release(ticket))
+    return response
+
 # Submit Task Route
 @login_required
 def submit_task():
@@ -1749,30 +1802,192 @@ def submit_task():
         else:
             return jsonify({"status": "error", "message": "Only students can submit tasks"})
         
+        # Task from the cached catalog, student details from the session
+        task = Task.eligibility().get(task_id)
+        if not task:
+            return jsonify({"status": "error", "message": "Task not found"})
+        _, _, campus, _ = notification_audience()
+        student = {'studentID': user_id, 'name': session.get('student_name'), 'campus': campus}
+        
         submission_data = {
             'studentId': user_id,
             'taskId': task_id,
             'code': code,
-            'output': output
+            'output': output,
+            'idempotencyKey': data.get("idempotency_key")
         }
         
-        result = Submission.create(submission_data)
-        if result:
-            # Get the created submission, student, and task to create notification
-            submission = Submission.find_by_student_task(user_id, task_id)
-            student = Student.find_by_id(user_id)
-            task = Task.find_by_id(task_id)
-            
-            if submission and student and task:
-                Notification.create_submission_notification(submission, student, task)
+        # The submission and its notifications commit together
+        with db.transaction():
+            submission_id, changed = Submission.upsert(submission_data)
+            if changed:
+                Notification.create_submission_notification({'id': submission_id}, student, task)
+        drafts.discard(user_id, task_id)
+        
+        return jsonify({"status": "success", "message": "Task submitted successfully"})
+    
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)})
+
+# Search Route
+@login_required
+def search_index():
+    try:
+        query = request.args.get("q", "").strip()
+        kind = request.args.get("kind")
+        limit = max(1, min(request.args.get("limit", 20, type=int), 50))
+        user_type, _, campus, grade = notification_audience()
+        
+        # Students search tasks only; teachers see their own campus
+        kinds = ['task'] if user_type == 'student' else ['student', 'task', 'submission']
+        if kind:
+            kinds = [k for k in kinds if k == kind]
+        if not query or not kinds or (user_type != 'admin' and not campus):
+            return jsonify({"status": "success", "results": []})
+        
+        # The scope is part of the search queries, so every hit is visible
+        eligibility = Task.eligibility()
+        if user_type == 'admin':
+            hits = SearchIndex.search(query, kinds, limit)
+        else:
+            visible_tasks = eligibility.tasks_for(campus, grade if user_type == 'student' else None)
+            hits = SearchIndex.search(query, kinds, limit, campus=campus,
+                                      task_ids=[task['id'] for task in visible_tasks])
+        
+        student_ids = {doc_id.split(':', 1)[0] for hit_kind, doc_id, _ in hits if hit_kind != 'task'}
+        students = {student['studentID']: student for student in Student.find_by_ids(student_ids)}
+        
+        results = []
+        for hit_kind, doc_id, score in hits:
+            if hit_kind == 'task':
+                task = eligibility.get(doc_id)
+                if not task:
+                    continue
+                endpoint = {'admin': 'task_details', 'teacher': 'teacher_task_details'}.get(user_type)
+                url = url_for(endpoint, task_id=doc_id) if endpoint else url_for('web_editor', task_id=doc_id)
+                result = {'title': task['title'], 'subtitle': (task.get('language') or '').title(), 'url': url}
+            else:
+                student_id, _, task_id = doc_id.partition(':')
+                student = students.get(student_id)
+                # Only guards against a posting not yet moved after a campus change
+                if not student or (user_type == 'teacher' and student['campus'] != campus):
+                    continue
+                if hit_kind == 'student':
+                    endpoint = 'edit_student' if user_type == 'admin' else 'teacher_edit_student'
+                    result = {
+                        'title': f"{student['name']} ({student_id})",
+                        'subtitle': f"{student['campus']} · {student['grade']}",
+                        'url': url_for(endpoint, student_id=student_id)
+                    }
+                else:
+                    task = eligibility.get(task_id)
+                    if not task:
+                        continue
+                    endpoint = 'view_submission' if user_type == 'admin' else 'teacher_view_submission'
+                    result = {
+                        'title': f"{student['name']} — {task['title']}",
+                        'subtitle': 'Submission',
+                        'url': url_for(endpoint, task_id=task_id, student_id=student_id)
+                    }
             
-            return jsonify({"status": "success", "message": "Task submitted successfully"})
+            result.update({'kind': hit_kind, 'id': doc_id, 'score': round(score, 3)})
+            results.append(result)
+        
+        return jsonify({"status": "success", "results": results})
+    
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)})
+
+# Autosave Draft Route
+@login_required
+def save_draft():
+    try:
+        data = request.get_json()
+        task_id = data.get("task_id")
+        seq = data.get("seq")
+        
+        if not task_id or not isinstance(seq, int):
+            return jsonify({"status": "error", "message": "Task ID and sequence number are required"})
+        
+        user_type, user_id, _, _ = notification_audience()
+        if user_type != 'student':
+            return jsonify({"status": "error", "message": "Only students can save drafts"})
+        
+        if not Task.eligibility().get(task_id):
+            return jsonify({"status": "error", "message": "Task not found"})
+        
+        if "code" in data:
+            if not isinstance(data["code"], str):
+                return jsonify({"status": "error", "message": "Code must be text"})
+            status, current = drafts.save(user_id, task_id, seq, code=data["code"])
         else:
-            return jsonify({"status": "error", "message": "Failed to submit task"})
+            splice = (data.get("start"), data.get("end"), data.get("text", ""), data.get("length"))
+            if not all(isinstance(value, int) for value in (splice[0], splice[1], splice[3])) or not isinstance(splice[2], str):
+                return jsonify({"status": "error", "message": "Code or a complete change is required"})
+            status, current = drafts.save(user_id, task_id, seq, base_seq=data.get("base_seq"), splice=splice)
+        
+        return jsonify({"status": status, "seq": current})
     
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)})
 
+def can_view_attempts(student_id):
+    """Admins, the student's campus teachers and the student may read attempts"""
+    user_type, user_id, campus, _ = notification_audience()
+    if user_type == 'admin':
+        return True
+    if user_type == 'student':
+        return user_id == student_id
+    if user_type == 'teacher':
+        student = Student.find_by_id(student_id)
+        return bool(student) and student['campus'] == campus
+    return False
+
+# Submission Attempt Routes
+@login_required
+def submission_attempts(task_id, student_id):
+    try:
+        if not can_view_attempts(student_id):
+            return jsonify({"status": "error", "message": "Access denied"}), 403
+        
+        attempts = SubmissionAttempt.get_history(student_id, task_id)
+        return jsonify({
+            "status": "success",
+            "attempts": [{
+                'version': attempt['version'],
+                'size': attempt['size'],
+                'createdAt': attempt['createdAt'].isoformat()
+            } for attempt in attempts]
+        })
+    
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)})
+
+@login_required
+def submission_attempt(task_id, student_id, version):
+    try:
+        if not can_view_attempts(student_id):
+            return jsonify({"status": "error", "message": "Access denied"}), 403
+        
+        # Versions are numbered from 1
+        code = SubmissionAttempt.get_version(student_id, task_id, version) if version >= 1 else None
+        if code is None:
+            return jsonify({"status": "error", "message": "Attempt not found"}), 404
+        
+        return jsonify({"status": "success", "version": version, "code": code})
+    
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)})
+
+# AI scheduler load, queue times and request coalescing
+@admin_required
+def ai_metrics():
+    return jsonify({
+        "status": "success",
+        "scheduler": ai_scheduler.stats(),
+        "coalescing": single_flight.stats()
+    })
+
 # Initialize the application
 def init_app():
     initialize_default_data()
@@ -0,0 +1,84 @@
+import math
+import re
+from collections import Counter
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+CAMEL_RE = re.compile(r'[A-Z]+(?![a-z])|[A-Z]?[a-z]+|\d+')
+
+MAX_TERM_LENGTH = 64
+MAX_DOCUMENT_TERMS = 2000
+MAX_QUERY_TERMS = 8
+
+# Score factor for a term reached by prefix expansion rather than typed in full
+PREFIX_MATCH_FACTOR = 0.7
+
+def terms(text):
+    """
+    Index terms of text: lowercased words, plus the parts of camelCase and
+    snake_case identifiers so digitalWrite is found by "write" as well
+    """
+    found = []
+    for word in WORD_RE.findall(text or ''):
+        if len(word) > MAX_TERM_LENGTH:
+            continue
+        parts = [word]
+        if '_' in word or not (word.islower() or word.isupper()):
+            parts.extend(part for piece in word.split('_') for part in CAMEL_RE.findall(piece))
+        for part in dict.fromkeys(part.lower() for part in parts):
+            if len(part) > 1 or part.isdigit():
+                found.append(part)
+    return found
+
+def document_terms(fields):
+    """
+    Weighted term frequencies of a document from (text, weight) fields,
+    limited to the MAX_DOCUMENT_TERMS heaviest terms
+    """
+    weights = Counter()
+    for text, weight in fields:
+        for term in terms(text):
+            weights[term] += weight
+    return dict(weights.most_common(MAX_DOCUMENT_TERMS))
+
+def query_terms(query):
+    """Distinct lowercased query words, at most MAX_QUERY_TERMS"""
+    words = [word.lower() for word in WORD_RE.findall(query or '') if len(word) <= MAX_TERM_LENGTH]
+    return list(dict.fromkeys(words))[:MAX_QUERY_TERMS]
+
+def prefix_range(prefix):
+    """[low, high) bounds of the terms starting with prefix, for an index range scan"""
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+def rank(expansions, postings, document_counts, limit):
+    """
+    Rank documents matching every query word.
+    
+    expansions maps each query word to the index terms it matched,
+    postings maps each of those terms to {(kind, doc_id): weight} and
+    document_counts gives the number of indexed documents per kind. A word
+    contributes the best tf-idf of its terms in the document; terms reached
+    by prefix count for less than an exact match. Returns
+    [(kind, doc_id, score)], best first.
+    """
+    scores = None
+    for word, word_terms in expansions.items():
+        word_scores = {}
+        for term in word_terms:
+            term_postings = postings.get(term, {})
+            factor = 1.0 if term == word else PREFIX_MATCH_FACTOR
+            for key, weight in term_postings.items():
+                total = document_counts.get(key[0], 0)
+                idf = math.log(1 + total / len(term_postings))
+                score = factor * (1 + math.log(weight)) * idf
+                if score > word_scores.get(key, 0):
+                    word_scores[key] = score
+        
+        if scores is None:
+            scores = word_scores
+        else:
+            scores = {key: score + word_scores[key] for key, score in scores.items() if key in word_scores}
+        if not scores:
+            return []
+    
+    ranked = sorted((scores or {}).items(), key=lambda item: -item[1])[:limit]
+    return [(kind, doc_id, score) for (kind, doc_id), score in ranked]
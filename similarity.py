@@ -0,0 +1,90 @@
+import hashlib
+import keyword
+import re
+import zlib
+import numpy as np
+
+# MinHash signature length and its split into LSH bands. 32 bands of 4 rows
+# make pairs above roughly 0.45 Jaccard similarity likely to share a bucket
+NUM_PERM = 128
+BANDS = 32
+ROWS_PER_BAND = NUM_PERM // BANDS
+SHINGLE_SIZE = 5
+
+# Fixed hash parameters, so signatures stay comparable across processes.
+# a < 2**31 keeps a * x + b inside uint64 for 32-bit shingle hashes
+PRIME = 4294967291
+_rng = np.random.default_rng(20240601)
+_A = _rng.integers(1, 2 ** 31, NUM_PERM, dtype=np.uint64)
+_B = _rng.integers(0, 2 ** 31, NUM_PERM, dtype=np.uint64)
+
+TOKEN_RE = re.compile(r'''
+    (?P<string>"(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')
+  | (?P<comment>\#[^\n]*|//[^\n]*|/\*.*?\*/)
+  | (?P<number>\d+(?:\.\d+)?)
+  | (?P<name>[A-Za-z_]\w*)
+  | (?P<symbol>\S)
+''', re.VERBOSE | re.DOTALL)
+
+# Names kept as-is; every other identifier is normalized so renaming
+# variables does not hide a copy
+KEEP_NAMES = set(keyword.kwlist) | {
+    'print', 'input', 'range', 'len', 'int', 'float', 'str', 'list', 'dict', 'set',
+    'void', 'char', 'bool', 'long', 'double', 'const', 'return', 'if', 'else',
+    'for', 'while', 'do', 'switch', 'case', 'break', 'continue',
+    'setup', 'loop', 'pinMode', 'digitalWrite', 'digitalRead', 'analogWrite',
+    'analogRead', 'delay', 'millis', 'Serial', 'begin', 'println',
+    'HIGH', 'LOW', 'INPUT', 'OUTPUT', 'INPUT_PULLUP'
+}
+
+def tokenize(code):
+    """Normalized token stream of code: comments dropped, literals and names generalized"""
+    tokens = []
+    for match in TOKEN_RE.finditer(code or ''):
+        kind = match.lastgroup
+        if kind == 'comment':
+            continue
+        if kind == 'string':
+            tokens.append('S')
+        elif kind == 'number':
+            tokens.append('N')
+        elif kind == 'name':
+            value = match.group()
+            tokens.append(value if value in KEEP_NAMES else 'V')
+        else:
+            tokens.append(match.group())
+    return tokens
+
+def shingle_hashes(tokens):
+    """32-bit hashes of the overlapping SHINGLE_SIZE-token windows"""
+    size = min(SHINGLE_SIZE, len(tokens))
+    shingles = {' '.join(tokens[i:i + size]) for i in range(len(tokens) - size + 1)} if size else set()
+    return np.fromiter((zlib.crc32(shingle.encode('utf-8')) for shingle in shingles),
+                       dtype=np.uint64, count=len(shingles))
+
+def signature(tokens):
+    """MinHash signature (NUM_PERM uint32 values) of a token stream"""
+    hashes = shingle_hashes(tokens)
+    if not len(hashes):
+        return np.full(NUM_PERM, PRIME, dtype=np.uint32)
+    permuted = (np.outer(hashes, _A) + _B) % PRIME
+    return permuted.min(axis=0).astype(np.uint32)
+
+def band_hashes(sig):
+    """One bucket key per LSH band, as signed 63-bit integers for a BIGINT column"""
+    keys = []
+    for band in range(BANDS):
+        chunk = sig[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND].tobytes()
+        digest = hashlib.blake2b(chunk, digest_size=8).digest()
+        keys.append(int.from_bytes(digest, 'big') >> 1)
+    return keys
+
+def similarity(first, second):
+    """Estimated Jaccard similarity of two signatures"""
+    return float(np.mean(first == second))
+
+def to_bytes(sig):
+    return sig.astype('<u4').tobytes()
+
+def from_bytes(data):
+    return np.frombuffer(data, dtype='<u4')
@@ -1,8 +1,13 @@
 import jwt
 from datetime import datetime, timedelta
 from config import Config
+from models import Student, Teacher
 import pandas as pd
-from io import BytesIO
+from openpyxl import Workbook
+import csv
+import io
+import tempfile
+import zlib
 import bcrypt
 
 def create_token(user_id, user_type):
@@ -28,98 +33,139 @@ def hash_password(password):
 def check_password(password, hashed):
     return bcrypt.checkpw(password.encode('utf-8'), hashed)
 
-def generate_student_id(campus, sequence):
-    campus_prefix = {
-        'Subhash Nagar': 'SUB',
-        'Yamuna': 'YAM', 
-        'I20': 'I20'
-    }.get(campus, 'STD')
+CAMPUS_PREFIXES = {
+    'Subhash Nagar': 'SUB',
+    'Yamuna': 'YAM', 
+    'I20': 'I20'
+}
+
+def generate_student_id(campus, sequence=None):
+    campus_prefix = CAMPUS_PREFIXES.get(campus, 'STD')
+    if sequence is None:
+        sequence = Student.reserve_sequence(campus_prefix)
     return f"{campus_prefix}-{sequence:03d}"
 
-def generate_teacher_id(campus, sequence):
-    campus_prefix = {
-        'Subhash Nagar': 'SUB',
-        'Yamuna': 'YAM', 
-        'I20': 'I20'
-    }.get(campus, 'TCH')
+def generate_teacher_id(campus, sequence=None):
+    campus_prefix = CAMPUS_PREFIXES.get(campus, 'TCH')
+    if sequence is None:
+        sequence = Teacher.reserve_sequence(campus_prefix)
     return f"{campus_prefix}-T{sequence:03d}"
 
-def export_students_to_excel(students):
-    # Create DataFrame with student data including passwords
-    student_data = []
-    for s in students:
-        student_data.append({
-            'studentID': s['studentID'],
-            'name': s['name'],
-            'campus': s['campus'],
-            'grade': s['grade'],
-            'section': s.get('section', ''),
-            'password': '123456'  # Default password for all students
-        })
+def reserve_student_ids(campus, count):
+    """Reserve a block of count student IDs for a campus with one allocation"""
+    if count <= 0:
+        return []
+    campus_prefix = CAMPUS_PREFIXES.get(campus, 'STD')
+    first = Student.reserve_sequence(campus_prefix, count)
+    return [generate_student_id(campus, first + offset) for offset in range(count)]
+
+STUDENT_EXPORT_HEADERS = ['studentID', 'name', 'campus', 'grade', 'section', 'password']
+TEACHER_EXPORT_HEADERS = ['teacherID', 'name', 'email', 'campus', 'password']
+
+STUDENT_EXPORT_INFO = [
+    'This file contains student login credentials',
+    'All students have default password: 123456',
+    'Students should change their password after first login',
+    'Keep this file secure and do not share publicly'
+]
+
+TEACHER_EXPORT_INFO = [
+    'This file contains teacher login credentials',
+    'All teachers have default password: 123456',
+    'Teachers should change their password after first login',
+    'Keep this file secure and do not share publicly'
+]
+
+# Rows are buffered this many at a time before a CSV chunk is yielded
+EXPORT_CHUNK_ROWS = 500
+
+def student_export_row(s):
+    # Default password for all students
+    return [s['studentID'], s['name'], s['campus'], s['grade'], s.get('section') or '', '123456']
+
+def teacher_export_row(t):
+    # Default password for all teachers
+    return [t['teacherID'], t['name'], t.get('email') or '', t['campus'], '123456']
+
+def write_xlsx_export(sheet_name, headers, rows, info_lines):
+    """
+    Write rows into a write-only workbook backed by a temporary file.
     
-    df = pd.DataFrame(student_data)
+    openpyxl's write-only mode spools each worksheet to disk as rows are
+    appended, so memory stays flat however many rows the iterator yields.
+    The returned file is positioned at the start, ready for send_file.
+    """
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(sheet_name)
+    sheet.append(headers)
+    for row in rows:
+        sheet.append(row)
     
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, sheet_name='Students', index=False)
-        
-        # Add a info sheet with instructions
-        info_data = {
-            'Information': [
-                'This file contains student login credentials',
-                'All students have default password: 123456',
-                'Students should change their password after first login',
-                'Keep this file secure and do not share publicly'
-            ]
-        }
-        info_df = pd.DataFrame(info_data)
-        info_df.to_excel(writer, sheet_name='Instructions', index=False)
+    # Add a info sheet with instructions
+    info_sheet = workbook.create_sheet('Instructions')
+    info_sheet.append(['Information'])
+    for line in info_lines:
+        info_sheet.append([line])
     
+    output = tempfile.TemporaryFile()
+    workbook.save(output)
     output.seek(0)
     return output
 
-def export_teachers_to_excel(teachers):
-    # Create DataFrame with teacher data including passwords
-    teacher_data = []
-    for t in teachers:
-        teacher_data.append({
-            'teacherID': t['teacherID'],
-            'name': t['name'],
-            'email': t['email'],
-            'campus': t['campus'],
-            'password': '123456'  # Default password for all teachers
-        })
+def iter_csv_export(headers, rows, compress=False):
+    """
+    Yield a CSV document in byte chunks of EXPORT_CHUNK_ROWS rows.
     
-    df = pd.DataFrame(teacher_data)
+    With compress=True the chunks form a single gzip stream.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
     
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, sheet_name='Teachers', index=False)
-        
-        # Add a info sheet with instructions
-        info_data = {
-            'Information': [
-                'This file contains teacher login credentials',
-                'All teachers have default password: 123456',
-                'Teachers should change their password after first login',
-                'Keep this file secure and do not share publicly'
-            ]
-        }
-        info_df = pd.DataFrame(info_data)
-        info_df.to_excel(writer, sheet_name='Instructions', index=False)
+    def drain():
+        data = buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate(0)
+        return compressor.compress(data) if compressor else data
     
-    output.seek(0)
-    return output
+    writer.writerow(headers)
+    pending = 0
+    for row in rows:
+        writer.writerow(row)
+        pending += 1
+        if pending >= EXPORT_CHUNK_ROWS:
+            chunk = drain()
+            if chunk:
+                yield chunk
+            pending = 0
+    
+    chunk = drain()
+    if compressor:
+        chunk += compressor.flush()
+    if chunk:
+        yield chunk
+
+def export_students_to_excel(students):
+    rows = (student_export_row(s) for s in students)
+    return write_xlsx_export('Students', STUDENT_EXPORT_HEADERS, rows, STUDENT_EXPORT_INFO)
+
+def export_teachers_to_excel(teachers):
+    rows = (teacher_export_row(t) for t in teachers)
+    return write_xlsx_export('Teachers', TEACHER_EXPORT_HEADERS, rows, TEACHER_EXPORT_INFO)
 
 def import_students_from_excel(file):
     try:
         df = pd.read_excel(file)
-        students = []
         
+        # Reserve one block of IDs per campus instead of one allocation per row
+        campus_counts = df['campus'].value_counts()
+        campus_ids = {campus: iter(reserve_student_ids(campus, int(count)))
+                      for campus, count in campus_counts.items()}
+        
+        students = []
         for idx, row in df.iterrows():
-            student_id = generate_student_id(row['campus'], idx + 1)
             student = {
-                'studentID': student_id,
+                'studentID': next(campus_ids[row['campus']]),
                 'name': row['name'],
                 'campus': row['campus'],
                 'grade': row['grade'],